@@ -52,8 +52,8 @@ class ChatMessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ChatMessage
-        fields = ['id', 'room', 'sender', 'content', 'media', 'media_url', 'timestamp', 'receipts', 'delivered', 'delivered_at', 'read', 'read_at']
-        read_only_fields = ['id', 'sender', 'timestamp']
+        fields = ['id', 'seq', 'client_msg_id', 'room', 'sender', 'content', 'media', 'media_url', 'timestamp', 'receipts', 'delivered', 'delivered_at', 'read', 'read_at']
+        read_only_fields = ['id', 'seq', 'client_msg_id', 'sender', 'timestamp']
 
     def get_media_url(self, obj):
         if obj.media:
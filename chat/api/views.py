@@ -4,7 +4,7 @@ from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import get_user_model
 import logging
 from rest_framework.decorators import action
-from django.db import DatabaseError, IntegrityError, DataError
+from django.db import DatabaseError, IntegrityError, DataError, transaction
 
 from chat.models import ChatRoom, ChatMessage, get_or_create_private_chat, ChatMessageReceipt
 from chat.api.serializers import ChatRoomSerializer, ChatMessageSerializer
@@ -157,6 +157,9 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
 
         try:
             out = self.perform_create(serializer)
+            if isinstance(out, dict) and out.get('duplicate'):
+                # retried send: the message already exists and was not re-broadcast
+                return Response(out, status=status.HTTP_200_OK)
             headers = self.get_success_headers(serializer.data)
             # prefer returning the explicit payload built in perform_create
             return Response(out or serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -178,7 +181,33 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             qs = qs.filter(room_id=room_id)
         return qs
 
+    def _replay_payload(self, message):
+        """Payload returned for a retried send that matched an existing message."""
+        out = dict(ChatMessageSerializer(message, context={'request': self.request}).data)
+        out.update({
+            'type': 'chat.message',
+            'message_id': message.id,
+            'room_id': str(message.room_id),
+            'duplicate': True,
+        })
+        return out
+
     def perform_create(self, serializer):
+        # Idempotent retries: a (sender, client_msg_id) pair that was already
+        # stored returns the existing message without creating media, receipts
+        # or broadcasting again.
+        client_msg_id = None
+        try:
+            client_msg_id = self.request.data.get('client_msg_id') or self.request.data.get('clientMsgId')
+        except Exception:
+            client_msg_id = None
+        client_msg_id = str(client_msg_id)[:64] if client_msg_id else None
+        if client_msg_id:
+            existing = ChatMessage.objects.filter(sender=self.request.user, client_msg_id=client_msg_id).first()
+            if existing is not None:
+                logging.getLogger(__name__).info('[HTTP_RETRY] message id=%s client_msg_id=%s', existing.id, client_msg_id)
+                return self._replay_payload(existing)
+
         # If client provided a direct media_url (uploaded by client to Supabase
         # or other storage), create a Media record first so the ChatMessage can
         # be created with a proper FK and outgoing broadcasts include media_url.
@@ -203,7 +232,14 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             logging.getLogger(__name__).exception('pre-create media_url handling failed')
 
         # Save message with sender context
-        saved = serializer.save(sender=self.request.user)
+        try:
+            with transaction.atomic():
+                saved = serializer.save(sender=self.request.user, client_msg_id=client_msg_id)
+        except IntegrityError:
+            existing = ChatMessage.objects.filter(sender=self.request.user, client_msg_id=client_msg_id).first() if client_msg_id else None
+            if existing is None:
+                raise
+            return self._replay_payload(existing)
 
         try:
             # Ensure per-user receipts exist for all participants except sender
@@ -239,11 +275,12 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 'sender_id': getattr(saved.sender, 'id', None),
                 'media_id': getattr(getattr(saved, 'media', None), 'id', None),
                 'media_url': getattr(getattr(saved, 'media', None), 'url', None),
-                # If Media.description stores JSON-encoded spectrum or metadata, surface it
+                # compact spectrum stored on Media (see media/spectrum.py)
                 'media_spectrum': None,
                 'message_id': saved.id,
                 'id': saved.id,
-                'client_msg_id': getattr(self.request, 'data', {}).get('client_msg_id', None),
+                'seq': saved.seq,
+                'client_msg_id': saved.client_msg_id,
                 'room_id': str(saved.room_id),
                 'timestamp': saved.timestamp.isoformat() if getattr(saved, 'timestamp', None) else None,
                 'receipts': receipts,
@@ -259,36 +296,8 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 except Exception:
                     pass
                 if media_obj:
-                    desc = getattr(media_obj, 'description', None)
-                    try:
-                        logging.getLogger(__name__).debug('Media description for media_id=%s repr: %s', getattr(media_obj, 'id', None), (repr(desc)[:200] + ('...' if desc and len(str(desc)) > 200 else '')) )
-                    except Exception:
-                        pass
-                    if desc:
-                        import json as _json
-                        try:
-                            parsed = _json.loads(desc) if isinstance(desc, (str, bytes)) else desc
-                            # parsed may be a plain list of bins or a dict containing the spectrum
-                            if isinstance(parsed, list):
-                                out['media_spectrum'] = parsed
-                            elif isinstance(parsed, dict):
-                                # common keys to check
-                                for k in ('spectrum', 'media_spectrum', 'audio_spectrum', 'bins'):
-                                    if k in parsed and isinstance(parsed[k], list):
-                                        out['media_spectrum'] = parsed[k]
-                                        break
-                                else:
-                                    # last resort: try to find first list value
-                                    found = None
-                                    for v in parsed.values():
-                                        if isinstance(v, list):
-                                            found = v
-                                            break
-                                    out['media_spectrum'] = found
-                            else:
-                                out['media_spectrum'] = None
-                        except Exception:
-                            out['media_spectrum'] = None
+                    # spectrum is parsed once when the Media is saved
+                    out['media_spectrum'] = media_obj.spectrum_values()
                 try:
                     if out.get('media_id') is not None:
                         logging.getLogger(__name__).info('HTTP create broadcast payload media debug: media_id=%s media_url=%s media_spectrum=%s', out.get('media_id'), out.get('media_url'), (out.get('media_spectrum') and ('len=%d' % len(out.get('media_spectrum'))) or None))
@@ -317,11 +326,12 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                         'type': 'chat_message_direct',
                         'message_id': saved.id,
                         'id': saved.id,
+                        'seq': saved.seq,
                         'sender_id': getattr(saved.sender, 'id', None),
                         'text': saved.content or '',
                         'message': saved.content or '',
                         'room_id': str(saved.room_id),
-                        'client_msg_id': getattr(self.request, 'data', {}).get('client_msg_id', None),
+                        'client_msg_id': saved.client_msg_id,
                     }
                     logging.getLogger(__name__).info('[HTTP_BCAST] chat_message_direct -> room=%s payload=%s', saved.room_id, direct_payload)
                     for pid in participant_ids:
@@ -341,7 +351,7 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                         # created a local message can match incoming updates
                         # (handles the race where an update arrives before
                         # the full message_new payload).
-                        'client_msg_id': getattr(self.request, 'data', {}).get('client_msg_id', None),
+                        'client_msg_id': saved.client_msg_id,
                         # include minimal text so the client can display a
                         # lightweight representation if the full message
                         # payload hasn't arrived yet.
@@ -409,7 +419,21 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         # Prefetch receipts to avoid N+1 queries and ensure the serializer
         # can include per-message receipts so the client sees persisted ticks
         # after reloads.
+        # Gap fill: with ?after_seq=N return only messages newer than the
+        # client's last seen sequence number (oldest first).
+        after_seq = request.query_params.get('after_seq')
+        if after_seq in ('', 'null', 'undefined'):
+            after_seq = None
+        if after_seq is not None:
+            try:
+                after_seq = int(after_seq)
+            except (TypeError, ValueError):
+                return Response({'detail': "'after_seq' debe ser numérico."}, status=status.HTTP_400_BAD_REQUEST)
         try:
+            if after_seq is not None:
+                messages = ChatMessage.objects.filter(room=room, seq__gt=after_seq).order_by('seq').prefetch_related('receipts')[:limit]
+                serializer = ChatMessageSerializer(messages, many=True, context={'request': request})
+                return Response(serializer.data)
             messages_qs = ChatMessage.objects.filter(room=room).order_by('-timestamp').prefetch_related('receipts')[:limit]
             # los devolvemos en orden cronológico ascendente
             messages = reversed(list(messages_qs))
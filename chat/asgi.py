@@ -12,6 +12,7 @@ from django.core.asgi import get_asgi_application
 # consulta por token es opcional: si su import falla haremos un fallback
 # que no interfiere con la autenticación por sesión/default.
 import chat.routing
+from tools.middleware.websocket import WebSocketMetricsMiddleware
 
 try:
     from .middleware import QueryAuthMiddlewareStack
@@ -23,6 +24,8 @@ except Exception:
 websocket_app = AuthMiddlewareStack(URLRouter(chat.routing.websocket_urlpatterns))
 if QueryAuthMiddlewareStack:
     websocket_app = QueryAuthMiddlewareStack(websocket_app)
+# Métricas de handshake, latencia por handler y bytes salientes (/api/metrics/ws/)
+websocket_app = WebSocketMetricsMiddleware(websocket_app)
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
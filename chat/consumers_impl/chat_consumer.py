@@ -7,16 +7,21 @@ requests it. It also broadcasts lightweight events for clients to update
 UI ticks.
 """
 import logging
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.utils import timezone
 
-from chat.models import ChatMessage, ChatMessageReceipt, ChatRoom
+from chat.models import ChatMessage, ChatMessageReceipt, ChatRoom, get_or_create_message
+from .helpers import _get_room_changes
+from .helpers_preview import prepare_preview, load_preview, encode_data_url
+from tools.middleware.websocket import TimedDispatchMixin
 
 logger = logging.getLogger(__name__)
 
 
-class ChatConsumer(AsyncJsonWebsocketConsumer):
+class ChatConsumer(TimedDispatchMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
         user = self.scope.get('user')
         if not user or not getattr(user, 'is_authenticated', False):
@@ -26,6 +31,14 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         self.user = user
         self.room_id = self.scope.get('url_route', {}).get('kwargs', {}).get('room_id')
         self.room_group_name = f'chat_{self.room_id}'
+        # Clients opt into receiving previews as binary frames with
+        # ?binary_previews=1; everyone else gets an inline data URL.
+        try:
+            qs = parse_qs(self.scope.get('query_string', b'').decode())
+        except Exception:
+            qs = {}
+        self.binary_previews = (qs.get('binary_previews') or ['0'])[0] in ('1', 'true')
+        self._pending_preview = None
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.channel_layer.group_add(f'user_{getattr(user, "id")}', self.channel_name)
@@ -44,6 +57,18 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             logger.exception('group_discard user failed')
         logger.info('[DISCONNECT] user=%s left room=%s', getattr(self.user, 'id', None), self.room_id)
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # Binary frames carry the raw bytes of a preview announced by a
+        # preceding JSON 'preview' frame with "binary": true.
+        if bytes_data is not None and text_data is None:
+            pending, self._pending_preview = self._pending_preview, None
+            if pending is None:
+                logger.warning('[PREVIEW] binary frame without pending preview header user=%s', getattr(self.user, 'id', None))
+                return
+            await self.handle_preview(pending, raw=bytes_data)
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
     async def receive_json(self, content, **kwargs):
         try:
             logger.debug('[RECEIVE_JSON] user=%s payload=%s', getattr(self.user, 'id', None), content)
@@ -55,47 +80,114 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             # lightweight preview to the room so other connected clients can display
             # a thumbnail immediately while the upload finishes on the sender side.
             elif event_type in ('chat.message', 'preview_message', 'preview'):
-                # Only accept preview messages that include a preview_data_url or a previewUrl
-                try:
-                    if not (content.get('preview_data_url') or content.get('previewUrl') or content.get('preview_url')):
-                        logger.debug('[RECEIVE_JSON] preview event ignored, missing preview field')
-                    else:
-                        # build a normalized preview payload and broadcast to room group
-                        room_id = content.get('room_id') or self.room_id
-                        preview_msg = {
-                            'id': content.get('id') or content.get('temp_id') or f'tmp_{int(timezone.now().timestamp()*1000)}',
-                            'client_msg_id': content.get('client_msg_id') or content.get('clientMsgId') or None,
-                            'sender_id': getattr(self.user, 'id', None),
-                            'preview_data_url': content.get('preview_data_url') or content.get('previewUrl') or content.get('preview_url'),
-                            'media_type': content.get('media_type') or content.get('mediaType') or None,
-                            'media_uploading': True,
-                            'status': 'uploading',
-                            'room': room_id,
-                            'room_id': room_id,
-                            'timestamp': content.get('timestamp') or timezone.now().isoformat(),
-                        }
-                        # Broadcast as a lightweight event; consumers will handle preview_message
-                        group_name = f'chat_{room_id}'
-                        await self.channel_layer.group_send(group_name, {
-                            'type': 'preview_message',
-                            'message': preview_msg,
-                            'room_id': room_id,
-                        })
-                        logger.info('[PREVIEW_BCAST] rebroadcast preview to room=%s sender=%s', room_id, getattr(self.user, 'id', None))
-                except Exception:
-                    logger.exception('receive_json: failed handling preview event')
+                await self.handle_preview(content)
             elif event_type == 'mark_read':
                 await self.mark_messages_read(content)
+            elif event_type == 'resync':
+                await self.resync(content)
             else:
                 logger.warning('[UNKNOWN_EVENT] %s', event_type)
         except Exception:
             logger.exception('receive_json handling failed')
 
+    async def resync(self, content):
+        """Gap fill for reconnecting clients.
+
+        The client sends its last seen ``last_seq`` (or ``last_message_id``)
+        and ``receipts_since`` watermark; the reply only carries newer
+        messages and receipts that changed since then. Clients loop while
+        ``has_more`` or ``receipts_has_more`` is true, sending back the
+        returned ``last_seq``, ``receipts_watermark`` and ``receipts_after_id``.
+        """
+        after_seq = content.get('last_seq', content.get('after_seq'))
+        try:
+            diff = await _get_room_changes(
+                self.room_id,
+                getattr(self.user, 'id', None),
+                after_seq=after_seq,
+                after_message_id=content.get('last_message_id'),
+                receipts_since=content.get('receipts_since') or content.get('receipts_watermark'),
+                limit=content.get('limit'),
+                receipts_after_id=content.get('receipts_after_id'),
+            )
+        except Exception:
+            logger.exception('resync: _get_room_changes failed')
+            diff = None
+        if diff is None:
+            await self.send_json({'type': 'resync_error', 'room_id': self.room_id})
+            return
+        logger.info('[RESYNC] user=%s room=%s after_seq=%s messages=%s receipts=%s', getattr(self.user, 'id', None), self.room_id, diff.get('after_seq'), len(diff['messages']), len(diff['receipts']))
+        await self.send_json(dict(diff, type='resync'))
+
+    async def handle_preview(self, content, raw=None):
+        """Validate a client preview and rebroadcast it to the room by key.
+
+        The preview is capped, optionally downscaled and stored in the cache
+        so the channel layer only carries a short key; each receiving
+        consumer resolves it in ``preview_message``.
+        """
+        try:
+            data_url = content.get('preview_data_url') or content.get('previewUrl') or content.get('preview_url')
+            if raw is None and not data_url:
+                if content.get('binary'):
+                    # header for a binary preview frame that follows
+                    self._pending_preview = content
+                else:
+                    logger.debug('[RECEIVE_JSON] preview event ignored, missing preview field')
+                return
+
+            temp_id = content.get('id') or content.get('temp_id') or f'tmp_{int(timezone.now().timestamp()*1000)}'
+            client_msg_id = content.get('client_msg_id') or content.get('clientMsgId') or None
+            if raw is not None:
+                preview, error = await sync_to_async(prepare_preview)(raw=raw, mime=content.get('mime') or content.get('media_type'))
+            else:
+                preview, error = await sync_to_async(prepare_preview)(data_url=data_url)
+            if error:
+                logger.info('[PREVIEW_REJECTED] user=%s reason=%s', getattr(self.user, 'id', None), error)
+                await self.send_json({
+                    'type': 'preview_error',
+                    'id': temp_id,
+                    'client_msg_id': client_msg_id,
+                    'error': error,
+                })
+                return
+
+            # build a normalized preview payload and broadcast to room group
+            room_id = content.get('room_id') or self.room_id
+            preview_msg = {
+                'id': temp_id,
+                'client_msg_id': client_msg_id,
+                'sender_id': getattr(self.user, 'id', None),
+                'media_type': content.get('media_type') or content.get('mediaType') or None,
+                'media_uploading': True,
+                'status': 'uploading',
+                'room': room_id,
+                'room_id': room_id,
+                'timestamp': content.get('timestamp') or timezone.now().isoformat(),
+            }
+            preview_msg.update(preview)
+            # Broadcast as a lightweight event; consumers will handle preview_message
+            group_name = f'chat_{room_id}'
+            await self.channel_layer.group_send(group_name, {
+                'type': 'preview_message',
+                'message': preview_msg,
+                'room_id': room_id,
+            })
+            logger.info('[PREVIEW_BCAST] rebroadcast preview to room=%s sender=%s size=%s', room_id, getattr(self.user, 'id', None), preview.get('preview_size'))
+        except Exception:
+            logger.exception('receive_json: failed handling preview event')
+
     async def create_message(self, content):
-        """Create a ChatMessage and per-user receipts, then broadcast."""
+        """Create a ChatMessage and per-user receipts, then broadcast.
+
+        Sends carrying a ``client_msg_id`` are idempotent per sender: a retry
+        of an already stored message is acknowledged to the sender only and
+        is not broadcast again.
+        """
         user = self.user
         room_id = content.get('room_id') or self.room_id
         text = content.get('text', '')
+        client_msg_id = content.get('client_msg_id') or content.get('clientMsgId') or None
         try:
             room = await database_sync_to_async(ChatRoom.objects.get)(id=room_id)
         except Exception:
@@ -103,11 +195,31 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             return
 
         try:
-            msg = await database_sync_to_async(ChatMessage.objects.create)(room=room, sender=user, content=text)
+            msg, created = await database_sync_to_async(get_or_create_message)(room, user, client_msg_id=client_msg_id, content=text)
         except Exception:
             logger.exception('create_message: failed saving message')
             return
 
+        if not created:
+            logger.info('[MESSAGE_RETRY] id=%s sender=%s client_msg_id=%s', msg.id, user.id, client_msg_id)
+            try:
+                await self.send_json({
+                    'type': 'chat.message',
+                    'id': msg.id,
+                    'message_id': msg.id,
+                    'seq': msg.seq,
+                    'sender_id': user.id,
+                    'text': msg.content,
+                    'status': 'sent',
+                    'duplicate': True,
+                    'client_msg_id': msg.client_msg_id,
+                    'room': str(msg.room_id),
+                    'room_id': str(msg.room_id),
+                })
+            except Exception:
+                logger.exception('create_message: failed acknowledging retry')
+            return
+
         # create receipts for each participant except sender
         try:
             participants = await database_sync_to_async(lambda: list(room.participants.all()))()
@@ -120,7 +232,7 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         except Exception:
             logger.exception('create_message: failed creating receipts')
 
-        logger.info('[MESSAGE_CREATED] id=%s sender=%s room=%s', msg.id, user.id, room_id)
+        logger.info('[MESSAGE_CREATED] id=%s seq=%s sender=%s room=%s', msg.id, msg.seq, user.id, room_id)
 
         # Broadcast the message to the room
         try:
@@ -129,11 +241,12 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                 # Use underscore type to match legacy consumers that expect 'chat_message'
                 'type': 'chat_message',
                 'message_id': msg.id,
+                'seq': msg.seq,
                 'sender_id': user.id,
                 'text': text,
                 'room_id': room_id,
                 'room': room_id,
-                'client_msg_id': getattr(self.scope.get('query_string', b''), 'decode', lambda: None)(),
+                'client_msg_id': msg.client_msg_id,
             }
             # Log the outgoing payload for traceability
             logger.info('[BCAST_OUT] chat.message -> room=%s payload=%s', room_id, out_payload)
@@ -210,7 +323,7 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             }
             # Preserve optional media/preview/client identifiers if present on the event
             try:
-                for key in ('media_id', 'media_url', 'media_spectrum', 'client_msg_id', 'clientMsgId', 'message', 'content', 'preview_data_url', 'previewUrl'):
+                for key in ('seq', 'media_id', 'media_url', 'media_spectrum', 'client_msg_id', 'clientMsgId', 'message', 'content', 'preview_data_url', 'previewUrl'):
                     if key in event and event.get(key) is not None:
                         out_payload[key] = event.get(key)
             except Exception:
@@ -227,9 +340,21 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         payload to the connected client without persisting or marking receipts.
         This is used when a sender emits a temporary preview (preview_data_url)
         while the actual file upload is in progress.
+
+        The event only carries a cache key; the bytes are resolved here and
+        written either inline as a data URL or, for clients connected with
+        ``?binary_previews=1``, as a binary frame right after the JSON header.
         """
         try:
-            msg = event.get('message') or {}
+            msg = dict(event.get('message') or {})
+            stored = await sync_to_async(load_preview)(msg.get('preview_key')) if msg.get('preview_key') else None
+            binary = None
+            if stored is not None:
+                if self.binary_previews:
+                    msg['preview_binary'] = True
+                    binary = stored.get('data')
+                else:
+                    msg['preview_data_url'] = encode_data_url(stored.get('mime'), stored.get('data'))
             # send as a consistent 'chat.message' payload so JS clients handle it
             await self.send_json({
                 'type': 'chat.message',
@@ -237,6 +362,8 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                 'room': event.get('room_id') or msg.get('room') or None,
                 'room_id': event.get('room_id') or msg.get('room') or None,
             })
+            if binary:
+                await self.send(bytes_data=binary)
             logger.debug('[PREVIEW_SEND] forwarded preview to user=%s msg=%s', getattr(self.user, 'id', None), msg.get('id'))
         except Exception:
             logger.exception('preview_message: send_json failed')
@@ -439,6 +566,13 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         except Exception:
             logger.exception('chat_delivery: send_json failed')
 
+    async def notification_new(self, event):
+        """Forum notification pushed to the user_<id> group (foro.notifications)."""
+        try:
+            await self.send_json(dict(event, type='notification.new'))
+        except Exception:
+            logger.exception('notification_new: send_json failed')
+
     async def message_delivered(self, event):
         try:
             # forward as-is but include a friendly type for JS listeners
@@ -474,7 +608,7 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                 'room_id': event.get('room_id') or event.get('room'),
             }
             try:
-                for key in ('media_id', 'media_url', 'media_spectrum', 'client_msg_id', 'clientMsgId', 'message', 'content', 'preview_data_url', 'previewUrl'):
+                for key in ('seq', 'media_id', 'media_url', 'media_spectrum', 'client_msg_id', 'clientMsgId', 'message', 'content', 'preview_data_url', 'previewUrl'):
                     if key in event and event.get(key) is not None:
                         out[key] = event.get(key)
             except Exception:
@@ -9,6 +9,7 @@ from .helpers_db import (
     _participants_list_from_room,
     _get_room_participant_ids,
     _get_room_messages,
+    _get_room_changes,
     _get_room_participants,
     _get_rooms_for_user,
     _get_undelivered_messages_for_user,
@@ -34,6 +35,7 @@ __all__ = [
     '_participants_list_from_room',
     '_get_room_participant_ids',
     '_get_room_messages',
+    '_get_room_changes',
     '_get_room_participants',
     '_get_rooms_for_user',
     '_get_undelivered_messages_for_user',
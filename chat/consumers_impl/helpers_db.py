@@ -6,7 +6,7 @@ These functions perform synchronous DB operations wrapped with
 import logging
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from chat.models import ChatRoom, ChatMessage
+from chat.models import ChatRoom, ChatMessage, get_or_create_message
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -81,6 +81,8 @@ def _get_room_messages(room_id, limit=200, only_unread_for_user=None):
 
                         msgs.append({
                             'id': m.id,
+                            'seq': m.seq,
+                            'client_msg_id': m.client_msg_id,
                             'sender_id': getattr(m.sender, 'id', None),
                             'content': m.content,
                             'timestamp': m.timestamp.isoformat() if getattr(m, 'timestamp', None) else None,
@@ -101,7 +103,7 @@ def _get_room_messages(room_id, limit=200, only_unread_for_user=None):
             except Exception:
                 logger.exception('failed fetching unread receipts')
 
-        qs = list(room.messages.order_by('-timestamp')[:limit])
+        qs = list(room.messages.select_related('sender', 'media').order_by('-timestamp')[:limit])
         qs.reverse()
         for m in qs:
             receipts_out = []
@@ -119,6 +121,8 @@ def _get_room_messages(room_id, limit=200, only_unread_for_user=None):
 
             msgs.append({
                 'id': m.id,
+                'seq': m.seq,
+                'client_msg_id': m.client_msg_id,
                 'sender_id': getattr(m.sender, 'id', None),
                 'content': m.content,
                 'timestamp': m.timestamp.isoformat() if getattr(m, 'timestamp', None) else None,
@@ -129,30 +133,10 @@ def _get_room_messages(room_id, limit=200, only_unread_for_user=None):
                 'receipts': receipts_out,
             })
             # include media metadata when present for client rendering
-            try:
-                media_obj = getattr(m, 'media', None)
-                if media_obj:
-                    media_desc = getattr(media_obj, 'description', None)
-                    if media_desc:
-                        import json as _json
-                        try:
-                            parsed = _json.loads(media_desc) if isinstance(media_desc, (str, bytes)) else media_desc
-                            if isinstance(parsed, list):
-                                msgs[-1]['media_spectrum'] = parsed
-                            elif isinstance(parsed, dict):
-                                for k in ('spectrum', 'media_spectrum', 'audio_spectrum', 'bins'):
-                                    if k in parsed and isinstance(parsed[k], list):
-                                        msgs[-1]['media_spectrum'] = parsed[k]
-                                        break
-                                else:
-                                    for v in parsed.values():
-                                        if isinstance(v, list):
-                                            msgs[-1]['media_spectrum'] = v
-                                            break
-                        except Exception:
-                            pass
-            except Exception:
-                pass
+            if m.media_id and m.media is not None:
+                spectrum = m.media.spectrum_values()
+                if spectrum:
+                    msgs[-1]['media_spectrum'] = spectrum
 
         participants = _participants_list_from_room(room)
         return {
@@ -167,6 +151,144 @@ def _get_room_messages(room_id, limit=200, only_unread_for_user=None):
         return None
 
 
+def _receipt_payload(r):
+    return {
+        'message_id': r.get('message_id'),
+        'user_id': r.get('user_id'),
+        'delivered': bool(r.get('delivered')),
+        'delivered_at': r['delivered_at'].isoformat() if r.get('delivered_at') else None,
+        'read': bool(r.get('read')),
+        'read_at': r['read_at'].isoformat() if r.get('read_at') else None,
+    }
+
+
+@database_sync_to_async
+def _get_room_changes(room_id, user_id, after_seq=None, after_message_id=None, receipts_since=None,
+                      limit=None, receipts_after_id=None):
+    """Compact diff for a reconnecting client.
+
+    Returns messages with ``seq > after_seq`` (resolved from
+    ``after_message_id`` when the client only knows ids) and receipts of
+    older messages whose delivered/read timestamps moved past
+    ``receipts_since``. Both are indexed range queries, so the cost scales
+    with what the client missed rather than with the room size.
+
+    Both lists are paged. ``last_seq`` is the seq of the last message
+    returned (resume from it while ``has_more``). Receipts are ordered by
+    change time and id; when ``receipts_has_more`` the watermark is the
+    change time of the last receipt returned and ``receipts_after_id`` its
+    id, to be sent back as-is with the next resync.
+    """
+    try:
+        from datetime import timezone as dt_timezone
+        from django.conf import settings
+        from django.db.models import Q
+        from django.db.models.functions import Coalesce, Greatest
+        from django.utils import timezone
+        from django.utils.dateparse import parse_datetime
+        from chat.models import ChatMessageReceipt
+
+        if not ChatRoom.objects.filter(id=room_id, participants__id=user_id).exists():
+            return None
+        max_limit = int(getattr(settings, 'CHAT_RESYNC_LIMIT', 200))
+        try:
+            limit = min(int(limit), max_limit) if limit else max_limit
+        except (TypeError, ValueError):
+            limit = max_limit
+
+        if after_seq is None and after_message_id is not None:
+            after_seq = ChatMessage.objects.filter(id=after_message_id, room_id=room_id).values_list('seq', flat=True).first()
+        after_seq = int(after_seq or 0)
+        # taken before querying so changes racing with this resync are
+        # picked up again by the next one instead of being lost
+        watermark = timezone.now()
+
+        rows = list(
+            ChatMessage.objects.filter(room_id=room_id, seq__gt=after_seq)
+            .select_related('media')
+            .order_by('seq')[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        new_ids = [m.id for m in rows]
+        receipts_by_msg = {}
+        for r in ChatMessageReceipt.objects.filter(message_id__in=new_ids).values('message_id', 'user_id', 'delivered', 'delivered_at', 'read', 'read_at'):
+            receipts_by_msg.setdefault(r['message_id'], []).append(_receipt_payload(r))
+
+        messages = []
+        for m in rows:
+            item = {
+                'id': m.id,
+                'seq': m.seq,
+                'client_msg_id': m.client_msg_id,
+                'sender_id': m.sender_id,
+                'content': m.content,
+                'timestamp': m.timestamp.isoformat() if m.timestamp else None,
+                'receipts': receipts_by_msg.get(m.id, []),
+            }
+            if m.media_id:
+                item['media_id'] = m.media_id
+                item['media_url'] = getattr(m.media, 'url', None)
+                spectrum = m.media.spectrum_values() if m.media is not None else None
+                if spectrum:
+                    item['media_spectrum'] = spectrum
+            messages.append(item)
+
+        receipts = []
+        receipts_has_more = False
+        next_after_id = None
+        since = parse_datetime(receipts_since) if isinstance(receipts_since, str) else receipts_since
+        if since is not None:
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, dt_timezone.utc)
+            try:
+                after_id = int(receipts_after_id) if receipts_after_id is not None else None
+            except (TypeError, ValueError):
+                after_id = None
+            receipt_limit = max_limit * 10
+            changed = (
+                ChatMessageReceipt.objects
+                .filter(message__room_id=room_id, message__seq__lte=after_seq)
+                .annotate(changed_at=Greatest(Coalesce('delivered_at', 'read_at'), Coalesce('read_at', 'delivered_at')))
+            )
+            if after_id is None:
+                changed = changed.filter(Q(delivered_at__gt=since) | Q(read_at__gt=since))
+            else:
+                # resuming a truncated page: same change time, higher id
+                changed = changed.filter(Q(delivered_at__gte=since) | Q(read_at__gte=since)).filter(
+                    Q(changed_at__gt=since) | Q(changed_at=since, id__gt=after_id)
+                )
+            rows_r = list(
+                changed.order_by('changed_at', 'id')
+                .values('id', 'changed_at', 'message_id', 'user_id', 'delivered', 'delivered_at', 'read', 'read_at')[:receipt_limit + 1]
+            )
+            receipts_has_more = len(rows_r) > receipt_limit
+            rows_r = rows_r[:receipt_limit]
+            receipts = [_receipt_payload(r) for r in rows_r]
+            if receipts_has_more:
+                # hold the watermark back so the rest is returned next time
+                watermark = rows_r[-1]['changed_at']
+                next_after_id = rows_r[-1]['id']
+
+        # seq of the page's last message, not the room head: resuming from
+        # the head would skip the messages after this page
+        last_seq = rows[-1].seq if rows else after_seq
+        return {
+            'room_id': str(room_id),
+            'after_seq': after_seq,
+            'last_seq': last_seq,
+            'has_more': has_more,
+            'messages': messages,
+            'receipts': receipts,
+            'receipts_has_more': receipts_has_more,
+            'receipts_watermark': watermark.isoformat(),
+            'receipts_after_id': next_after_id,
+        }
+    except Exception:
+        logger.exception('_get_room_changes failed')
+        return None
+
+
 @database_sync_to_async
 def _get_room_participants(room_id):
     try:
@@ -189,7 +311,7 @@ def _get_rooms_for_user(user_id):
         payload = []
         for r in rooms:
             msgs = []
-            for m in list(r.messages.order_by('timestamp')[:50]):
+            for m in list(r.messages.select_related('sender', 'media').order_by('timestamp')[:50]):
                 receipts_out = []
                 try:
                     for rr in getattr(m, 'receipts', m.receipts.all()):
@@ -202,32 +324,12 @@ def _get_rooms_for_user(user_id):
                         })
                 except Exception:
                     receipts_out = []
-                msgs.append({'id': m.id, 'sender_id': getattr(m.sender, 'id', None), 'content': m.content, 'timestamp': m.timestamp.isoformat() if getattr(m, 'timestamp', None) else None, 'receipts': receipts_out})
+                msgs.append({'id': m.id, 'seq': m.seq, 'client_msg_id': m.client_msg_id, 'sender_id': getattr(m.sender, 'id', None), 'content': m.content, 'timestamp': m.timestamp.isoformat() if getattr(m, 'timestamp', None) else None, 'receipts': receipts_out})
                 # include media metadata for list responses
-                try:
-                    media_obj = getattr(m, 'media', None)
-                    if media_obj:
-                        media_desc = getattr(media_obj, 'description', None)
-                        if media_desc:
-                            import json as _json
-                            try:
-                                parsed = _json.loads(media_desc) if isinstance(media_desc, (str, bytes)) else media_desc
-                                if isinstance(parsed, list):
-                                    msgs[-1]['media_spectrum'] = parsed
-                                elif isinstance(parsed, dict):
-                                    for k in ('spectrum', 'media_spectrum', 'audio_spectrum', 'bins'):
-                                        if k in parsed and isinstance(parsed[k], list):
-                                            msgs[-1]['media_spectrum'] = parsed[k]
-                                            break
-                                    else:
-                                        for v in parsed.values():
-                                            if isinstance(v, list):
-                                                msgs[-1]['media_spectrum'] = v
-                                                break
-                            except Exception:
-                                pass
-                except Exception:
-                    pass
+                if m.media_id and m.media is not None:
+                    spectrum = m.media.spectrum_values()
+                    if spectrum:
+                        msgs[-1]['media_spectrum'] = spectrum
             participants = _participants_list_from_room(r)
             payload.append({'id': str(r.id), 'name': r.name or '', 'participants': participants, 'messages': msgs})
         return payload
@@ -404,7 +506,13 @@ def _get_messages_read_info(message_ids):
 
 
 @database_sync_to_async
-def save_message(user_id, room_id, message):
+def save_message(user_id, room_id, message, with_created=False):
+    """Persist an incoming WS message.
+
+    Payloads carrying ``client_msg_id`` are idempotent per sender. With
+    ``with_created=True`` a ``(message, created)`` tuple is returned so the
+    caller can skip re-broadcasting a retried send.
+    """
     try:
         room = ChatRoom.objects.get(id=room_id)
     except ChatRoom.DoesNotExist:
@@ -418,6 +526,7 @@ def save_message(user_id, room_id, message):
 
     content = None
     media_obj = None
+    client_msg_id = None
     try:
         if isinstance(message, str):
             import json as _json
@@ -426,6 +535,8 @@ def save_message(user_id, room_id, message):
             parsed = message
         content = parsed.get('content') if isinstance(parsed, dict) else str(parsed)
         media_id = parsed.get('media_id') if isinstance(parsed, dict) else None
+        if isinstance(parsed, dict):
+            client_msg_id = parsed.get('client_msg_id') or parsed.get('clientMsgId')
         if media_id:
             try:
                 from media.models import Media
@@ -441,7 +552,10 @@ def save_message(user_id, room_id, message):
     except Exception:
         content = str(message)
 
-    m = ChatMessage.objects.create(room=room, sender=user, content=content or '', media=media_obj)
+    m, created = get_or_create_message(room, user, client_msg_id=client_msg_id, content=content or '', media=media_obj)
+    if not created:
+        logger.info('save_message: retry of ChatMessage id=%s client_msg_id=%s', m.id, client_msg_id)
+        return (m, False) if with_created else m
     try:
         logger.info('Saved ChatMessage id=%s room=%s sender=%s', m.id, room.id, user.id)
     except Exception:
@@ -463,4 +577,4 @@ def save_message(user_id, room_id, message):
                 pass
     except Exception:
         logger.exception('failed to create message receipts')
-    return m
+    return (m, True) if with_created else m
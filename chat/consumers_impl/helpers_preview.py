@@ -0,0 +1,131 @@
+"""Preview helpers for chat consumers.
+
+Senders may emit a temporary thumbnail while the real upload is still in
+progress. Instead of rebroadcasting the client's base64 data URL through
+the channel layer, these helpers enforce a size cap, optionally downscale
+the image with Pillow and park the bytes in the Django cache under a
+short-lived key. Channel-layer events then only carry that key and each
+consumer resolves it right before writing to its own socket.
+"""
+import base64
+import binascii
+import io
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CACHE_PREFIX = 'chat:preview:'
+
+
+def _max_bytes():
+    return int(getattr(settings, 'CHAT_PREVIEW_MAX_BYTES', 512 * 1024))
+
+
+def _thumbnail_px():
+    return int(getattr(settings, 'CHAT_PREVIEW_THUMBNAIL_PX', 320))
+
+
+def _ttl():
+    return int(getattr(settings, 'CHAT_PREVIEW_TTL', 120))
+
+
+def decode_data_url(data_url):
+    """Return ``(mime, raw_bytes)`` for a base64 ``data:`` URL or None."""
+    if not isinstance(data_url, str) or not data_url.startswith('data:'):
+        return None
+    header, sep, payload = data_url.partition(',')
+    if not sep or ';base64' not in header:
+        return None
+    mime = header[5:].split(';')[0] or 'application/octet-stream'
+    try:
+        raw = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return mime, raw
+
+
+def encode_data_url(mime, raw):
+    return 'data:%s;base64,%s' % (mime or 'application/octet-stream', base64.b64encode(raw).decode('ascii'))
+
+
+def make_thumbnail(raw, mime, max_px=None):
+    """Downscale an image so its longest side is at most ``max_px``.
+
+    Returns ``(mime, raw)``. Non-image payloads, images already small
+    enough, or a missing Pillow install are returned unchanged.
+    """
+    max_px = _thumbnail_px() if max_px is None else max_px
+    if Image is None or not max_px or not str(mime or '').startswith('image/'):
+        return mime, raw
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            if max(img.size) <= max_px:
+                return mime, raw
+            img.thumbnail((max_px, max_px))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            out = io.BytesIO()
+            img.save(out, format='JPEG', quality=70, optimize=True)
+            thumb = out.getvalue()
+    except Exception:
+        logger.debug('make_thumbnail: could not downscale preview mime=%s', mime, exc_info=True)
+        return mime, raw
+    # keep the original when re-encoding did not actually save anything
+    if len(thumb) >= len(raw):
+        return mime, raw
+    return 'image/jpeg', thumb
+
+
+def prepare_preview(data_url=None, raw=None, mime=None):
+    """Validate, downscale and store a preview.
+
+    Accepts either a ``data_url`` (JSON frames) or ``raw`` bytes plus
+    ``mime`` (binary frames). Returns ``(preview, error)`` where preview is
+    a dict with ``preview_key``/``preview_mime``/``preview_size`` and, only
+    when the cache is unavailable, an inline ``preview_data_url`` fallback.
+    """
+    limit = _max_bytes()
+    if data_url is not None:
+        # cheap check before decoding: base64 inflates by 4/3
+        if len(data_url) > (limit * 4) // 3 + 128:
+            return None, 'too_large'
+        decoded = decode_data_url(data_url)
+        if decoded is None:
+            return None, 'invalid'
+        mime, raw = decoded
+    if not raw:
+        return None, 'invalid'
+    if len(raw) > limit:
+        return None, 'too_large'
+
+    mime, raw = make_thumbnail(raw, mime)
+    preview = {'preview_mime': mime, 'preview_size': len(raw)}
+    key = uuid.uuid4().hex
+    try:
+        cache.set(PREVIEW_CACHE_PREFIX + key, {'mime': mime, 'data': raw}, timeout=_ttl())
+        preview['preview_key'] = key
+    except Exception:
+        # without a shared cache the (already capped) thumbnail travels inline
+        logger.exception('prepare_preview: cache unavailable, falling back to inline preview')
+        preview['preview_data_url'] = encode_data_url(mime, raw)
+    return preview, None
+
+
+def load_preview(key):
+    """Return ``{'mime': ..., 'data': bytes}`` for a stored preview or None."""
+    if not key:
+        return None
+    try:
+        return cache.get(PREVIEW_CACHE_PREFIX + str(key))
+    except Exception:
+        logger.exception('load_preview failed key=%s', key)
+        return None
@@ -28,12 +28,33 @@ async def handle_received_message(consumer, payload):
     per-user groups, and attempt lightweight delivered marking.
     """
     user = consumer.scope.get('user')
+    created = True
     try:
-        saved = await save_message(getattr(user, 'id'), consumer.room_id, payload)
+        saved, created = await save_message(getattr(user, 'id'), consumer.room_id, payload, with_created=True)
     except Exception:
         logger.exception('save_message failed')
         saved = None
 
+    if saved and not created:
+        # Retried send (same sender + client_msg_id): acknowledge the stored
+        # message to the sender only instead of fanning it out again.
+        try:
+            await consumer.send_json({
+                'type': 'chat.message',
+                'id': saved.id,
+                'message_id': saved.id,
+                'seq': saved.seq,
+                'client_msg_id': saved.client_msg_id,
+                'content': saved.content,
+                'message': saved.content,
+                'sender_id': getattr(user, 'id', None),
+                'room_id': str(consumer.room_id),
+                'duplicate': True,
+            })
+        except Exception:
+            logger.exception('failed acknowledging retried message')
+        return
+
     out = {
         'type': 'chat.message',
         'message': payload.get('content') if isinstance(payload, dict) else str(payload),
@@ -46,6 +67,7 @@ async def handle_received_message(consumer, payload):
     if saved:
         out['message_id'] = saved.id
         out['id'] = saved.id
+        out['seq'] = saved.seq
         out['room_id'] = str(consumer.room_id)
         try:
             out['participants'] = await _get_room_participants(consumer.room_id)
@@ -65,38 +87,8 @@ async def handle_received_message(consumer, payload):
             if media_obj:
                 out['media_id'] = getattr(getattr(saved, 'media', None), 'id', None)
                 out['media_url'] = getattr(getattr(saved, 'media', None), 'url', None)
-                # If the Media record contains a description that encodes spectrum
-                # data (JSON), try to include it for richer client rendering.
-                try:
-                    desc = getattr(media_obj, 'description', None)
-                    if desc:
-                        import json as _json
-                        try:
-                            parsed = _json.loads(desc) if isinstance(desc, (str, bytes)) else desc
-                            if isinstance(parsed, list):
-                                out['media_spectrum'] = parsed
-                            elif isinstance(parsed, dict):
-                                for k in ('spectrum', 'media_spectrum', 'audio_spectrum', 'bins'):
-                                    if k in parsed and isinstance(parsed[k], list):
-                                        out['media_spectrum'] = parsed[k]
-                                        break
-                                else:
-                                    found = None
-                                    for v in parsed.values():
-                                        if isinstance(v, list):
-                                            found = v
-                                            break
-                                    out['media_spectrum'] = found
-                            else:
-                                out['media_spectrum'] = None
-                        except Exception:
-                            out['media_spectrum'] = None
-                    try:
-                        logger.debug('WS saved media description preview media_id=%s repr=%s', getattr(media_obj, 'id', None), (repr(desc)[:200] + ('...' if desc and len(str(desc)) > 200 else '')) )
-                    except Exception:
-                        pass
-                except Exception:
-                    out['media_spectrum'] = None
+                # spectrum is parsed once when the Media is saved
+                out['media_spectrum'] = media_obj.spectrum_values()
         except Exception:
             pass
 
@@ -115,44 +107,21 @@ async def handle_received_message(consumer, payload):
     try:
         if out.get('media_id') is not None and not out.get('media_spectrum'):
             media_id = out.get('media_id')
-            async def _fetch_desc(mid):
-                try:
-                    from media.models import Media as _Media
-                    m = _Media.objects.filter(id=mid).first()
-                    return getattr(m, 'description', None) if m else None
-                except Exception:
-                    return None
 
-            desc = await database_sync_to_async(_fetch_desc)(media_id)
-            if desc:
-                try:
-                    import json as _json
-                    parsed = _json.loads(desc) if isinstance(desc, (str, bytes)) else desc
-                    if isinstance(parsed, list):
-                        out['media_spectrum'] = parsed
-                    elif isinstance(parsed, dict):
-                        for k in ('spectrum', 'media_spectrum', 'audio_spectrum', 'bins'):
-                            if k in parsed and isinstance(parsed[k], list):
-                                out['media_spectrum'] = parsed[k]
-                                break
-                        else:
-                            for v in parsed.values():
-                                if isinstance(v, list):
-                                    out['media_spectrum'] = v
-                                    break
-                    if out.get('media_spectrum'):
-                        try:
-                            logger.info('Recovered media_spectrum from DB for media_id=%s len=%s', media_id, len(out.get('media_spectrum') or []))
-                        except Exception:
-                            pass
-                except Exception:
-                    logger.exception('failed parsing media.description during broadcast recovery')
+            def _fetch_spectrum(mid):
+                from media.models import Media as _Media
+                m = _Media.objects.filter(id=mid).only('id', 'spectrum').first()
+                return m.spectrum_values() if m else None
+
+            spectrum = await database_sync_to_async(_fetch_spectrum)(media_id)
             # re-send updated out to group so late-spectrum is delivered
-            try:
-                if out.get('media_spectrum'):
+            if spectrum:
+                out['media_spectrum'] = spectrum
+                logger.info('Recovered media_spectrum from DB for media_id=%s len=%s', media_id, len(spectrum))
+                try:
                     await consumer.channel_layer.group_send(consumer.room_group_name, out)
-            except Exception:
-                logger.exception('group_send failed on recovered payload')
+                except Exception:
+                    logger.exception('group_send failed on recovered payload')
     except Exception:
         logger.exception('failed defensive media_spectrum recovery')
 
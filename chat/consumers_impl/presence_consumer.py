@@ -9,11 +9,12 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from .helpers import _get_rooms_for_user, _get_undelivered_messages_for_user, _get_room_participant_ids
 from .helpers import _mark_receipt_delivered
 from .helpers_presence import is_online, mark_online, mark_offline
+from tools.middleware.websocket import TimedDispatchMixin
 
 logger = logging.getLogger(__name__)
 
 
-class PresenceConsumer(AsyncWebsocketConsumer):
+class PresenceConsumer(TimedDispatchMixin, AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope.get('user')
         logger.info('Presence connect attempt user=%r channel=%s', user, self.channel_name)
@@ -134,3 +135,10 @@ class PresenceConsumer(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps(event))
         except Exception:
             logger.exception('presence send failed')
+
+    async def notification_new(self, event):
+        # forum notifications pushed to user_<id> (foro.notifications)
+        try:
+            await self.send(text_data=json.dumps(event))
+        except Exception:
+            logger.exception('presence notification send failed')
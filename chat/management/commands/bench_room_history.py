@@ -0,0 +1,66 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from chat.consumers_impl.helpers_db import _get_room_messages
+from chat.models import ChatMessage, ChatRoom
+from media.models import Media
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark room history loading (_get_room_messages) on a synthetic media-heavy room. '
+        'All rows are created inside a transaction that is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200, help='Number of voice-note messages to create.')
+        parser.add_argument('--iterations', type=int, default=20, help='How many times to load the history.')
+
+    def handle(self, *args, **options):
+        n_messages = max(1, options['messages'])
+        iterations = max(1, options['iterations'])
+        try:
+            with transaction.atomic():
+                room_id = self._populate(n_messages)
+                timings = []
+                queries = 0
+                for _ in range(iterations):
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        # call the sync function directly; the async wrapper would
+                        # run in another thread outside this transaction
+                        _get_room_messages.func(room_id, limit=n_messages)
+                        timings.append(time.perf_counter() - start)
+                    queries = len(ctx.captured_queries)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        timings.sort()
+        avg = sum(timings) / len(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'messages={n_messages} iterations={iterations} queries/load={queries} '
+            f'avg={avg * 1000:.2f}ms p95={p95 * 1000:.2f}ms'
+        )
+
+    def _populate(self, n_messages):
+        User = get_user_model()
+        sender = User.objects.create_user(phone_number='bench-history-sender', password='bench')
+        room = ChatRoom.objects.create(name='bench-history')
+        room.participants.add(sender)
+        # Media.description is a 200-char column; keep the synthetic spectrum short
+        spectrum = json.dumps([i % 10 for i in range(64)])
+        for i in range(n_messages):
+            media = Media.objects.create(name=f'voice-{i}.ogg', description=spectrum)
+            ChatMessage.objects.create(room=room, sender=sender, content='', media=media)
+        return room.id
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_message_seq(apps, schema_editor):
+    """Number existing messages per room in chronological order."""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    for room_id in ChatRoom.objects.values_list('id', flat=True).iterator():
+        ids = ChatMessage.objects.filter(room_id=room_id).order_by('timestamp', 'id').values_list('id', flat=True)
+        batch = []
+        seq = 0
+        for seq, mid in enumerate(ids.iterator(), start=1):
+            batch.append(ChatMessage(id=mid, seq=seq))
+            if len(batch) >= 1000:
+                ChatMessage.objects.bulk_update(batch, ['seq'])
+                batch = []
+        if batch:
+            ChatMessage.objects.bulk_update(batch, ['seq'])
+        ChatRoom.objects.filter(id=room_id).update(last_seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0008_broadcastretry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='client_msg_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_message_seq, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='chatmessage',
+            unique_together={('sender', 'client_msg_id'), ('room', 'seq')},
+        ),
+    ]
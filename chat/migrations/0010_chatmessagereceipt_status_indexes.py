@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_chatmessage_seq_client_msg_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessagereceipt',
+            index=models.Index(fields=['delivered_at'], name='chat_chatme_deliver_099c24_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessagereceipt',
+            index=models.Index(fields=['read_at'], name='chat_chatme_read_at_1a2812_idx'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.db.models import Count
 from django.contrib.auth import get_user_model
 
@@ -21,6 +21,8 @@ class ChatRoom(models.Model):
     is_private = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     last_activity = models.DateTimeField(null=True, blank=True)
+    # Último número de secuencia asignado a un mensaje de esta sala.
+    last_seq = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         # Muestra los nombres de usuario de los participantes.
@@ -97,8 +99,11 @@ class ChatMessage(models.Model):
     read = models.BooleanField(default=False, verbose_name="Leído")
     seen = models.BooleanField(default=False, verbose_name="Visto")
     read_at = models.DateTimeField(null=True, blank=True, verbose_name="Fecha/Hora lectura")
+    # Id generado por el cliente para reintentos idempotentes (único por remitente)
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True)
+    # Secuencia monótona por sala para que los clientes detecten huecos
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
 
-    
     def __str__(self):
         # Use a safe display for sender in case custom User lacks `username`
         sender_display = getattr(self.sender, 'username', None) or getattr(self.sender, 'full_name', None) or getattr(self.sender, 'phone_number', None) or str(self.sender)
@@ -108,10 +113,19 @@ class ChatMessage(models.Model):
         ordering = ('timestamp',) # Ordena los mensajes por tiempo
         verbose_name = "Mensaje de Chat"
         verbose_name_plural = "Mensajes de Chat"
+        unique_together = (('sender', 'client_msg_id'), ('room', 'seq'))
 
     def save(self, *args, **kwargs):
-        # Save the message first
-        super().save(*args, **kwargs)
+        if self._state.adding and self.seq is None and self.room_id:
+            # Allocate the next per-room sequence number. The UPDATE holds the
+            # room row lock until commit, so concurrent senders get distinct,
+            # gap-free numbers in commit order.
+            with transaction.atomic():
+                ChatRoom.objects.filter(pk=self.room_id).update(last_seq=models.F('last_seq') + 1)
+                self.seq = ChatRoom.objects.filter(pk=self.room_id).values_list('last_seq', flat=True).first()
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
         # Update room metadata: last_activity and optionally room name
         try:
             from django.utils import timezone
@@ -133,6 +147,28 @@ class ChatMessage(models.Model):
             import logging; logging.getLogger(__name__).exception('Failed updating room metadata after saving ChatMessage')
 
 
+def get_or_create_message(room, sender, client_msg_id=None, **fields):
+    """
+    Crea un ChatMessage salvo que ya exista uno del mismo remitente con el
+    mismo ``client_msg_id`` (reintento del cliente). Devuelve (mensaje, creado).
+    """
+    client_msg_id = str(client_msg_id)[:64] if client_msg_id else None
+    if client_msg_id:
+        existing = ChatMessage.objects.filter(sender=sender, client_msg_id=client_msg_id).first()
+        if existing is not None:
+            return existing, False
+    try:
+        with transaction.atomic():
+            msg = ChatMessage.objects.create(room=room, sender=sender, client_msg_id=client_msg_id, **fields)
+        return msg, True
+    except IntegrityError:
+        # a concurrent retry won the unique (sender, client_msg_id) index
+        existing = ChatMessage.objects.filter(sender=sender, client_msg_id=client_msg_id).first() if client_msg_id else None
+        if existing is None:
+            raise
+        return existing, False
+
+
 class ChatMessageReceipt(models.Model):
     """
     Per-user receipt status for a ChatMessage.
@@ -147,6 +183,11 @@ class ChatMessageReceipt(models.Model):
 
     class Meta:
         unique_together = ('message', 'user')
+        # resync looks up receipts whose status changed after a watermark
+        indexes = [
+            models.Index(fields=['delivered_at']),
+            models.Index(fields=['read_at']),
+        ]
         verbose_name = 'Receipt de mensaje'
         verbose_name_plural = 'Receipts de mensajes'
     def __str__(self):
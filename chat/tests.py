@@ -1,3 +1,213 @@
-from django.test import TestCase
+import io
 
-# Create your tests here.
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from chat.models import ChatMessage, ChatMessageReceipt, ChatRoom, get_or_create_message
+from chat.consumers_impl.helpers import _get_room_changes
+from chat.consumers_impl.helpers_preview import (
+    decode_data_url,
+    encode_data_url,
+    load_preview,
+    prepare_preview,
+)
+from chat.consumers import TestConsumer
+from tools.metrics import Histogram, metrics
+from tools.middleware.websocket import TimedDispatchMixin, WebSocketMetricsMiddleware
+
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def _png_bytes(size):
+    buf = io.BytesIO()
+    Image.new('RGB', size, color=(200, 30, 30)).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+@override_settings(CACHES=LOCMEM_CACHE, CHAT_PREVIEW_MAX_BYTES=64 * 1024, CHAT_PREVIEW_THUMBNAIL_PX=64)
+class PreviewHelpersTests(TestCase):
+
+    def test_oversized_preview_is_rejected(self):
+        data_url = encode_data_url('image/png', b'\x00' * (65 * 1024))
+        preview, error = prepare_preview(data_url=data_url)
+        self.assertIsNone(preview)
+        self.assertEqual(error, 'too_large')
+
+    def test_invalid_data_url_is_rejected(self):
+        preview, error = prepare_preview(data_url='data:image/png;base64,@@@')
+        self.assertIsNone(preview)
+        self.assertEqual(error, 'invalid')
+
+    def test_preview_is_downscaled_and_stored_by_key(self):
+        data_url = encode_data_url('image/png', _png_bytes((600, 300)))
+        preview, error = prepare_preview(data_url=data_url)
+        self.assertIsNone(error)
+        self.assertNotIn('preview_data_url', preview)
+
+        stored = load_preview(preview['preview_key'])
+        self.assertEqual(stored['mime'], preview['preview_mime'])
+        with Image.open(io.BytesIO(stored['data'])) as img:
+            self.assertLessEqual(max(img.size), 64)
+
+    def test_data_url_round_trip(self):
+        mime, raw = decode_data_url(encode_data_url('image/gif', b'GIF89a'))
+        self.assertEqual((mime, raw), ('image/gif', b'GIF89a'))
+
+
+class MessageSequenceTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create_user(phone_number='70000001', password='pass1234')
+        self.bob = User.objects.create_user(phone_number='70000002', password='pass1234')
+        self.room = ChatRoom.objects.create(name='test')
+        self.room.participants.set([self.alice, self.bob])
+
+    def test_messages_get_monotonic_room_sequence(self):
+        first = ChatMessage.objects.create(room=self.room, sender=self.alice, content='a')
+        second = ChatMessage.objects.create(room=self.room, sender=self.bob, content='b')
+        other_room = ChatRoom.objects.create(name='other')
+        other = ChatMessage.objects.create(room=other_room, sender=self.alice, content='c')
+        self.assertEqual((first.seq, second.seq, other.seq), (1, 2, 1))
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_seq, 2)
+
+    def test_retry_with_same_client_msg_id_returns_existing_message(self):
+        msg, created = get_or_create_message(self.room, self.alice, client_msg_id='c-1', content='hola')
+        again, created_again = get_or_create_message(self.room, self.alice, client_msg_id='c-1', content='hola')
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(msg.id, again.id)
+        self.assertEqual(ChatMessage.objects.filter(room=self.room).count(), 1)
+
+    def test_http_retry_is_not_duplicated(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        body = {'room': self.room.id, 'content': 'hola', 'client_msg_id': 'c-2'}
+        first = client.post('/api/chat/messages/', body, format='json')
+        retry = client.post('/api/chat/messages/', body, format='json')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(first.data['id'], retry.data['id'])
+        self.assertTrue(retry.data['duplicate'])
+        self.assertEqual(ChatMessage.objects.filter(room=self.room).count(), 1)
+
+        missed = client.get('/api/chat/messages/last_messages/', {'room': self.room.id, 'after_seq': 0})
+        self.assertEqual([m['seq'] for m in missed.data], [1])
+
+    def test_resync_returns_only_missed_messages_and_changed_receipts(self):
+        # call the wrapped sync function: database_sync_to_async would close
+        # the test transaction's connection
+        old = ChatMessage.objects.create(room=self.room, sender=self.alice, content='old')
+        receipt = ChatMessageReceipt.objects.create(message=old, user=self.bob)
+        watermark = timezone.now() - timedelta(seconds=1)
+        ChatMessage.objects.create(room=self.room, sender=self.alice, content='new 1')
+        ChatMessage.objects.create(room=self.room, sender=self.bob, content='new 2')
+        receipt.read = True
+        receipt.read_at = timezone.now()
+        receipt.save()
+
+        diff = _get_room_changes.func(self.room.id, self.bob.id, after_seq=1, receipts_since=watermark.isoformat(), limit=1)
+        self.assertEqual([m['content'] for m in diff['messages']], ['new 1'])
+        self.assertTrue(diff['has_more'])
+        # last seq of the page, so resuming from it doesn't skip 'new 2'
+        self.assertEqual(diff['last_seq'], 2)
+        rest = _get_room_changes.func(self.room.id, self.bob.id, after_seq=diff['last_seq'], limit=1)
+        self.assertEqual([m['content'] for m in rest['messages']], ['new 2'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual([(r['message_id'], r['read']) for r in diff['receipts']], [(old.id, True)])
+
+        outsider = get_user_model().objects.create_user(phone_number='70000003', password='pass1234')
+        self.assertIsNone(_get_room_changes.func(self.room.id, outsider.id, after_seq=0))
+
+    @override_settings(CHAT_RESYNC_LIMIT=1)
+    def test_resync_pages_receipts_with_the_same_timestamp(self):
+        # 10 receipts per page; a bulk mark-read gives them all one read_at
+        watermark = timezone.now() - timedelta(seconds=1)
+        users = [get_user_model().objects.create_user(phone_number='7100%04d' % i, password='pass1234') for i in range(12)]
+        msg = ChatMessage.objects.create(room=self.room, sender=self.alice, content='hola')
+        ChatMessageReceipt.objects.bulk_create([ChatMessageReceipt(message=msg, user=u) for u in users])
+        ChatMessageReceipt.objects.filter(message=msg).update(read=True, read_at=timezone.now())
+
+        seen = []
+        since, after_id = watermark.isoformat(), None
+        for _ in range(3):
+            diff = _get_room_changes.func(self.room.id, self.bob.id, after_seq=msg.seq,
+                                          receipts_since=since, receipts_after_id=after_id)
+            seen += [r['user_id'] for r in diff['receipts']]
+            since, after_id = diff['receipts_watermark'], diff['receipts_after_id']
+            if not diff['receipts_has_more']:
+                break
+        self.assertEqual(sorted(seen), sorted(u.id for u in users))
+
+
+class _TimedEchoConsumer(TimedDispatchMixin, TestConsumer):
+    pass
+
+
+class WebSocketMetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_handshake_handlers_and_outbound_bytes(self):
+        async def scenario():
+            app = WebSocketMetricsMiddleware(_TimedEchoConsumer.as_asgi())
+            communicator = WebsocketCommunicator(app, '/ws/test/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()  # pong
+            await communicator.send_json_to({'type': 'chat_message', 'text': 'hola'})
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        snap = metrics.snapshot()
+        self.assertEqual(snap['counters']['ws.accepted'], 1)
+        self.assertEqual(snap['counters']['ws.outbound_frames'], 2)
+        self.assertEqual(snap['counters']['ws.outbound_bytes'], len('{"message": "pong"}') + len(
+            '{"echo": {"type": "chat_message", "text": "hola"}}'))
+        self.assertEqual(snap['gauges']['ws.open_connections'], 0)
+        self.assertEqual(snap['histograms']['ws.handshake_ms']['count'], 1)
+        self.assertEqual(snap['histograms']['ws.receive_json.chat_message']['count'], 1)
+        self.assertIn('ws.handler.websocket_connect', snap['histograms'])
+
+    def test_histogram_percentiles(self):
+        hist = Histogram()
+        for v in range(1, 1001):
+            hist.observe(float(v))
+        summary = hist.summary()
+        self.assertEqual(summary['count'], 1000)
+        self.assertEqual(summary['max'], 1000.0)
+        # bucket upper bounds: within ~19% above the true percentile
+        self.assertTrue(500 <= summary['p50'] <= 500 * 1.2)
+        self.assertTrue(990 <= summary['p99'] <= 1000)
+
+    def test_endpoint_is_staff_only(self):
+        User = get_user_model()
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(phone_number='70900001', password='pass1234'))
+        self.assertEqual(client.get('/api/metrics/ws/').status_code, 403)
+        client.force_authenticate(User.objects.create_user(phone_number='70900002', password='pass1234', is_staff=True))
+        resp = client.get('/api/metrics/ws/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(set(resp.data), {'counters', 'gauges', 'histograms'})
+
+    def test_reset_keeps_gauges_of_open_connections(self):
+        metrics.gauge('ws.open_connections', 1)
+        self.addCleanup(metrics.gauge, 'ws.open_connections', -1)
+        metrics.incr('ws.accepted')
+        metrics.reset()
+        snap = metrics.snapshot()
+        self.assertEqual(snap['counters'], {})
+        self.assertEqual(snap['gauges']['ws.open_connections'], 1)
@@ -3,12 +3,13 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
+from tools.middleware.websocket import WebSocketMetricsMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'consultveterinarias.settings')
 
 application = ProtocolTypeRouter({
   "http": get_asgi_application(),
-  "websocket": AuthMiddlewareStack(
+  "websocket": WebSocketMetricsMiddleware(AuthMiddlewareStack(
     URLRouter(chat.routing.websocket_urlpatterns)
-  ),
+  )),
 })
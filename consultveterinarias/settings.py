@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 from corsheaders.defaults import default_headers
 import pymysql
@@ -45,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # primero, para medir toda la petición (Server-Timing, presupuestos de queries)
+    'tools.middleware.performance.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -149,6 +152,46 @@ if use_redis_channels:
 else:
     CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
 
+# ------------------ Chat previews ------------------
+# Límite del preview (bytes decodificados), lado máximo del thumbnail y TTL
+# de la clave en caché con la que viaja por el channel layer.
+CHAT_PREVIEW_MAX_BYTES = int(os.getenv('CHAT_PREVIEW_MAX_BYTES', 512 * 1024))
+CHAT_PREVIEW_THUMBNAIL_PX = int(os.getenv('CHAT_PREVIEW_THUMBNAIL_PX', 320))
+CHAT_PREVIEW_TTL = int(os.getenv('CHAT_PREVIEW_TTL', 120))
+# Máximo de mensajes devueltos por cada frame 'resync' de reconexión
+CHAT_RESYNC_LIMIT = int(os.getenv('CHAT_RESYNC_LIMIT', 200))
+
+# ------------------ Notas de voz ------------------
+# Archivos de audio hasta MEDIA_AUDIO_INLINE_MAX_BYTES se procesan en la misma
+# petición; los más grandes van al pool de MEDIA_AUDIO_WORKERS hilos.
+MEDIA_AUDIO_INLINE_MAX_BYTES = int(os.getenv('MEDIA_AUDIO_INLINE_MAX_BYTES', 256 * 1024))
+MEDIA_AUDIO_MAX_BYTES = int(os.getenv('MEDIA_AUDIO_MAX_BYTES', 20 * 1024 * 1024))
+MEDIA_AUDIO_WORKERS = int(os.getenv('MEDIA_AUDIO_WORKERS', 2))
+
+# ------------------ Foro ------------------
+# Posts recientes que se rankean en /posts/relevant/ y TTL del ranking cacheado por usuario
+FORO_FEED_WINDOW = int(os.getenv('FORO_FEED_WINDOW', 500))
+FORO_FEED_CACHE_TTL = int(os.getenv('FORO_FEED_CACHE_TTL', 120))
+# Comentarios embebidos en cada post y paginación/profundidad de /posts/<id>/comments/
+FORO_POST_TOP_COMMENTS = int(os.getenv('FORO_POST_TOP_COMMENTS', 3))
+FORO_COMMENTS_PAGE_SIZE = int(os.getenv('FORO_COMMENTS_PAGE_SIZE', 20))
+FORO_COMMENTS_MAX_PAGE_SIZE = int(os.getenv('FORO_COMMENTS_MAX_PAGE_SIZE', 100))
+FORO_COMMENTS_MAX_DEPTH = int(os.getenv('FORO_COMMENTS_MAX_DEPTH', 3))
+# Contador de vistas write-behind: 'redis' (hash compartido) o 'local' (por proceso)
+FORO_VIEW_COUNTER_BACKEND = os.getenv('FORO_VIEW_COUNTER_BACKEND', 'redis' if use_redis_channels else 'local')
+FORO_VIEWS_FLUSH_INTERVAL = float(os.getenv('FORO_VIEWS_FLUSH_INTERVAL', 10))
+# Ventanas ordenadas por comunidad para /communities/<id>/feed/ (foro/community_feed.py)
+FORO_COMMUNITY_FEED_BACKEND = os.getenv('FORO_COMMUNITY_FEED_BACKEND', 'redis' if use_redis_channels else 'local')
+FORO_COMMUNITY_FEED_WINDOW = int(os.getenv('FORO_COMMUNITY_FEED_WINDOW', 1000))
+# Caché de respuestas anónimas de posts/comunidades (foro/cache.py sobre tools/cache_utils), invalidada por señales
+FORO_RESPONSE_CACHE = os.getenv('FORO_RESPONSE_CACHE', 'True') == 'True'
+FORO_RESPONSE_CACHE_TTL = int(os.getenv('FORO_RESPONSE_CACHE_TTL', 30))
+# Notificaciones: escritura en segundo plano y ventana (s) en la que se agrupan
+FORO_NOTIFICATIONS_ASYNC = os.getenv('FORO_NOTIFICATIONS_ASYNC', 'True') == 'True'
+FORO_NOTIFICATION_WINDOW = int(os.getenv('FORO_NOTIFICATION_WINDOW', 300))
+FORO_NOTIFICATION_BATCH = int(os.getenv('FORO_NOTIFICATION_BATCH', 200))
+FORO_UNREAD_COUNT_TTL = int(os.getenv('FORO_UNREAD_COUNT_TTL', 300))
+
 # ------------------ Supabase ------------------
 SUPABASE_URL = os.getenv('SUPABASE_URL', 'https://kprsxavfuqotrgfxyqbj.supabase.co')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY', 'sb_secret_8jlGXGcs3ubH-9v7T6riiw_Hbq28d0R')
@@ -165,6 +208,31 @@ LOGGING = {
     },
 }
 
+# ------------------ Perfilado de peticiones (tools/middleware/performance.py) ------------------
+PERFORMANCE_SLOW_REQUEST_MS = float(os.getenv('PERFORMANCE_SLOW_REQUEST_MS', 500))
+# Máximo de queries por vista ('MÉTODO nombre-de-url' o sólo el nombre),
+# incluida la autenticación. Al pasarse se registra un warning, o falla la
+# petición con 'raise' (por defecto en `manage.py test`) para detectar N+1
+# en los serializers.
+PERFORMANCE_BUDGET_MODE = os.getenv('PERFORMANCE_BUDGET_MODE', 'raise' if sys.argv[1:2] == ['test'] else 'log')
+PERFORMANCE_QUERY_BUDGETS = {
+    'GET foro-posts-list': 6,
+    'GET foro-posts-detail': 6,
+    'GET foro-posts-comments': 6,
+    'GET foro-posts-relevant': 8,
+    'GET foro-posts-search': 6,
+    'GET foro-comments-list': 6,
+    'GET foro-communities-list': 4,
+    'GET foro-communities-detail': 4,
+    'GET foro-communities-feed': 8,
+    'GET foro-notifications-list': 8,
+    'GET foro-notifications-unread-count': 4,
+}
+
+# Métricas de WebSocket por proceso (tools/metrics.py, /api/metrics/ws/)
+WS_METRICS_ENABLED = os.getenv('WS_METRICS_ENABLED', 'True') == 'True'
+METRICS_MAX_SERIES = int(os.getenv('METRICS_MAX_SERIES', 200))
+
 # ------------------ Cache con Redis ------------------
 REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1')
 CACHES = {
@@ -174,4 +242,13 @@ CACHES = {
         'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
     }
 }
+if sys.argv[1:2] == ['test']:
+    # los tests no dependen de un Redis en marcha
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
 DEFAULT_CACHE_TIMEOUT = 60 * 5  # 5 minutos
+# tools/cache_utils: LRU en proceso delante de Redis, lock single-flight y caché de None
+CACHE_UTILS_LOCAL_MAXSIZE = int(os.getenv('CACHE_UTILS_LOCAL_MAXSIZE', 1024))
+CACHE_UTILS_LOCAL_TTL = float(os.getenv('CACHE_UTILS_LOCAL_TTL', 5))
+CACHE_UTILS_LOCK_TIMEOUT = int(os.getenv('CACHE_UTILS_LOCK_TIMEOUT', 10))
+CACHE_UTILS_LOCK_WAIT = float(os.getenv('CACHE_UTILS_LOCK_WAIT', 2))
+CACHE_UTILS_NEGATIVE_TIMEOUT = int(os.getenv('CACHE_UTILS_NEGATIVE_TIMEOUT', 30))
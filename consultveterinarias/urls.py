@@ -10,6 +10,7 @@ from drf_yasg import openapi
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.static import serve
+from tools.metrics import metrics_view
 
 
 schema_view = get_schema_view(
@@ -28,6 +29,8 @@ urlpatterns = [
     path('', RedirectView.as_view(url='/admin/', permanent=True)),
    # Simple health endpoint to verify the Django server and routing quickly
    path('api/health/', lambda request: HttpResponse('ok')),
+   # WebSocket metrics of this process (staff only), see tools/metrics.py
+   path('api/metrics/ws/', metrics_view, name='ws-metrics'),
     path('api/profiles/', include('profiles.api.urls')),
     path('api/auth/', include('auth_app.api.urls')),
     path('api/chat/', include('chat.api.urls')), 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Post, Comment, Reaction, Notification
+from .models import Post, Comment, Reaction, Notification, NotificationArchive
 
 
 @admin.register(Post)
@@ -22,5 +22,11 @@ class ReactionAdmin(admin.ModelAdmin):
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ('id', 'recipient', 'actor', 'notif_type', 'read', 'created_at')
+    list_display = ('id', 'recipient', 'actor', 'notif_type', 'actors_count', 'read', 'created_at')
     list_filter = ('notif_type', 'read')
+
+
+@admin.register(NotificationArchive)
+class NotificationArchiveAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipient', 'notif_type', 'actors_count', 'created_at', 'archived_at')
+    list_filter = ('notif_type',)
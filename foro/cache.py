@@ -0,0 +1,136 @@
+"""Read-through cache for the anonymous forum read endpoints.
+
+``PostViewSet.list/retrieve`` and ``CommunityViewSet.list/retrieve/feed``
+cache the serialized response of anonymous GETs with
+``tools.cache_utils.get_or_set_cache``, keyed by path and sorted query
+params inside the ``tools.cache_utils`` *namespace* the response depends on:
+
+- ``foro:posts``: every post listing (any post, comment or post/comment
+  reaction write changes it).
+- ``foro:post:<id>``: one post's detail (its fields, top comments and counters).
+- ``foro:community:<id>``: one community's detail and feed.
+- ``foro:communities``: the community listing (created/edited/deleted
+  communities and ``members_count`` changes).
+
+Writes don't delete cached responses, they bump the namespaces (``bump``)
+from the signals in ``foro.models``, so every key built with the old
+generation is simply never read again and expires with
+``FORO_RESPONSE_CACHE_TTL``. Namespaces are bumped right away and again
+after commit: the first makes this process see its own write, the second
+drops anything a concurrent reader cached from pre-commit data.
+
+A cold key is rebuilt by a single request (``cache_utils``' single flight;
+the others wait up to ``CACHE_UTILS_LOCK_WAIT`` seconds for its result).
+``views_count`` of a cached post stores the flushed count only; views still
+buffered in ``foro.view_counter`` are added when it is served. A flush
+bumps the detail namespaces of the posts it wrote but not the listings,
+which may show fewer views for up to ``FORO_RESPONSE_CACHE_TTL``.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.response import Response
+
+from foro.view_counter import pending_views
+from tools.cache_utils import get_or_set_cache, invalidate_namespace
+
+POSTS = 'foro:posts'
+COMMUNITIES = 'foro:communities'
+
+
+def post_stamp(post_id):
+    return 'foro:post:%s' % post_id
+
+
+def community_stamp(community_id):
+    return 'foro:community:%s' % community_id
+
+
+def enabled():
+    return bool(getattr(settings, 'FORO_RESPONSE_CACHE', True))
+
+
+def _ttl():
+    return int(getattr(settings, 'FORO_RESPONSE_CACHE_TTL', 30))
+
+
+def _bump_now(names):
+    for name in names:
+        invalidate_namespace(name)
+
+
+def bump(*names):
+    """Invalidate every cached response depending on ``names``."""
+    names = [n for n in names if n]
+    if not names:
+        return
+    _bump_now(names)
+    transaction.on_commit(lambda: _bump_now(names))
+
+
+def cache_key(request, scope):
+    query = sorted(request.query_params.lists())
+    digest = hashlib.md5(('%s?%r' % (request.path, query)).encode()).hexdigest()
+    return 'rc:%s:%s' % (scope, digest)
+
+
+def _cacheable(request):
+    user = getattr(request, 'user', None)
+    return enabled() and request.method == 'GET' and not (user and user.is_authenticated)
+
+
+def cached_response(request, scope, namespace, build, to_cache=None, on_hit=None):
+    """Serve ``build()`` (a DRF Response) through the cache for anonymous GETs.
+
+    ``scope`` names the endpoint, ``namespace`` is what invalidates it
+    (``POSTS``, ``post_stamp(id)``...). Only 200 responses are stored.
+    ``to_cache(data)`` and ``on_hit(data)`` let a view store and serve the
+    volatile parts of its payload differently (see ``post_views_stored`` /
+    ``post_views_current``).
+    """
+    if not _cacheable(request):
+        return build()
+    built = []
+
+    def compute():
+        response = build()
+        built.append(response)
+        if response.status_code != 200:
+            return None  # not cached: negative_timeout=0
+        return to_cache(response.data) if to_cache else response.data
+
+    data = get_or_set_cache(cache_key(request, scope), compute, timeout=_ttl(),
+                            namespace=namespace, negative_timeout=0)
+    if data is None and not built:
+        return build()
+    if built:
+        response = built[-1]
+        response['X-Cache'] = 'MISS'
+        return response
+    response = Response(on_hit(data) if on_hit else data)
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def _adjust_views(data, sign):
+    posts = data['results'] if isinstance(data, dict) and 'results' in data else data
+    single = isinstance(posts, dict)
+    rows = [posts] if single else list(posts)
+    pending = pending_views([p['id'] for p in rows if 'views_count' in p])
+    rows = [dict(p, views_count=p['views_count'] + sign * pending.get(p['id'], 0)) if 'views_count' in p else p for p in rows]
+    if single:
+        return rows[0]
+    if isinstance(data, dict):
+        return dict(data, results=rows)
+    return rows
+
+
+def post_views_stored(data):
+    """Serialized post(s) with ``views_count`` minus the views still buffered."""
+    return _adjust_views(data, -1)
+
+
+def post_views_current(data):
+    """Cached post(s) with the currently buffered views added back."""
+    return _adjust_views(data, 1)
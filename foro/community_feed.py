@@ -0,0 +1,275 @@
+"""Per-community ranked post windows for ``/communities/<id>/feed/``.
+
+Each community keeps, per ordering, the ``FORO_COMMUNITY_FEED_WINDOW`` best
+post ids with their score, in a Redis sorted set or (without Redis) an
+in-process sorted window:
+
+- ``new``: creation time.
+- ``top``: reactions + comments.
+- ``hot``: ``log10(max(top, 1)) + created / 45000`` (reddit style), so newer
+  posts outrank older ones unless these have ~10x the engagement, without
+  needing periodic re-scoring.
+
+A window is built from the database on first use and then kept current by
+the post/comment/reaction signals in ``foro.models`` (after commit). Pages
+are served from the window with a ``(score, id)`` cursor, so community
+pages never scan the global post table; a feed ends where its window does.
+"""
+import base64
+import binascii
+import bisect
+import logging
+import math
+import threading
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from foro.models import Comment, Post
+
+try:
+    import redis as _redis
+except Exception:
+    _redis = None
+
+logger = logging.getLogger(__name__)
+
+ORDERINGS = ('hot', 'new', 'top')
+HOT_EPOCH = 1700000000  # 2023-11-14, keeps hot scores small
+HOT_PERIOD = 45000.0
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _window():
+    return int(getattr(settings, 'FORO_COMMUNITY_FEED_WINDOW', 1000))
+
+
+def _backend():
+    return getattr(settings, 'FORO_COMMUNITY_FEED_BACKEND', 'local')
+
+
+def page_size(requested=None):
+    default = int(getattr(settings, 'FORO_COMMUNITY_FEED_PAGE_SIZE', 20))
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, 100))
+
+
+def scores(created_at, engagement):
+    """Return ``{ordering: score}`` for a post."""
+    created = created_at.timestamp()
+    return {
+        'new': created,
+        'top': float(engagement),
+        'hot': round(math.log10(max(engagement, 1)) + (created - HOT_EPOCH) / HOT_PERIOD, 7),
+    }
+
+
+def encode_cursor(score, pk):
+    raw = '%r:%d' % (score, pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        score, pk = raw.rsplit(':', 1)
+        return float(score), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, AttributeError):
+        raise InvalidCursor(cursor)
+
+
+class LocalWindows:
+    """In-process ``{key: {post_id: score}}`` with a sorted (score desc, id desc) index."""
+
+    def __init__(self):
+        self._scores = {}
+        self._order = {}
+        self._lock = threading.Lock()
+
+    def exists(self, key):
+        return key in self._scores
+
+    def fill(self, key, items):
+        with self._lock:
+            self._scores[key] = dict(items)
+            self._order[key] = sorted((-s, -pk) for pk, s in items)
+
+    def set(self, key, pk, score, limit):
+        with self._lock:
+            scores, order = self._scores.get(key), self._order.get(key)
+            if scores is None:
+                return
+            self._discard(scores, order, pk)
+            bisect.insort(order, (-score, -pk))
+            scores[pk] = score
+            while len(order) > limit:
+                _, neg_pk = order.pop()
+                scores.pop(-neg_pk, None)
+
+    def remove(self, key, pk):
+        with self._lock:
+            if key in self._scores:
+                self._discard(self._scores[key], self._order[key], pk)
+
+    def _discard(self, scores, order, pk):
+        old = scores.pop(pk, None)
+        if old is not None:
+            i = bisect.bisect_left(order, (-old, -pk))
+            if i < len(order) and order[i] == (-old, -pk):
+                del order[i]
+
+    def page(self, key, after, limit):
+        with self._lock:
+            order = self._order.get(key, [])
+            start = bisect.bisect_right(order, (-after[0], -after[1])) if after else 0
+            return [(-s, -pk) for s, pk in order[start:start + limit]]
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self._order.clear()
+
+
+class RedisWindows:
+    """Same interface over sorted sets; members are zero-padded ids so ties sort by id."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _member(pk):
+        return '%012d' % pk
+
+    def exists(self, key):
+        return bool(self.client.exists(key + ':built'))
+
+    def fill(self, key, items):
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if items:
+            pipe.zadd(key, {self._member(pk): s for pk, s in items})
+        pipe.set(key + ':built', '1')
+        pipe.execute()
+
+    def set(self, key, pk, score, limit):
+        if not self.exists(key):
+            return
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {self._member(pk): score})
+        pipe.zremrangebyrank(key, 0, -limit - 1)
+        pipe.execute()
+
+    def remove(self, key, pk):
+        self.client.zrem(key, self._member(pk))
+
+    def page(self, key, after, limit):
+        if after is None:
+            rows = self.client.zrevrange(key, 0, limit - 1, withscores=True)
+        else:
+            score, pk = after
+            rank = self.client.zrevrank(key, self._member(pk))
+            if rank is not None and self.client.zscore(key, self._member(pk)) == score:
+                rows = self.client.zrevrange(key, rank + 1, rank + limit, withscores=True)
+            else:
+                # cursor post moved or left the window: continue below its score
+                rows = self.client.zrevrangebyscore(key, '(%r' % score, '-inf', start=0, num=limit, withscores=True)
+        return [(float(s), int(m)) for m, s in rows]
+
+
+_local = LocalWindows()
+_client = None
+
+
+def _windows():
+    global _client
+    if _backend() == 'redis' and _redis is not None:
+        if _client is None:
+            try:
+                _client = _redis.from_url(getattr(settings, 'REDIS_URL', 'redis://127.0.0.1:6379/1'), decode_responses=True)
+            except Exception:
+                logger.exception('community_feed: failed creating redis client')
+        if _client is not None:
+            return RedisWindows(_client)
+    return _local
+
+
+def _key(community_id, ordering):
+    return 'foro:cfeed:%s:%s' % (community_id, ordering)
+
+
+def _engagement_rows(qs):
+    comments = (Comment.objects.filter(post=OuterRef('pk')).order_by()
+                .values('post').annotate(c=Count('id')).values('c'))
+    return qs.annotate(num_comments=Coalesce(Subquery(comments), 0)).values_list(
+        'id', 'community_id', 'created_at', 'reactions_count', 'num_comments',
+    )
+
+
+def build(community_id, windows=None):
+    """(Re)build all orderings of a community from the database."""
+    windows = windows or _windows()
+    base = Post.objects.filter(community_id=community_id)
+    limit = _window()
+    candidates = {}
+    # newest window plus the most reacted posts, then each ordering keeps its best
+    for qs in (base.order_by('-created_at'), base.order_by('-reactions_count', '-id')):
+        for pk, _, created_at, reactions, comments in _engagement_rows(qs)[:limit]:
+            candidates[pk] = scores(created_at, reactions + comments)
+    for ordering in ORDERINGS:
+        items = sorted(((pk, s[ordering]) for pk, s in candidates.items()), key=lambda x: (x[1], x[0]), reverse=True)
+        windows.fill(_key(community_id, ordering), items[:limit])
+
+
+def refresh_post(post_id):
+    """Re-score one post in its community's windows (no-op for windows not built yet)."""
+    try:
+        row = _engagement_rows(Post.objects.filter(pk=post_id)).first()
+        if row is None or row[1] is None:
+            return
+        pk, community_id, created_at, reactions, comments = row
+        windows = _windows()
+        for ordering, score in scores(created_at, reactions + comments).items():
+            windows.set(_key(community_id, ordering), pk, score, _window())
+    except Exception:
+        logger.exception('community_feed: could not refresh post=%s', post_id)
+
+
+def remove_post(post_id, community_id):
+    if community_id is None:
+        return
+    try:
+        windows = _windows()
+        for ordering in ORDERINGS:
+            windows.remove(_key(community_id, ordering), post_id)
+    except Exception:
+        logger.exception('community_feed: could not remove post=%s', post_id)
+
+
+def _page(windows, community_id, key, after, limit):
+    if not windows.exists(key):
+        build(community_id, windows)
+    return windows.page(key, after, limit)
+
+
+def feed_page(community_id, ordering='hot', cursor=None, limit=None):
+    """Return ``(post_ids, next_cursor)`` for one page of a community feed."""
+    if ordering not in ORDERINGS:
+        raise ValueError(ordering)
+    limit = page_size(limit)
+    after = decode_cursor(cursor) if cursor else None
+    key = _key(community_id, ordering)
+    try:
+        rows = _page(_windows(), community_id, key, after, limit + 1)
+    except Exception:
+        logger.exception('community_feed: redis unavailable, serving community=%s from process memory', community_id)
+        rows = _page(_local, community_id, key, after, limit + 1)
+    page = rows[:limit]
+    next_cursor = encode_cursor(*page[-1]) if len(rows) > limit else None
+    return [pk for _, pk in page], next_cursor
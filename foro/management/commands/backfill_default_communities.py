@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from foro.memberships import ROLE_COMMUNITIES, assign_default_communities
+
+
+class Command(BaseCommand):
+    help = (
+        'Add existing users to the default communities of their role (the same ones new users '
+        'get on registration), in chunks with bulk inserts. Safe to re-run: existing memberships are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users processed per batch.')
+        parser.add_argument('--general', action='store_true', help="Also add every user to the 'general' community.")
+        parser.add_argument('--start-id', type=int, default=0, help='Resume after this user id.')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        extra = ['general'] if options['general'] else []
+        chunk_size = max(1, options['chunk_size'])
+        qs = User.objects.all() if extra else User.objects.filter(role__in=list(ROLE_COMMUNITIES))
+
+        users = added = 0
+        last_pk = options['start_id']
+        while True:
+            # keyset over pk: constant cost per chunk however far the backfill got
+            chunk = list(qs.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'role')[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            added += assign_default_communities(chunk, extra_slugs=extra)
+            users += len(chunk)
+            self.stdout.write('... %d users, %d memberships added (last id %d)' % (users, added, last_pk))
+
+        self.stdout.write(self.style.SUCCESS('Backfilled %d memberships for %d users' % (added, users)))
@@ -0,0 +1,96 @@
+import itertools
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from foro import search
+from foro.models import Post
+
+BENCH_PHONE = 'bench-forum-search'
+BASE_WORDS = (
+    'vacuna ganado bovino ternero leche mastitis parasitos desparasitante pasto forraje '
+    'fiebre aftosa brucelosis garrapata cerdo porcino aves gallina postura engorde maiz '
+    'soya fertilizante plaga hongo riego semilla cosecha suelo abono dosis tratamiento '
+    'antibiotico veterinario agronomo diagnostico sintoma diarrea cojera parto destete'
+).split()
+
+
+def _vocabulary(size, rng):
+    extra = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 9)))
+             for _ in range(max(0, size - len(BASE_WORDS)))]
+    words = BASE_WORDS + extra
+    # Zipf-like frequencies, as in real text; cumulative so choices() doesn't
+    # re-sum them on every call
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark forum search (foro.search) on a synthetic corpus. --backend memory builds an '
+        'InvertedIndex in-process (no database); --backend db inserts posts into the database and '
+        'queries the configured backend (FULLTEXT on MySQL), deleting them afterwards unless --keep.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000, help='Size of the synthetic corpus.')
+        parser.add_argument('--words', type=int, default=30, help='Words per post.')
+        parser.add_argument('--vocabulary', type=int, default=50000, help='Distinct words in the corpus.')
+        parser.add_argument('--queries', type=int, default=50, help='Number of timed queries.')
+        parser.add_argument('--backend', choices=['memory', 'db'], default='memory')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create (db backend).')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic posts (db backend).')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words, cum_weights = _vocabulary(options['vocabulary'], rng)
+        n_posts = max(1, options['posts'])
+
+        def text():
+            return ' '.join(rng.choices(words, cum_weights=cum_weights, k=options['words']))
+
+        start = time.perf_counter()
+        if options['backend'] == 'memory':
+            index = search.InvertedIndex()
+            for pk in range(1, n_posts + 1):
+                index.add(('post', pk), text())
+            run = index.search
+        else:
+            author = self._populate(n_posts, text, options['batch_size'])
+            run = search.ranked_hits
+        self.stdout.write('corpus: %d posts built in %.1fs' % (n_posts, time.perf_counter() - start))
+
+        # mix of frequent and rarer terms, one or two words per query
+        queries = [' '.join(rng.sample(BASE_WORDS, rng.randint(1, 2))) for _ in range(max(1, options['queries']))]
+        timings = []
+        hits = 0
+        try:
+            for q in queries:
+                t0 = time.perf_counter()
+                hits += len(run(q))
+                timings.append(time.perf_counter() - t0)
+        finally:
+            if options['backend'] == 'db' and not options['keep']:
+                Post.objects.filter(author=author).delete()
+                author.delete()
+
+        timings.sort()
+        avg = sum(timings) / len(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f'backend={options["backend"]} queries={len(queries)} avg_hits={hits / len(queries):.0f} '
+            f'avg={avg * 1000:.2f}ms p95={p95 * 1000:.2f}ms'
+        )
+
+    def _populate(self, n_posts, text, batch_size):
+        # committed on purpose: InnoDB only indexes FULLTEXT rows at commit
+        User = get_user_model()
+        author, _ = User.objects.get_or_create(phone_number=BENCH_PHONE)
+        for i in range(0, n_posts, batch_size):
+            Post.objects.bulk_create(
+                [Post(author=author, title=text()[:255], content=text()) for _ in range(min(batch_size, n_posts - i))],
+            )
+        return author
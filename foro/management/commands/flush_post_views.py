@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from foro.view_counter import flush_views
+
+
+class Command(BaseCommand):
+    help = (
+        'Write buffered post views (foro.view_counter) to Post.views_count. '
+        'Views are also flushed automatically every FORO_VIEWS_FLUSH_INTERVAL seconds while '
+        'traffic arrives; run this from cron or before shutting a process down.'
+    )
+
+    def handle(self, *args, **options):
+        flushed = flush_views()
+        self.stdout.write(self.style.SUCCESS('Flushed %d post views' % flushed))
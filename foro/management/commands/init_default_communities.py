@@ -1,7 +1,21 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from foro.memberships import assign_default_communities
 from foro.models import Community
 
+CHUNK_SIZE = 5000
+
+# normalized (lowercase) role -> communities; specialists go to veterinarios,
+# agronomos and especialistas
+_SPECIALIST = ['veterinarios', 'agronomos', 'especialistas']
+ROLE_SLUGS = {
+    'consumer': ['consumidores'], 'consumidor': ['consumidores'], 'consumidores': ['consumidores'],
+    # map business role to agroveterinarias
+    'businessman': ['agroveterinarias'], 'empresario': ['agroveterinarias'], 'empresarios': ['agroveterinarias'],
+    'specialist': _SPECIALIST, 'specialists': _SPECIALIST, 'specialista': _SPECIALIST,
+    'especialista': _SPECIALIST, 'especialistas': _SPECIALIST,
+}
+
 
 class Command(BaseCommand):
     help = (
@@ -17,10 +31,9 @@ class Command(BaseCommand):
             if old:
                 target = Community.objects.filter(slug='agroveterinarias').first()
                 if target:
-                    # move members from old to target and delete old
+                    # move members from old to target and delete old (members_count
+                    # follows through the m2m_changed signal)
                     target.members.add(*old.members.all())
-                    target.members_count = target.members.count()
-                    target.save(update_fields=['members_count'])
                     old.delete()
                 else:
                     # rename
@@ -55,38 +68,17 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS('Ensured communities exist: %s' % ', '.join([s[0] for s in slugs])))
 
-        # add all users to general
-        general = Community.objects.get(slug='general')
-        users = User.objects.all()
-        general.members.add(*users)
-        general.members_count = general.members.count()
-        general.save(update_fields=['members_count'])
-        self.stdout.write(self.style.SUCCESS('Added %d users to general community' % users.count()))
-
-        # role-based assignment
-        for user in users:
-            role = getattr(user, 'role', None)
-            if not role:
-                continue
+        # add all users to general + role-based assignment, in chunks with bulk inserts
+        total = 0
+        last_pk = 0
+        while True:
+            chunk = list(User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'role')[:CHUNK_SIZE])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
             # normalize role string to lowercase for common matches
-            r = str(role).lower()
-            if r in ('consumer', 'consumidor', 'consumidores'):
-                c = Community.objects.get(slug='consumidores')
-                c.members.add(user)
-                c.members_count = c.members.count()
-                c.save(update_fields=['members_count'])
-            elif r in ('businessman', 'empresario', 'empresarios'):
-                # map business role to agroveterinarias
-                c = Community.objects.get(slug='agroveterinarias')
-                c.members.add(user)
-                c.members_count = c.members.count()
-                c.save(update_fields=['members_count'])
-            elif r in ('specialist', 'specialists', 'specialista', 'especialista', 'especialistas'):
-                # Assign specialists to veterinarian/agronomist and especialistas
-                for slug in ['veterinarios', 'agronomos', 'especialistas']:
-                    c = Community.objects.get(slug=slug)
-                    c.members.add(user)
-                    c.members_count = c.members.count()
-                    c.save(update_fields=['members_count'])
-
-        self.stdout.write(self.style.SUCCESS('Role-based assignment completed'))
\ No newline at end of file
+            rows = [(pk, str(role).lower() if role else None) for pk, role in chunk]
+            assign_default_communities(rows, role_communities=ROLE_SLUGS, extra_slugs=['general'])
+            total += len(chunk)
+        self.stdout.write(self.style.SUCCESS('Added %d users to general community' % total))
+        self.stdout.write(self.style.SUCCESS('Role-based assignment completed'))
@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+
+from foro.feed import invalidate_all_feeds
+from foro.models import (
+    AFFINITY_COMMENT_ON_POST,
+    AFFINITY_REACTION_ON_COMMENT,
+    AFFINITY_REACTION_ON_POST,
+    AuthorAffinity,
+    Comment,
+    Post,
+    Reaction,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute AuthorAffinity (user -> author interaction score used by /posts/relevant/) '
+        'from existing comments and reactions. Run once after deploying the feed, or to repair drift.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk_create.')
+
+    def handle(self, *args, **options):
+        scores = defaultdict(float)
+
+        for row in Comment.objects.values('user_id', 'post__author_id').annotate(n=Count('id')):
+            scores[(row['user_id'], row['post__author_id'])] += row['n'] * AFFINITY_COMMENT_ON_POST
+
+        targets = (
+            (Post, 'author_id', AFFINITY_REACTION_ON_POST),
+            (Comment, 'user_id', AFFINITY_REACTION_ON_COMMENT),
+        )
+        for model, owner_field, weight in targets:
+            owner = Subquery(model.objects.filter(pk=OuterRef('object_id')).values(owner_field)[:1])
+            rows = (
+                Reaction.objects.filter(content_type=ContentType.objects.get_for_model(model))
+                .annotate(owner_id=owner)
+                .exclude(owner_id__isnull=True)
+                .values('user_id', 'owner_id')
+                .annotate(n=Count('id'))
+            )
+            for row in rows:
+                scores[(row['user_id'], row['owner_id'])] += row['n'] * weight
+
+        with transaction.atomic():
+            AuthorAffinity.objects.all().delete()
+            AuthorAffinity.objects.bulk_create(
+                [AuthorAffinity(user_id=u, author_id=a, score=s) for (u, a), s in scores.items() if s],
+                batch_size=options['batch_size'],
+            )
+        invalidate_all_feeds()
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d author affinity rows' % len(scores)))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from foro.feed import invalidate_all_feeds
+from foro.relevance import recompute_all, recompute_changed
+from foro.view_counter import flush_views
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute Post.relevance_score for posts whose views, comments or reactions changed since '
+        'the last run (PostChangeLog). Schedule it every few minutes; use --all periodically so '
+        'the time decay also reaches untouched posts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Posts scored and bulk-updated per chunk.')
+        parser.add_argument('--all', action='store_true', help='Recompute every post, not only changed ones.')
+
+    def handle(self, *args, **options):
+        # buffered views count as engagement too
+        flush_views()
+        chunk_size = max(1, options['chunk_size'])
+        if options['all']:
+            updated, seconds = recompute_all(chunk_size)
+        else:
+            updated, seconds = recompute_changed(chunk_size)
+        if updated:
+            invalidate_all_feeds()
+        rate = updated / seconds if seconds else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            'Recomputed relevance for %d posts in %.2fs (%.0f posts/s)' % (updated, seconds, rate)
+        ))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from foro.models import Community
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute Community.members_count from the membership table and fix communities '
+        'that drifted. Safe to run periodically (cron).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would change.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows read and bulk-updated per batch.')
+
+    def handle(self, *args, **options):
+        Membership = Community.members.through
+        # one grouped COUNT for every community instead of one per row
+        actual = dict(
+            Membership.objects.values('community_id').annotate(n=Count('id')).order_by()
+            .values_list('community_id', 'n')
+        )
+
+        live = (Membership.objects.filter(community_id=OuterRef('pk')).order_by()
+                .values('community_id').annotate(n=Count('id')).values('n'))
+
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(Community.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'members_count')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            stale = [c.pk for c in batch if c.members_count != actual.get(c.pk, 0)]
+            fixed += len(stale)
+            if stale and not options['dry_run']:
+                # recount inside the UPDATE itself so joins/leaves that land
+                # between the read above and this write are not overwritten
+                with transaction.atomic():
+                    Community.objects.filter(pk__in=stale).update(members_count=Coalesce(Subquery(live), 0))
+
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS('Community: %s %d rows' % (verb, fixed)))
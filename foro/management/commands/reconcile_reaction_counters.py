@@ -0,0 +1,59 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from foro.models import REACTION_COUNTER_FIELDS, Comment, Post, Reaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute reactions_count and the per-type counters (heart/like/dislike) of posts and '
+        'comments from the Reaction table and fix rows that drifted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would change.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows read and bulk-updated per batch.')
+
+    def handle(self, *args, **options):
+        for model in (Post, Comment):
+            fixed = self.reconcile(model, options['batch_size'], options['dry_run'])
+            verb = 'would fix' if options['dry_run'] else 'fixed'
+            self.stdout.write(self.style.SUCCESS('%s: %s %d rows' % (model.__name__, verb, fixed)))
+
+    def reconcile(self, model, batch_size, dry_run):
+        ct = ContentType.objects.get_for_model(model)
+        counters = list(REACTION_COUNTER_FIELDS.values()) + ['reactions_count']
+        actual = defaultdict(lambda: dict.fromkeys(counters, 0))
+        rows = (
+            Reaction.objects.filter(content_type=ct, type__in=list(REACTION_COUNTER_FIELDS))
+            .values('object_id', 'type').annotate(n=Count('id')).order_by()
+        )
+        for row in rows:
+            counts = actual[row['object_id']]
+            counts[REACTION_COUNTER_FIELDS[row['type']]] = row['n']
+            counts['reactions_count'] += row['n']
+
+        zero = dict.fromkeys(counters, 0)
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *counters)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            stale = []
+            for obj in batch:
+                expected = actual.get(obj.pk, zero)
+                if any(getattr(obj, f) != expected[f] for f in counters):
+                    for f in counters:
+                        setattr(obj, f, expected[f])
+                    stale.append(obj)
+            fixed += len(stale)
+            if stale and not dry_run:
+                with transaction.atomic():
+                    model.objects.bulk_update(stale, counters)
+        return fixed
@@ -0,0 +1,124 @@
+"""Bulk community membership writer.
+
+Registration and imports used to run ``get_or_create`` + ``members.add``
+(and a recount) per user and community. Here the slug -> community id map
+is cached, membership rows are written straight into the through table with
+``bulk_create(ignore_conflicts=True)`` and ``members_count`` of the
+touched communities is recounted in one ``UPDATE`` with a ``COUNT``
+subquery.
+
+The insert silently skips rows a concurrent ``join`` inserted after the
+existence check (and, on MySQL, rows whose community was deleted under a
+stale slug -> id map), so neither the counter nor the returned number
+trusts the number of pairs sent.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from foro import cache as response_cache
+from foro.models import Community
+
+logger = logging.getLogger(__name__)
+
+COMMUNITY_IDS_KEY = 'foro:community_ids'
+
+# communities a new user joins according to their role
+ROLE_COMMUNITIES = {
+    'consumer': ['consumidores'],
+    'businessman': ['agroveterinarias'],
+    'veterinario': ['veterinarios'],
+    'agronomo': ['agronomos'],
+    'Specialist': ['especialistas'],
+}
+
+
+def _ids_ttl():
+    return int(getattr(settings, 'FORO_COMMUNITY_IDS_TTL', 3600))
+
+
+def invalidate_community_ids():
+    try:
+        cache.delete(COMMUNITY_IDS_KEY)
+    except Exception:
+        logger.exception('memberships: could not invalidate community id map')
+
+
+def community_ids(slugs, create=True):
+    """Return ``{slug: community_id}`` for ``slugs``, creating missing communities if ``create``."""
+    slugs = set(slugs)
+    try:
+        ids = cache.get(COMMUNITY_IDS_KEY)
+    except Exception:
+        ids = None
+    if ids is None or not slugs.issubset(ids):
+        ids = dict(Community.objects.values_list('slug', 'id'))
+        for slug in slugs.difference(ids) if create else ():
+            comm, _ = Community.objects.get_or_create(
+                slug=slug,
+                defaults={'name': slug.replace('-', ' ').title(), 'short_description': '', 'created_by': None},
+            )
+            ids[slug] = comm.pk
+        try:
+            cache.set(COMMUNITY_IDS_KEY, ids, _ids_ttl())
+        except Exception:
+            logger.exception('memberships: could not cache community id map')
+    return {s: ids[s] for s in slugs if s in ids}
+
+
+def _pairs_lookup(pairs):
+    lookup = Q()
+    for community_id in {c for c, _ in pairs}:
+        lookup |= Q(community_id=community_id, user_id__in=[u for c, u in pairs if c == community_id])
+    return lookup
+
+
+def bulk_add_members(pairs, check_existing=True):
+    """Insert ``(community_id, user_id)`` memberships; returns how many were new.
+
+    ``check_existing=False`` skips the lookup of current rows when the
+    users are known to have no memberships yet (just created); rows that
+    did exist would then be counted as new.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    Membership = Community.members.through
+    with transaction.atomic():
+        if check_existing:
+            pairs -= set(Membership.objects.filter(_pairs_lookup(pairs)).values_list('community_id', 'user_id'))
+            if not pairs:
+                return 0
+        Membership.objects.bulk_create(
+            [Membership(community_id=c, user_id=u) for c, u in pairs],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        # rows of ours that are there now; a concurrent join's row isn't
+        # visible yet (InnoDB snapshot, SQLite single writer)
+        inserted = Membership.objects.filter(_pairs_lookup(pairs)).count()
+        added = {c for c, _ in pairs}
+        live = (Membership.objects.filter(community_id=OuterRef('pk')).order_by()
+                .values('community_id').annotate(n=Count('id')).values('n'))
+        Community.objects.filter(pk__in=added).update(members_count=Coalesce(Subquery(live), 0))
+        response_cache.bump(response_cache.COMMUNITIES, *[response_cache.community_stamp(c) for c in added])
+    return inserted
+
+
+
+def default_memberships(users, role_communities=None, extra_slugs=()):
+    """``(community_id, user_id)`` pairs for ``users`` (objects or ``(pk, role)`` tuples)."""
+    role_communities = ROLE_COMMUNITIES if role_communities is None else role_communities
+    rows = [(u.pk, getattr(u, 'role', None)) if hasattr(u, 'pk') else tuple(u) for u in users]
+    wanted = {pk: list(extra_slugs) + list(role_communities.get(role, [])) for pk, role in rows}
+    ids = community_ids({s for slugs in wanted.values() for s in slugs})
+    return {(ids[s], pk) for pk, slugs in wanted.items() for s in slugs if s in ids}
+
+
+def assign_default_communities(users, check_existing=True, role_communities=None, extra_slugs=()):
+    """Add ``users`` to their role's default communities in one batch. Returns rows inserted."""
+    pairs = default_memberships(users, role_communities, extra_slugs)
+    return bulk_add_members(pairs, check_existing=check_existing)
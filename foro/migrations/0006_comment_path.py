@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:37
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    """Compute path/depth of existing comments from their parent chain."""
+    Comment = apps.get_model('foro', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id').iterator())
+    paths = {}
+
+    def resolve(pk):
+        chain = []
+        while pk is not None and pk not in paths:
+            chain.append(pk)
+            pk = parents.get(pk)
+        prefix, depth = paths.get(pk, ('', -1))
+        for node in reversed(chain):
+            depth += 1
+            prefix = prefix + '%010d/' % node
+            paths[node] = (prefix, depth)
+
+    batch = []
+    for pk in parents:
+        resolve(pk)
+        path, depth = paths[pk]
+        batch.append(Comment(id=pk, path=path, depth=depth))
+        if len(batch) >= 1000:
+            Comment.objects.bulk_update(batch, ['path', 'depth'])
+            batch = []
+    if batch:
+        Comment.objects.bulk_update(batch, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foro', '0005_reaction_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('foro', '0007_notification_aggregation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('actor_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('content_type_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('notif_type', models.CharField(choices=[('post_reply', 'Reply to post'), ('comment_reply', 'Reply to comment'), ('post_reaction', 'Reaction to post'), ('comment_reaction', 'Reaction to comment')], max_length=32)),
+                ('summary', models.CharField(blank=True, max_length=512)),
+                ('actors_count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-created_at', '-id'], name='foro_notif_recipient_list'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'read', '-created_at'], name='foro_notif_recipient_read'),
+        ),
+        migrations.AddField(
+            model_name='notificationarchive',
+            name='recipient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='notificationarchive',
+            index=models.Index(fields=['recipient', '-created_at'], name='foro_notifarch_recipient'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+FULLTEXT_INDEXES = (
+    ('foro_post', 'foro_post_fulltext', 'title, content'),
+    ('foro_comment', 'foro_comment_fulltext', 'content'),
+)
+
+
+def create_fulltext(apps, schema_editor):
+    # MySQL only; other backends search with foro.search.InvertedIndex
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name, columns in FULLTEXT_INDEXES:
+        schema_editor.execute('ALTER TABLE %s ADD FULLTEXT INDEX %s (%s)' % (table, name, columns))
+
+
+def drop_fulltext(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name, _ in FULLTEXT_INDEXES:
+        schema_editor.execute('ALTER TABLE %s DROP INDEX %s' % (table, name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foro', '0008_notification_indexes_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext, drop_fulltext),
+    ]
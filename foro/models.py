@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
@@ -21,6 +21,11 @@ class Post(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     views_count = models.PositiveIntegerField(default=0)
     relevance_score = models.FloatField(default=0.0, db_index=True)
+    # contadores de reacciones (ver apply_reaction_delta / reconcile_reaction_counters)
+    reactions_count = models.PositiveIntegerField(default=0)
+    heart_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
@@ -29,8 +34,9 @@ class Post(models.Model):
         return f"{self.title} by {self.author}"
 
     def increment_views(self):
-        self.views_count = models.F('views_count') + 1
-        self.save(update_fields=['views_count'])
+        # write-behind: buffered and flushed in batches by foro.view_counter
+        from foro.view_counter import record_view
+        record_view(self.pk)
 
 
 class Comment(models.Model):
@@ -42,7 +48,18 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     reactions_count = models.PositiveIntegerField(default=0)
+    heart_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
     replies_count = models.PositiveIntegerField(default=0)
+    # Materialized path: ids of every ancestor and the comment itself, each
+    # zero-padded to PATH_STEP chars ("0000000012/0000000045/"). A whole
+    # subthread is `path__startswith=<root path>`, i.e. one index range scan.
+    path = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    PATH_STEP = 11
+    MAX_DEPTH = 255 // PATH_STEP - 1
 
     class Meta:
         ordering = ['-created_at']
@@ -50,9 +67,25 @@ class Comment(models.Model):
     def __str__(self):
         return f"Comment by {self.user} on {self.post}"
 
-    def increment_replies(self):
-        self.replies_count = models.F('replies_count') + 1
-        self.save(update_fields=['replies_count'])
+    @staticmethod
+    def path_segment(pk):
+        return '%010d/' % pk
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # path needs our own pk, so inserts take one extra UPDATE; the
+        # parent's replies_count moves in the same transaction
+        with transaction.atomic():
+            parent_path = ''
+            if self.parent_id:
+                parent_path, parent_depth = Comment.objects.filter(pk=self.parent_id).values_list('path', 'depth').get()
+                self.depth = parent_depth + 1
+            super().save(*args, **kwargs)
+            self.path = parent_path + self.path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+            if self.parent_id:
+                Comment.objects.filter(pk=self.parent_id).update(replies_count=models.F('replies_count') + 1)
 
 
 class Reaction(models.Model):
@@ -78,6 +111,69 @@ class Reaction(models.Model):
         return f"{self.type} by {self.user} on {self.content_object}"
 
 
+# Reaction.type -> contador por tipo en Post/Comment
+REACTION_COUNTER_FIELDS = {'heart': 'heart_count', 'like': 'like_count', 'dislike': 'dislike_count'}
+
+
+def apply_reaction_delta(model, object_id, rtype, delta):
+    """Add ``delta`` to the per-type and total reaction counters of a Post/Comment.
+
+    Uses F-expressions so concurrent reactions don't lose updates; call it in
+    the same transaction that creates/deletes the Reaction. Decrements never
+    take a counter below zero. Returns the number of rows updated.
+    """
+    field = REACTION_COUNTER_FIELDS.get(rtype)
+    if field is None or model not in (Post, Comment) or not delta:
+        return 0
+    qs = model.objects.filter(pk=object_id)
+    if delta < 0:
+        qs = qs.filter(**{field + '__gte': -delta, 'reactions_count__gte': -delta})
+    return qs.update(**{field: models.F(field) + delta, 'reactions_count': models.F('reactions_count') + delta})
+
+
+class ReactionTargetMissing(Exception):
+    pass
+
+
+def toggle_reaction(user_id, model, object_id, rtype):
+    """Add the user's ``rtype`` reaction on a Post/Comment, or remove it if present.
+
+    Insert-or-delete and the counter delta run in one transaction. The
+    insert goes first, so the transaction starts by taking a write lock
+    instead of upgrading a read (no gap locks on MySQL), and the unique
+    index decides which case applies. SQLite still serialises writers, so
+    concurrent toggles there can fail with "database is locked".
+    A missing target is detected by the counter UPDATE touching no row.
+    Returns ``(active, row)`` where ``row`` has the target's counters and
+    owner id. Raises ``ReactionTargetMissing``.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    owner_field = 'author_id' if model is Post else 'user_id'
+    lookup = dict(user_id=user_id, content_type=content_type, object_id=object_id, type=rtype)
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                Reaction.objects.create(**lookup)
+        except IntegrityError:
+            # already reacted: remove it; only the request that deleted the
+            # row moves the counters
+            deleted, _ = Reaction.objects.filter(**lookup).delete()
+            if deleted:
+                apply_reaction_delta(model, object_id, rtype, -1)
+            active = False
+        else:
+            if not apply_reaction_delta(model, object_id, rtype, 1):
+                raise ReactionTargetMissing(object_id)
+            active = True
+        row = model.objects.filter(pk=object_id).values(
+            owner_field, 'reactions_count', *REACTION_COUNTER_FIELDS.values()
+        ).first()
+    if row is None:
+        raise ReactionTargetMissing(object_id)
+    row['owner_id'] = row.pop(owner_field)
+    return active, row
+
+
 class Notification(models.Model):
     NOTIF_TYPES = (
         ('post_reply', 'Reply to post'),
@@ -93,16 +189,47 @@ class Notification(models.Model):
     content_object = GenericForeignKey('content_type', 'object_id')
     notif_type = models.CharField(max_length=32, choices=NOTIF_TYPES)
     summary = models.CharField(max_length=512, blank=True)
+    # eventos agregados en esta fila ("X y N más"); actor es el más reciente.
+    # actor_ids guarda los últimos actores distintos para no contarlos dos veces
+    actors_count = models.PositiveIntegerField(default=1)
+    actor_ids = models.JSONField(default=list, blank=True)
     read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # listado por cursor (recipient, -created_at, -id) y conteo de no leídas
+            models.Index(fields=['recipient', '-created_at', '-id'], name='foro_notif_recipient_list'),
+            models.Index(fields=['recipient', 'read', '-created_at'], name='foro_notif_recipient_read'),
+        ]
 
     def __str__(self):
         return f"Notification {self.notif_type} -> {self.recipient}"
 
 
+class NotificationArchive(models.Model):
+    """Cold copy of read notifications moved out by ``archive_notifications``."""
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    actor_id = models.PositiveIntegerField(null=True, blank=True)
+    content_type_id = models.PositiveIntegerField(null=True, blank=True)
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    notif_type = models.CharField(max_length=32, choices=Notification.NOTIF_TYPES)
+    summary = models.CharField(max_length=512, blank=True)
+    actors_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['recipient', '-created_at'], name='foro_notifarch_recipient')]
+
+    def __str__(self):
+        return f"Archived notification {self.notif_type} -> {self.recipient_id}"
+
+
 class Community(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True)
@@ -122,52 +249,388 @@ class Community(models.Model):
         return self.name
 
 
+def apply_members_delta(community_ids, delta):
+    """Add ``delta`` to ``members_count`` of ``community_ids`` with one F() UPDATE.
+
+    Never takes a counter below zero; ``reconcile_members_count`` repairs drift.
+    """
+    if not community_ids or not delta:
+        return 0
+    qs = Community.objects.filter(pk__in=list(community_ids))
+    if delta < 0:
+        qs = qs.filter(members_count__gte=-delta)
+    updated = qs.update(members_count=models.F('members_count') + delta)
+    if updated:
+        from foro.cache import COMMUNITIES, bump, community_stamp
+        bump(COMMUNITIES, *[community_stamp(pk) for pk in community_ids])
+    return updated
+
+
+def add_member(community_id, user_id):
+    """Insert the membership row and count it only if it is new. Returns True if joined.
+
+    Writes the through table directly (no m2m_changed), so concurrent joins of
+    the same user rely on the unique (community, user) index instead of a
+    read-then-write check.
+    """
+    Membership = Community.members.through
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                Membership.objects.create(community_id=community_id, user_id=user_id)
+        except IntegrityError:
+            return False
+        apply_members_delta([community_id], 1)
+    return True
+
+
+def remove_member(community_id, user_id):
+    """Delete the membership row, decrementing by the rows actually deleted. Returns True if left."""
+    Membership = Community.members.through
+    with transaction.atomic():
+        deleted, _ = Membership.objects.filter(community_id=community_id, user_id=user_id).delete()
+        apply_members_delta([community_id], -deleted)
+    return bool(deleted)
+
+
+class AuthorAffinity(models.Model):
+    """How much ``user`` interacts with ``author``'s content (feed boost).
+
+    Kept up to date incrementally by the comment/reaction signals below;
+    ``rebuild_author_affinity`` recomputes it from scratch.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='author_affinities')
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('user', 'author'),)
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.author_id}: {self.score}"
+
+
+class PostChangeLog(models.Model):
+    """Append-only log of posts whose engagement changed (``recompute_relevance`` input).
+
+    ``post_id`` is a plain column, not a FK, so logging stays a cheap insert
+    and rows of deleted posts are simply skipped by the job.
+    """
+    post_id = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"post {self.post_id} changed at {self.created_at}"
+
+
+def log_post_changes(post_ids):
+    """Record that ``post_ids`` need their relevance_score recomputed."""
+    post_ids = {pk for pk in post_ids if pk}
+    if post_ids:
+        PostChangeLog.objects.bulk_create([PostChangeLog(post_id=pk) for pk in post_ids])
+
+
+# Peso de cada interacción en la afinidad usuario -> autor
+AFFINITY_COMMENT_ON_POST = 3
+AFFINITY_REACTION_ON_POST = 2
+AFFINITY_REACTION_ON_COMMENT = 1
+
+
+def bump_affinity(user_id, author_id, delta):
+    """Atomically add ``delta`` to the (user, author) affinity and drop the user's cached feed.
+
+    A negative ``delta`` only updates an existing row: with no row there is
+    nothing to take back, and the user may be in the middle of being deleted.
+    """
+    if not user_id or not author_id or not delta:
+        return
+    updated = AuthorAffinity.objects.filter(user_id=user_id, author_id=author_id).update(score=models.F('score') + delta)
+    if not updated:
+        if delta < 0:
+            return
+        try:
+            with transaction.atomic():
+                AuthorAffinity.objects.create(user_id=user_id, author_id=author_id, score=delta)
+        except IntegrityError:
+            # another request created the row first
+            AuthorAffinity.objects.filter(user_id=user_id, author_id=author_id).update(score=models.F('score') + delta)
+    from foro.feed import invalidate_user_feed
+    invalidate_user_feed(user_id)
+
+
+def _cascading(sender, origin):
+    """True when a post_delete comes from deleting another model (user, post...)."""
+    if origin is None:
+        return False
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return model is not sender
+
+
+def _reaction_affinity(reaction):
+    """Return ``(author_id, weight)`` for the target of a reaction, or ``(None, 0)``."""
+    model = reaction.content_type.model_class()
+    if model is Post:
+        author_id = Post.objects.filter(pk=reaction.object_id).values_list('author_id', flat=True).first()
+        return author_id, AFFINITY_REACTION_ON_POST
+    if model is Comment:
+        author_id = Comment.objects.filter(pk=reaction.object_id).values_list('user_id', flat=True).first()
+        return author_id, AFFINITY_REACTION_ON_COMMENT
+    return None, 0
+
+
 # Signals: keep members_count in sync and auto-assign default communities on user creation
-from django.db.models.signals import m2m_changed, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
 
 @receiver(m2m_changed, sender=Community.members.through)
-def update_members_count(sender, instance, action, pk_set, **kwargs):
+def update_members_count(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Update `members_count` whenever members are added/removed.
+    Keep `members_count` in step with `members.add/remove/clear` (and the
+    reverse `user.communities.*`) by the rows actually changed, with F()
+    updates instead of re-counting the membership table.
     """
-    if action in ("post_add", "post_remove", "post_clear"):
-        instance.members_count = instance.members.count()
-        instance.save(update_fields=["members_count"])
+    # add(): Django already drops ids that were members from pk_set.
+    # remove()/clear(): pk_set is what was asked for, so the rows that really
+    # exist are read in pre_* and applied in post_*
+    if reverse:
+        # instance is a user, pk_set are community ids
+        if action == 'post_add':
+            apply_members_delta(pk_set, 1)
+        elif action in ('pre_remove', 'pre_clear'):
+            rows = sender.objects.filter(user_id=instance.pk)
+            if action == 'pre_remove':
+                rows = rows.filter(community_id__in=pk_set)
+            instance._leaving_community_ids = list(rows.values_list('community_id', flat=True))
+        elif action in ('post_remove', 'post_clear'):
+            apply_members_delta(getattr(instance, '_leaving_community_ids', []), -1)
+            instance._leaving_community_ids = []
+    else:
+        if action == 'post_add':
+            apply_members_delta([instance.pk], len(pk_set))
+        elif action in ('pre_remove', 'pre_clear'):
+            rows = sender.objects.filter(community_id=instance.pk)
+            if action == 'pre_remove':
+                rows = rows.filter(user_id__in=pk_set)
+            instance._members_removing = rows.count()
+        elif action in ('post_remove', 'post_clear'):
+            apply_members_delta([instance.pk], -getattr(instance, '_members_removing', 0))
+            instance._members_removing = 0
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def members_count_on_user_delete(sender, instance, **kwargs):
+    # the cascade deletes membership rows without sending m2m_changed
+    community_ids = Community.members.through.objects.filter(user_id=instance.pk).values_list('community_id', flat=True)
+    apply_members_delta(list(community_ids), -1)
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def add_user_to_default_communities(sender, instance, created, **kwargs):
     """
-    When a new user is created, add them to default communities based on their role.
-    This will create the community if it doesn't exist.
+    When a new user is created, add them to default communities based on their role
+    (``foro.memberships.ROLE_COMMUNITIES``), creating the community if it doesn't exist.
+    Uses the cached slug -> id map and a single bulk insert + counter UPDATE.
     """
+    if not created or not getattr(instance, 'role', None):
+        return
+    from foro.memberships import assign_default_communities
+
+    # a brand-new user has no memberships yet, skip the existence lookup
+    assign_default_communities([instance], check_existing=False)
+
+
+@receiver(post_save, sender=Community)
+@receiver(post_delete, sender=Community)
+def community_ids_on_change(sender, instance, **kwargs):
+    from foro.memberships import invalidate_community_ids
+
+    invalidate_community_ids()
+
+
+# Signals: incremental author affinity for the personalised feed (PostViewSet.relevant)
+@receiver(post_save, sender=Comment)
+def comment_affinity_on_create(sender, instance, created, **kwargs):
     if not created:
         return
+    author_id = Post.objects.filter(pk=instance.post_id).values_list('author_id', flat=True).first()
+    bump_affinity(instance.user_id, author_id, AFFINITY_COMMENT_ON_POST)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_replies_count_on_delete(sender, instance, **kwargs):
+    if instance.parent_id:
+        Comment.objects.filter(pk=instance.parent_id, replies_count__gt=0).update(replies_count=models.F('replies_count') - 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_affinity_on_delete(sender, instance, origin=None, **kwargs):
+    # cascades (user/post deleted) skip N lookups + feed invalidations: a
+    # deleted user's rows go with it, rebuild_author_affinity corrects the rest
+    if _cascading(sender, origin):
+        return
+    author_id = Post.objects.filter(pk=instance.post_id).values_list('author_id', flat=True).first()
+    bump_affinity(instance.user_id, author_id, -AFFINITY_COMMENT_ON_POST)
+
+
+@receiver(post_save, sender=Reaction)
+def reaction_affinity_on_create(sender, instance, created, **kwargs):
+    if not created:
+        return
+    author_id, weight = _reaction_affinity(instance)
+    bump_affinity(instance.user_id, author_id, weight)
+
+
+@receiver(post_delete, sender=Reaction)
+def reaction_affinity_on_delete(sender, instance, origin=None, **kwargs):
+    if _cascading(sender, origin):
+        return
+    author_id, weight = _reaction_affinity(instance)
+    bump_affinity(instance.user_id, author_id, -weight)
+
+
+@receiver(post_save, sender=Post)
+def post_feed_on_create(sender, instance, created, **kwargs):
+    if created:
+        from foro.feed import invalidate_all_feeds
+        invalidate_all_feeds()
+
+
+@receiver(post_delete, sender=Post)
+def post_feed_on_delete(sender, instance, **kwargs):
+    from foro.feed import invalidate_all_feeds
+    invalidate_all_feeds()
+
+
+# Signals: keep the in-memory search index (foro.search, non-MySQL backends) current
+@receiver(post_save, sender=Post)
+def search_index_post_on_save(sender, instance, **kwargs):
+    from foro.search import index_post
+    index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def search_index_post_on_delete(sender, instance, **kwargs):
+    from foro.search import index_post
+    index_post(instance, deleted=True)
+
+
+@receiver(post_save, sender=Comment)
+def search_index_comment_on_save(sender, instance, **kwargs):
+    from foro.search import index_comment
+    index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def search_index_comment_on_delete(sender, instance, **kwargs):
+    from foro.search import index_comment
+    index_comment(instance, deleted=True)
+
 
-    role = getattr(instance, 'role', None)
-    if not role:
+# Signals: log engagement changes for the relevance job (recompute_relevance)
+@receiver(post_save, sender=Post)
+def post_change_on_create(sender, instance, created, **kwargs):
+    if created:
+        log_post_changes([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+def post_change_on_comment(sender, instance, created, **kwargs):
+    if created:
+        log_post_changes([instance.post_id])
+
+
+@receiver(post_delete, sender=Comment)
+def post_change_on_comment_delete(sender, instance, **kwargs):
+    log_post_changes([instance.post_id])
+
+
+@receiver(post_save, sender=Reaction)
+@receiver(post_delete, sender=Reaction)
+def post_change_on_reaction(sender, instance, **kwargs):
+    if kwargs.get('created') is False:
         return
+    if instance.content_type_id == ContentType.objects.get_for_model(Post).id:
+        log_post_changes([instance.object_id])
+
+
+# Signals: keep the per-community ranked windows (foro.community_feed) current.
+# Scores are read after commit, once the denormalized counters are written.
+def _refresh_community_feed(post_id):
+    from foro.community_feed import refresh_post
+    transaction.on_commit(lambda: refresh_post(post_id))
+
+
+@receiver(post_save, sender=Post)
+def community_feed_on_post_save(sender, instance, **kwargs):
+    if instance.community_id:
+        _refresh_community_feed(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def community_feed_on_post_delete(sender, instance, **kwargs):
+    from foro.community_feed import remove_post
+    pk, community_id = instance.pk, instance.community_id
+    transaction.on_commit(lambda: remove_post(pk, community_id))
+
 
-    # Mapping from role value to list of community slugs to join
-    role_map = {
-        'consumer': ['consumidores'],
-        'businessman': ['agroveterinarias'],
-        'veterinario': ['veterinarios'],
-        'agronomo': ['agronomos'],
-        'Specialist': ['especialistas'],
-    }
-
-    slugs = role_map.get(role, [])
-    for slug in slugs:
-        community, created_c = Community.objects.get_or_create(
-            slug=slug,
-            defaults={
-                'name': slug.replace('-', ' ').title(),
-                'short_description': '',
-                'created_by': None,
-            }
-        )
-        # add member
-        community.members.add(instance)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def community_feed_on_comment(sender, instance, **kwargs):
+    if kwargs.get('created') is not False:
+        _refresh_community_feed(instance.post_id)
+
+
+@receiver(post_save, sender=Reaction)
+@receiver(post_delete, sender=Reaction)
+def community_feed_on_reaction(sender, instance, **kwargs):
+    if kwargs.get('created') is not False and instance.content_type_id == ContentType.objects.get_for_model(Post).id:
+        _refresh_community_feed(instance.object_id)
+
+
+# Signals: invalidate cached anonymous responses (foro.cache). Deletes of a
+# post's comments/reactions run before the post row goes, so lookups work.
+def _community_of_post(post_id):
+    return Post.objects.filter(pk=post_id).values_list('community_id', flat=True).first()
+
+
+def _bump_post_responses(post_id, community_id):
+    from foro.cache import POSTS, bump, community_stamp, post_stamp
+    bump(POSTS, post_stamp(post_id), community_stamp(community_id) if community_id else None)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def response_cache_on_post(sender, instance, **kwargs):
+    _bump_post_responses(instance.pk, instance.community_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def response_cache_on_comment(sender, instance, **kwargs):
+    if Comment.post.is_cached(instance):
+        community_id = instance.post.community_id
+    else:
+        community_id = _community_of_post(instance.post_id)
+    _bump_post_responses(instance.post_id, community_id)
+
+
+@receiver(post_save, sender=Reaction)
+@receiver(post_delete, sender=Reaction)
+def response_cache_on_reaction(sender, instance, **kwargs):
+    if kwargs.get('created') is False:
+        return
+    if instance.content_type_id == ContentType.objects.get_for_model(Post).id:
+        _bump_post_responses(instance.object_id, _community_of_post(instance.object_id))
+    elif instance.content_type_id == ContentType.objects.get_for_model(Comment).id:
+        row = Comment.objects.filter(pk=instance.object_id).values_list('post_id', 'post__community_id').first()
+        if row:
+            _bump_post_responses(*row)
+
+
+@receiver(post_save, sender=Community)
+@receiver(post_delete, sender=Community)
+def response_cache_on_community(sender, instance, **kwargs):
+    from foro.cache import COMMUNITIES, bump, community_stamp
+    bump(COMMUNITIES, community_stamp(instance.pk))
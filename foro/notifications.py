@@ -0,0 +1,307 @@
+"""Queued, aggregated notification writer.
+
+Views call ``notify()`` instead of inserting a ``Notification`` per event.
+After the request's transaction commits the event is put on an in-process
+queue; a daemon writer thread drains it in batches and writes them with
+``bulk_create``/``bulk_update``. Events for the same recipient, type and
+target inside ``FORO_NOTIFICATION_WINDOW`` seconds collapse into one unread
+row whose ``actors_count`` grows ("Ana and 12 others reacted to your post").
+
+After every batch the touched rows are pushed as ``notification.new``
+events to the ``user_<id>`` channel-layer groups (joined by both the chat
+and presence consumers) together with the recipient's unread count, which
+is also cached for ``/notifications/unread_count/``.
+
+With ``FORO_NOTIFICATIONS_ASYNC = False`` events are written synchronously
+(tests, management commands).
+"""
+import atexit
+import logging
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from foro.models import Comment, Notification, Post
+from tools.gfk import prefetch_generic
+
+logger = logging.getLogger(__name__)
+
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+# distinct actors remembered per row; beyond this repeat actors may be recounted
+MAX_TRACKED_ACTORS = 100
+
+# (singular, aggregated) summary templates per notif_type
+SUMMARIES = {
+    'post_reply': ('{actor} commented on your post', '{actor} and {others} others commented on your post'),
+    'comment_reply': ('{actor} replied to your comment', '{actor} and {others} others replied to your comment'),
+    'post_reaction': ('{actor} reacted {verb}', '{actor} and {others} others reacted to your post'),
+    'comment_reaction': ('{actor} reacted {verb}', '{actor} and {others} others reacted to your comment'),
+}
+
+
+def _is_async():
+    return bool(getattr(settings, 'FORO_NOTIFICATIONS_ASYNC', True))
+
+
+def _window():
+    return int(getattr(settings, 'FORO_NOTIFICATION_WINDOW', 300))
+
+
+def _batch_size():
+    return int(getattr(settings, 'FORO_NOTIFICATION_BATCH', 200))
+
+
+def _unread_ttl():
+    return int(getattr(settings, 'FORO_UNREAD_COUNT_TTL', 300))
+
+
+def _unread_key(user_id):
+    return 'foro:notif:unread:%s' % user_id
+
+
+def actor_name(user):
+    # plain fields only: User.__str__ goes through get_role_display
+    return getattr(user, 'full_name', None) or getattr(user, 'phone_number', None) or 'Someone'
+
+
+def build_summary(notif_type, actor, actors_count, verb=''):
+    one, many = SUMMARIES.get(notif_type, ('{actor} {verb}', '{actor} and {others} others'))
+    if actors_count > 1:
+        return many.format(actor=actor, others=actors_count - 1, verb=verb)[:512]
+    return one.format(actor=actor, verb=verb)[:512]
+
+
+def _recent_actors(actor_ids):
+    """Distinct actor ids, most recent last, capped at ``MAX_TRACKED_ACTORS``."""
+    out = []
+    for a in reversed(actor_ids):
+        if a not in out:
+            out.append(a)
+        if len(out) >= MAX_TRACKED_ACTORS:
+            break
+    return out[::-1]
+
+
+def notify(recipient_id, actor, notif_type, content_type_id, object_id, verb=''):
+    """Queue a notification for ``recipient_id`` about ``actor``'s action on a target."""
+    event = {
+        'recipient_id': recipient_id,
+        'actor_id': actor.pk,
+        'actor_name': actor_name(actor),
+        'notif_type': notif_type,
+        'content_type_id': content_type_id,
+        'object_id': object_id,
+        'verb': verb or '',
+    }
+    if not _is_async():
+        write_events([event])
+        return
+    _ensure_writer()
+    # only enqueue once the triggering comment/reaction is committed
+    transaction.on_commit(lambda: _queue.put(event))
+
+
+def write_events(events):
+    """Aggregate ``events`` and write them; returns the touched Notification rows."""
+    groups = {}
+    for e in events:
+        key = (e['recipient_id'], e['notif_type'], e['content_type_id'], e['object_id'])
+        g = groups.setdefault(key, {'actors': [], 'last': e})
+        if e['actor_id'] in g['actors']:
+            g['actors'].remove(e['actor_id'])
+        g['actors'].append(e['actor_id'])
+        g['last'] = e
+    if not groups:
+        return []
+
+    now = timezone.now()
+    existing = {}
+    candidates = Notification.objects.filter(
+        recipient_id__in={k[0] for k in groups},
+        object_id__in={k[3] for k in groups},
+        read=False,
+        created_at__gte=now - timedelta(seconds=_window()),
+    ).order_by('created_at')
+    for n in candidates:
+        # latest matching row wins
+        existing[(n.recipient_id, n.notif_type, n.content_type_id, n.object_id)] = n
+
+    to_create, to_update = [], []
+    for key, g in groups.items():
+        last = g['last']
+        n = existing.get(key)
+        if n is not None:
+            seen = set(n.actor_ids or [n.actor_id])
+            n.actors_count += len([a for a in g['actors'] if a not in seen])
+            n.actor_ids = _recent_actors((n.actor_ids or [n.actor_id]) + g['actors'])
+            n.actor_id = last['actor_id']
+            n.summary = build_summary(key[1], last['actor_name'], n.actors_count, last['verb'])
+            n.updated_at = now
+            to_update.append(n)
+        else:
+            to_create.append(Notification(
+                recipient_id=key[0], actor_id=last['actor_id'], notif_type=key[1],
+                content_type_id=key[2], object_id=key[3], actors_count=len(g['actors']),
+                actor_ids=_recent_actors(g['actors']),
+                summary=build_summary(key[1], last['actor_name'], len(g['actors']), last['verb']),
+            ))
+    with transaction.atomic():
+        if to_update:
+            Notification.objects.bulk_update(to_update, ['actor', 'actors_count', 'actor_ids', 'summary', 'updated_at'])
+        if to_create:
+            if connection.features.can_return_rows_from_bulk_insert:
+                Notification.objects.bulk_create(to_create)
+            else:
+                # MySQL can't return the ids of a bulk INSERT and the pushed
+                # payload needs them: one INSERT per new row
+                for n in to_create:
+                    n.save(force_insert=True)
+    written = to_update + to_create
+    try:
+        push_notifications(written, {e['actor_id']: e['actor_name'] for e in events})
+    except Exception:
+        logger.exception('notification writer: push failed')
+    return written
+
+
+def refresh_unread_counts(user_ids):
+    """Recount unread notifications for ``user_ids`` in one query and cache them."""
+    user_ids = set(user_ids)
+    counts = dict.fromkeys(user_ids, 0)
+    rows = (Notification.objects.filter(recipient_id__in=user_ids, read=False)
+            .values('recipient_id').annotate(n=Count('id')).order_by())
+    for row in rows:
+        counts[row['recipient_id']] = row['n']
+    try:
+        cache.set_many({_unread_key(u): n for u, n in counts.items()}, _unread_ttl())
+    except Exception:
+        logger.exception('notifications: could not cache unread counts')
+    return counts
+
+
+def unread_count(user_id):
+    try:
+        n = cache.get(_unread_key(user_id))
+    except Exception:
+        n = None
+    if n is None:
+        n = refresh_unread_counts([user_id])[user_id]
+    return n
+
+
+def invalidate_unread_count(user_id):
+    try:
+        cache.delete(_unread_key(user_id))
+    except Exception:
+        logger.exception('notifications: could not invalidate unread count user=%s', user_id)
+
+
+def prefetch_targets(notifications):
+    """Load the post/comment of many notifications with one query per type."""
+    prefetch_generic(notifications, querysets={
+        Post: Post.objects.only('id', 'title'),
+        Comment: Comment.objects.only('id', 'post_id', 'content'),
+    })
+
+
+def target_payload(n):
+    target = n.content_object
+    if isinstance(target, Post):
+        return {'type': 'post', 'id': target.pk, 'title': target.title}
+    if isinstance(target, Comment):
+        return {'type': 'comment', 'id': target.pk, 'post_id': target.post_id, 'excerpt': target.content[:120]}
+    return None
+
+
+def notification_payload(n, actor_name=None, actor_avatar=None):
+    # same shape as NotificationSerializer
+    return {
+        'id': n.pk,
+        'recipient': n.recipient_id,
+        'actor': {'id': n.actor_id, 'name': actor_name, 'avatar': actor_avatar},
+        'notif_type': n.notif_type,
+        'summary': n.summary,
+        'actors_count': n.actors_count,
+        'target': target_payload(n),
+        'read': n.read,
+        'created_at': n.created_at.isoformat() if n.created_at else None,
+        'updated_at': n.updated_at.isoformat() if n.updated_at else None,
+    }
+
+
+def push_notifications(rows, actor_names=None):
+    """Send ``notification.new`` to each recipient's ``user_<id>`` group."""
+    if not rows:
+        return
+    from chat.utils.broadcast import safe_group_send_sync
+
+    actor_names = actor_names or {}
+    avatars = dict(
+        get_user_model().objects.filter(pk__in={n.actor_id for n in rows})
+        .values_list('pk', 'profile_picture')
+    )
+    counts = refresh_unread_counts({n.recipient_id for n in rows})
+    prefetch_targets(rows)
+    for n in rows:
+        # not persisted for retry: clients resync through unread_count/list
+        safe_group_send_sync('user_%s' % n.recipient_id, {
+            'type': 'notification.new',
+            'notification': notification_payload(n, actor_names.get(n.actor_id), avatars.get(n.actor_id)),
+            'unread_count': counts.get(n.recipient_id, 0),
+        }, persist_retry=False)
+
+
+def _drain(first=None):
+    events = [] if first is None else [first]
+    while len(events) < _batch_size():
+        try:
+            events.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return events
+
+
+def _run_writer():
+    while True:
+        events = _drain(_queue.get())
+        try:
+            write_events(events)
+        except Exception:
+            logger.exception('notification writer: failed writing %d events', len(events))
+        finally:
+            close_old_connections()
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run_writer, name='foro-notifications', daemon=True)
+            _writer.start()
+
+
+def flush_pending():
+    """Write whatever is still queued in this process (used at exit)."""
+    events = _drain()
+    while events:
+        try:
+            write_events(events)
+        except Exception:
+            logger.exception('notification writer: flush at exit failed')
+            return
+        events = _drain()
+
+
+atexit.register(flush_pending)
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class NotificationCursorPagination(CursorPagination):
+    """Keyset pagination for the notification inbox.
+
+    Pages are ``WHERE recipient = ? AND created_at < cursor`` range reads
+    off the ``(recipient, -created_at, -id)`` index instead of OFFSET scans
+    (DRF adds a small offset only for ties on ``created_at``), and stay
+    stable while new notifications arrive at the top.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
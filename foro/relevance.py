@@ -0,0 +1,123 @@
+"""Batch recomputation of ``Post.relevance_score``.
+
+Engagement-changing events (new post, comment, post reaction, flushed
+views) append the post id to ``PostChangeLog``. ``recompute_relevance``
+(cron) reads the distinct ids logged since its last run in chunks, scores
+each chunk in one vectorized pass and writes it back with ``bulk_update``;
+the processed log rows are then deleted.
+
+    engagement = VIEWS_WEIGHT * log1p(views) + COMMENT_WEIGHT * comments
+                 + HEART_WEIGHT * hearts + LIKE_WEIGHT * likes - DISLIKE_WEIGHT * dislikes
+    relevance  = max(engagement, 0) / (age_hours + 2) ** GRAVITY
+
+Scores of untouched posts only decay when recomputed, so run the job with
+``--all`` now and then (e.g. nightly).
+"""
+import math
+import time
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from foro.models import Comment, Post, PostChangeLog
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+VIEWS_WEIGHT = 1.0
+COMMENT_WEIGHT = 3.0
+HEART_WEIGHT = 2.0
+LIKE_WEIGHT = 1.0
+DISLIKE_WEIGHT = 1.0
+GRAVITY = 1.5
+
+
+def compute_scores(views, comments, hearts, likes, dislikes, ages_hours):
+    """Return the relevance of each post; all arguments are equal-length sequences."""
+    if np is not None:
+        def f(xs):
+            return np.asarray(xs, dtype=np.float64)
+
+        engagement = (
+            VIEWS_WEIGHT * np.log1p(f(views)) + COMMENT_WEIGHT * f(comments)
+            + HEART_WEIGHT * f(hearts) + LIKE_WEIGHT * f(likes) - DISLIKE_WEIGHT * f(dislikes)
+        )
+        ages = np.maximum(f(ages_hours), 0.0)
+        return (np.maximum(engagement, 0.0) / np.power(ages + 2.0, GRAVITY)).tolist()
+    out = []
+    for v, c, h, lk, d, a in zip(views, comments, hearts, likes, dislikes, ages_hours):
+        engagement = VIEWS_WEIGHT * math.log1p(v) + COMMENT_WEIGHT * c + HEART_WEIGHT * h + LIKE_WEIGHT * lk - DISLIKE_WEIGHT * d
+        out.append(max(engagement, 0.0) / (max(a, 0.0) + 2.0) ** GRAVITY)
+    return out
+
+
+def recompute_posts(post_ids, now=None):
+    """Recompute and store relevance_score for ``post_ids``; returns how many posts were updated."""
+    now = now or timezone.now()
+    rows = list(
+        Post.objects.filter(pk__in=list(post_ids))
+        .values_list('pk', 'views_count', 'heart_count', 'like_count', 'dislike_count', 'created_at')
+    )
+    if not rows:
+        return 0
+    comments = dict(
+        Comment.objects.filter(post_id__in=[r[0] for r in rows])
+        .values('post_id').annotate(n=Count('id')).order_by().values_list('post_id', 'n')
+    )
+    scores = compute_scores(
+        [r[1] for r in rows],
+        [comments.get(r[0], 0) for r in rows],
+        [r[2] for r in rows],
+        [r[3] for r in rows],
+        [r[4] for r in rows],
+        [(now - r[5]).total_seconds() / 3600.0 for r in rows],
+    )
+    posts = [Post(pk=r[0], relevance_score=round(s, 6)) for r, s in zip(rows, scores)]
+    Post.objects.bulk_update(posts, ['relevance_score'])
+    return len(posts)
+
+
+def _chunks(ids, size):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def recompute_changed(chunk_size=1000, now=None):
+    """Process every post logged in ``PostChangeLog`` up to now.
+
+    Returns ``(posts_updated, seconds)``. Changes logged while the job runs
+    have higher log ids and are left for the next run.
+    """
+    start = time.perf_counter()
+    last_log_id = PostChangeLog.objects.aggregate(m=Max('id'))['m']
+    if last_log_id is None:
+        return 0, 0.0
+    pending = PostChangeLog.objects.filter(id__lte=last_log_id)
+    ids = list(pending.order_by('post_id').values_list('post_id', flat=True).distinct())
+    updated = 0
+    for chunk in _chunks(ids, chunk_size):
+        with transaction.atomic():
+            updated += recompute_posts(chunk, now=now)
+    pending.delete()
+    return updated, time.perf_counter() - start
+
+
+def recompute_all(chunk_size=1000, now=None):
+    """Recompute every post, walking the table in primary-key chunks; clears the change log."""
+    start = time.perf_counter()
+    last_log_id = PostChangeLog.objects.aggregate(m=Max('id'))['m']
+    updated = 0
+    last_pk = 0
+    while True:
+        chunk = list(Post.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1]
+        with transaction.atomic():
+            updated += recompute_posts(chunk, now=now)
+    if last_log_id is not None:
+        PostChangeLog.objects.filter(id__lte=last_log_id).delete()
+    return updated, time.perf_counter() - start
@@ -0,0 +1,258 @@
+"""Forum search over post titles/contents and comment contents.
+
+Two backends produce ``{post_id: text_rank}`` for a query:
+
+- ``fulltext``: MySQL ``MATCH ... AGAINST`` on the FULLTEXT indexes created
+  by migration 0009 (``foro_post(title, content)``, ``foro_comment(content)``).
+- ``memory``: a pure-Python inverted index (tf-idf) built lazily from the
+  database and kept current by the Post/Comment signals in ``foro.models``.
+  It is per process, meant for SQLite (tests, local dev).
+
+``FORO_SEARCH_BACKEND`` picks one; by default ``fulltext`` on MySQL and
+``memory`` elsewhere. Matches on comments count towards their post with
+``COMMENT_WEIGHT``; the final score adds ``RELEVANCE_WEIGHT *
+Post.relevance_score``. At most ``FORO_SEARCH_MAX_HITS`` posts are ranked per
+query and paged with an opaque ``(score, id)`` keyset cursor.
+"""
+import base64
+import binascii
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from foro.models import Comment, Post
+
+COMMENT_WEIGHT = 0.5
+RELEVANCE_WEIGHT = 0.1
+# same as InnoDB's default innodb_ft_min_token_size
+MIN_TOKEN_LENGTH = 3
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def backend():
+    default = 'fulltext' if connection.vendor == 'mysql' else 'memory'
+    return getattr(settings, 'FORO_SEARCH_BACKEND', default)
+
+
+def max_hits():
+    return int(getattr(settings, 'FORO_SEARCH_MAX_HITS', 1000))
+
+
+def page_size(requested=None):
+    default = int(getattr(settings, 'FORO_SEARCH_PAGE_SIZE', 20))
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, 100))
+
+
+def tokenize(text):
+    """Lowercased, accent-stripped word tokens ("Vacunación" -> "vacunacion")."""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in _TOKEN_RE.findall(text) if len(t) >= MIN_TOKEN_LENGTH]
+
+
+class InvertedIndex:
+    """Thread-safe term -> {doc: term frequency} index with tf-idf scoring."""
+
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._docs = {}  # doc -> (length, terms)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc, text):
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self._remove(doc)
+            if not terms:
+                return
+            for term, tf in terms.items():
+                self._postings[term][doc] = tf
+            self._docs[doc] = (sum(terms.values()), tuple(terms))
+
+    def remove(self, doc):
+        with self._lock:
+            self._remove(doc)
+
+    def _remove(self, doc):
+        entry = self._docs.pop(doc, None)
+        if entry is None:
+            return
+        for term in entry[1]:
+            del self._postings[term][doc]
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def search(self, query):
+        """Return ``{doc: score}`` for docs containing any query term."""
+        scores = defaultdict(float)
+        with self._lock:
+            n_docs = len(self._docs) or 1
+            for term in set(tokenize(query)):
+                docs = self._postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + n_docs / len(docs))
+                for doc, tf in docs.items():
+                    scores[doc] += tf * idf / math.sqrt(self._docs[doc][0])
+        return scores
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _post_doc(post):
+    return ('post', post.pk)
+
+
+def _comment_doc(comment):
+    return ('comment', comment.pk, comment.post_id)
+
+
+def memory_index():
+    """The process-wide in-memory index, built on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = InvertedIndex()
+                for pk, title, content in Post.objects.values_list('pk', 'title', 'content').iterator():
+                    index.add(('post', pk), '%s %s' % (title, content))
+                for pk, post_id, content in Comment.objects.values_list('pk', 'post_id', 'content').iterator():
+                    index.add(('comment', pk, post_id), content)
+                _index = index
+    return _index
+
+
+def reset_memory_index():
+    global _index
+    _index = None
+
+
+def index_post(post, deleted=False):
+    # only maintained once built; a fresh index reads the table anyway
+    if _index is None:
+        return
+    # a post's comments are deleted one by one (they have signals), each
+    # through index_comment
+    if deleted:
+        _index.remove(_post_doc(post))
+    else:
+        _index.add(_post_doc(post), '%s %s' % (post.title, post.content))
+
+
+def index_comment(comment, deleted=False):
+    if _index is None:
+        return
+    if deleted:
+        _index.remove(_comment_doc(comment))
+    else:
+        _index.add(_comment_doc(comment), comment.content)
+
+
+def _merge(post_ranks, comment_ranks):
+    # a post scores its own rank plus its best matching comment's
+    hits = defaultdict(float)
+    for pk, rank in post_ranks:
+        hits[pk] += rank
+    best = {}
+    for post_id, rank in comment_ranks:
+        best[post_id] = max(rank, best.get(post_id, 0.0))
+    for post_id, rank in best.items():
+        hits[post_id] += COMMENT_WEIGHT * rank
+    return hits
+
+
+def _memory_hits(query, community_id=None):
+    scores = memory_index().search(query).items()
+    hits = _merge(
+        ((doc[1], s) for doc, s in scores if doc[0] == 'post'),
+        ((doc[2], s) for doc, s in scores if doc[0] == 'comment'),
+    )
+    if community_id is not None and hits:
+        # before ranked_hits cuts to max_hits, or other communities' posts
+        # could crowd this one's out of the top
+        in_community = Post.objects.filter(community_id=community_id, pk__in=list(hits)).values_list('pk', flat=True)
+        hits = {pk: hits[pk] for pk in in_community}
+    return hits
+
+
+def _fulltext_hits(query, community_id=None):
+    limit = max_hits()
+    post_match = RawSQL('MATCH (foro_post.title, foro_post.content) AGAINST (%s IN NATURAL LANGUAGE MODE)', [query])
+    comment_match = RawSQL('MATCH (foro_comment.content) AGAINST (%s IN NATURAL LANGUAGE MODE)', [query])
+    posts = Post.objects.annotate(rank=post_match).filter(rank__gt=0)
+    comments = Comment.objects.annotate(rank=comment_match).filter(rank__gt=0)
+    if community_id is not None:
+        posts = posts.filter(community_id=community_id)
+        comments = comments.filter(post__community_id=community_id)
+    return _merge(
+        posts.order_by('-rank').values_list('pk', 'rank')[:limit],
+        comments.order_by('-rank').values_list('post_id', 'rank')[:limit],
+    )
+
+
+def encode_cursor(score, pk):
+    raw = '%r:%d' % (score, pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        score, pk = raw.rsplit(':', 1)
+        return float(score), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, AttributeError):
+        raise InvalidCursor(cursor)
+
+
+def ranked_hits(query, community_id=None):
+    """Return ``[(score, post_id), ...]`` best first, at most ``FORO_SEARCH_MAX_HITS``."""
+    if not tokenize(query):
+        return []
+    if backend() == 'fulltext':
+        hits = _fulltext_hits(query, community_id)
+    else:
+        hits = _memory_hits(query, community_id)
+    if not hits:
+        return []
+    if len(hits) > max_hits():
+        hits = dict(sorted(hits.items(), key=lambda kv: kv[1], reverse=True)[:max_hits()])
+    rows = Post.objects.filter(pk__in=list(hits))
+    if community_id is not None:
+        rows = rows.filter(community_id=community_id)
+    ranked = [
+        (round(hits[pk] + RELEVANCE_WEIGHT * (relevance or 0.0), 6), pk)
+        for pk, relevance in rows.values_list('pk', 'relevance_score')
+    ]
+    ranked.sort(reverse=True)
+    return ranked[:max_hits()]
+
+
+def search_posts(query, community_id=None, cursor=None, limit=None):
+    """Return ``(post_ids, next_cursor)`` for one page of results."""
+    limit = page_size(limit)
+    ranked = ranked_hits(query, community_id)
+    if cursor:
+        after = decode_cursor(cursor)
+        ranked = [row for row in ranked if row < after]
+    page = ranked[:limit]
+    next_cursor = encode_cursor(*page[-1]) if len(ranked) > limit else None
+    return [pk for _, pk in page], next_cursor
@@ -2,6 +2,9 @@ from rest_framework import serializers
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from .models import Post, Comment, Reaction, Notification, Community
+from .threads import attach_replies, attach_top_comments, max_depth
+from .view_counter import pending_views
+from .notifications import prefetch_targets, target_payload
 from media.models import Media
 
 
@@ -17,31 +20,65 @@ class MediaSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'url', 'description']
 
 
+class CommentListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        missing = [c for c in items if not hasattr(c, '_reply_list')]
+        if missing:
+            attach_replies(missing, depth=max_depth())
+        return super().to_representation(items)
+
+
 class CommentSerializer(serializers.ModelSerializer):
     user = UserBriefSerializer(read_only=True)
     replies = serializers.SerializerMethodField()
+    has_more_replies = serializers.SerializerMethodField()
+    replies_cursor = serializers.SerializerMethodField()
     popularity = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'post', 'parent', 'content', 'media', 'created_at', 'updated_at', 'reactions_count', 'replies_count', 'popularity', 'replies']
-        read_only_fields = ['reactions_count', 'replies_count', 'created_at', 'updated_at', 'popularity', 'replies']
+        fields = ['id', 'user', 'post', 'parent', 'content', 'media', 'created_at', 'updated_at', 'depth', 'reactions_count', 'heart_count', 'like_count', 'dislike_count', 'replies_count', 'popularity', 'replies', 'has_more_replies', 'replies_cursor']
+        read_only_fields = ['depth', 'reactions_count', 'heart_count', 'like_count', 'dislike_count', 'replies_count', 'created_at', 'updated_at', 'popularity', 'replies', 'has_more_replies', 'replies_cursor']
+        list_serializer_class = CommentListSerializer
 
     def get_replies(self, obj):
-        # order replies by popularity (reactions + replies)
-        qs = obj.replies.all()
-        qs = sorted(qs, key=lambda c: (c.reactions_count + c.replies_count), reverse=True)
-        return CommentSerializer(qs, many=True, context=self.context).data
+        # replies ordered by popularity (reactions + replies), depth-limited
+        # and batch-loaded per level by foro.threads; the rest is paged from
+        # /posts/{id}/comments/?parent=<id>&cursor=<replies_cursor>
+        if not hasattr(obj, '_reply_list'):
+            attach_replies([obj], depth=max_depth())
+        return CommentSerializer(obj._reply_list, many=True, context=self.context).data
+
+    def get_has_more_replies(self, obj):
+        return getattr(obj, '_has_more_replies', False)
+
+    def get_replies_cursor(self, obj):
+        return getattr(obj, '_replies_cursor', None)
 
     def get_popularity(self, obj):
         return obj.reactions_count + obj.replies_count
 
 
+class PostListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        missing = [p for p in items if not hasattr(p, '_comment_tree')]
+        if missing:
+            attach_top_comments(missing)
+        pending = pending_views([p.pk for p in items])
+        for p in items:
+            p._pending_views = pending.get(p.pk, 0)
+        return super().to_representation(items)
+
+
 class PostSerializer(serializers.ModelSerializer):
     author = UserBriefSerializer(read_only=True)
     comments = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
-    reactions_count = serializers.SerializerMethodField()
+    views_count = serializers.SerializerMethodField()
     media = MediaSerializer(read_only=True)
     community = serializers.SerializerMethodField()
 
@@ -49,30 +86,31 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        fields = ['id', 'author', 'title', 'content', 'media', 'community', 'community_id', 'created_at', 'updated_at', 'views_count', 'relevance_score', 'comments_count', 'reactions_count', 'comments']
-        read_only_fields = ['created_at', 'updated_at', 'views_count', 'relevance_score', 'comments', 'comments_count', 'reactions_count']
+        fields = ['id', 'author', 'title', 'content', 'media', 'community', 'community_id', 'created_at', 'updated_at', 'views_count', 'relevance_score', 'comments_count', 'reactions_count', 'heart_count', 'like_count', 'dislike_count', 'comments']
+        read_only_fields = ['created_at', 'updated_at', 'views_count', 'relevance_score', 'comments', 'comments_count', 'reactions_count', 'heart_count', 'like_count', 'dislike_count']
+        list_serializer_class = PostListSerializer
 
     def get_comments(self, obj):
-        # top-level comments ordered by popularity
-        qs = obj.comments.filter(parent__isnull=True)
-        qs = sorted(qs, key=lambda c: (c.reactions_count + c.replies_count), reverse=True)
-        return CommentSerializer(qs, many=True, context=self.context).data
+        # only the top FORO_POST_TOP_COMMENTS top-level comments, by popularity
+        if not hasattr(obj, '_comment_tree'):
+            attach_top_comments([obj])
+        return CommentSerializer(obj._comment_tree, many=True, context=self.context).data
 
     def get_comments_count(self, obj):
+        # annotated by PostViewSet.get_queryset
+        if getattr(obj, 'num_comments', None) is not None:
+            return obj.num_comments
         try:
             return obj.comments.count()
         except Exception:
             return 0
 
-    def get_reactions_count(self, obj):
-        # Count reactions linked to this post
-        try:
-            from .models import Reaction
-            from django.contrib.contenttypes.models import ContentType
-            ct = ContentType.objects.get_for_model(obj.__class__)
-            return Reaction.objects.filter(content_type=ct, object_id=obj.id).count()
-        except Exception:
-            return 0
+    def get_views_count(self, obj):
+        # stored count plus views still buffered in foro.view_counter
+        pending = getattr(obj, '_pending_views', None)
+        if pending is None:
+            pending = pending_views([obj.pk]).get(obj.pk, 0) if obj.pk else 0
+        return obj.views_count + pending
 
     def get_community(self, obj):
         if obj.community is None:
@@ -89,13 +127,26 @@ class ReactionSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'user']
 
 
+class NotificationListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        # targets (post/comment GFK) with one query per content type, not per row
+        prefetch_targets(items)
+        return super().to_representation(items)
+
+
 class NotificationSerializer(serializers.ModelSerializer):
     actor = UserBriefSerializer(read_only=True)
+    target = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
-        fields = ['id', 'recipient', 'actor', 'notif_type', 'summary', 'read', 'created_at']
-        read_only_fields = ['created_at']
+        fields = ['id', 'recipient', 'actor', 'notif_type', 'summary', 'actors_count', 'target', 'read', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at', 'actors_count']
+        list_serializer_class = NotificationListSerializer
+
+    def get_target(self, obj):
+        return target_payload(obj)
 
 
 class CommunitySerializer(serializers.ModelSerializer):
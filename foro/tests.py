@@ -0,0 +1,794 @@
+import io
+from datetime import timedelta
+from unittest import mock, skipIf
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection as default_connection
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from foro.models import (
+    AuthorAffinity, Comment, Community, Notification, NotificationArchive, Post, PostChangeLog, Reaction,
+    add_member, apply_reaction_delta, remove_member, toggle_reaction,
+)
+from foro.threads import attach_replies
+from foro import community_feed, memberships, notifications, search, view_counter
+from tools import cache_utils
+from tools.middleware.performance import QueryBudgetExceeded
+
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RelevantFeedTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.reader = User.objects.create_user(phone_number='71000001', password='pass1234', full_name='Reader')
+        self.friend = User.objects.create_user(phone_number='71000002', password='pass1234', full_name='Friend')
+        self.other = User.objects.create_user(phone_number='71000003', password='pass1234', full_name='Other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def _affinity(self, author):
+        row = AuthorAffinity.objects.filter(user=self.reader, author=author).first()
+        return row.score if row else 0
+
+    def test_affinity_follows_comments_and_reactions(self):
+        post = Post.objects.create(author=self.friend, title='t', content='c')
+        comment = Comment.objects.create(user=self.reader, post=post, content='hola')
+        reaction = Reaction.objects.create(
+            user=self.reader, type='like',
+            content_type=ContentType.objects.get_for_model(Post), object_id=post.id,
+        )
+        self.assertEqual(self._affinity(self.friend), 5)
+
+        reaction.delete()
+        comment.delete()
+        self.assertEqual(self._affinity(self.friend), 0)
+
+    def test_deleting_a_user_with_comments_and_reactions(self):
+        post = Post.objects.create(author=self.friend, title='t', content='c')
+        Comment.objects.create(user=self.reader, post=post, content='hola')
+        Reaction.objects.create(user=self.reader, type='like', content_type=ContentType.objects.get_for_model(Post), object_id=post.id)
+        self.reader.delete()
+        default_connection.check_constraints()
+        self.assertFalse(AuthorAffinity.objects.exists())
+
+    def test_relevant_boosts_authors_the_user_interacts_with(self):
+        friend_post = Post.objects.create(author=self.friend, title='old', content='c')
+        newer = Post.objects.create(author=self.other, title='new', content='c')
+        ids = [p['id'] for p in self.client.get('/api/foro/posts/relevant/').data]
+        self.assertEqual(ids, [newer.id, friend_post.id])
+
+        # a comment changes the affinity and must invalidate the cached ranking
+        Comment.objects.create(user=self.reader, post=friend_post, content='hola')
+        ids = [p['id'] for p in self.client.get('/api/foro/posts/relevant/').data]
+        self.assertEqual(ids, [friend_post.id, newer.id])
+
+        AuthorAffinity.objects.all().delete()
+        call_command('rebuild_author_affinity', stdout=io.StringIO())
+        self.assertEqual(self._affinity(self.friend), 3)
+
+
+# a long flush interval keeps buffered views from adding an UPDATE mid-test
+@override_settings(FORO_VIEWS_FLUSH_INTERVAL=3600)
+class PostQueryCountTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(phone_number='7200000%d' % i, password='pass1234', full_name='U%d' % i)
+            for i in range(3)
+        ]
+        self.client = APIClient()
+
+    def _make_posts(self, n):
+        post_ct = ContentType.objects.get_for_model(Post)
+        for i in range(n):
+            post = Post.objects.create(author=self.users[i % 3], title='p%d' % i, content='c')
+            top = Comment.objects.create(user=self.users[1], post=post, content='top')
+            Comment.objects.create(user=self.users[2], post=post, parent=top, content='reply')
+            Reaction.objects.create(user=self.users[0], type='like', content_type=post_ct, object_id=post.id)
+            apply_reaction_delta(Post, post.id, 'like', 1)
+
+    def test_list_query_count_does_not_grow_with_posts(self):
+        self._make_posts(2)
+        with self.assertNumQueries(2):
+            small = self.client.get('/api/foro/posts/')
+        self._make_posts(8)
+        with self.assertNumQueries(2):
+            big = self.client.get('/api/foro/posts/')
+        self.assertEqual((len(small.data), len(big.data)), (2, 10))
+        first = big.data[0]
+        self.assertEqual((first['comments_count'], first['reactions_count']), (2, 1))
+        # replies are not embedded in post payloads, only flagged
+        self.assertEqual(first['comments'][0]['replies'], [])
+        self.assertTrue(first['comments'][0]['has_more_replies'])
+
+    def test_detail_query_count(self):
+        self._make_posts(1)
+        post = Post.objects.get()
+        with self.assertNumQueries(2):
+            resp = self.client.get('/api/foro/posts/%d/' % post.id)
+        self.assertEqual(len(resp.data['comments']), 1)
+        self.assertEqual(resp.data['comments_count'], 2)
+
+
+@override_settings(FORO_POST_TOP_COMMENTS=2, FORO_COMMENTS_MAX_DEPTH=2)
+class CommentThreadTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(phone_number='74000001', password='pass1234', full_name='U')
+        self.post = Post.objects.create(author=self.user, title='t', content='c')
+        # reactions 0..4; comment 3 also gets three replies
+        self.roots = [
+            Comment.objects.create(user=self.user, post=self.post, content='root %d' % i, reactions_count=i)
+            for i in range(5)
+        ]
+        for i in range(3):
+            Comment.objects.create(user=self.user, post=self.post, parent=self.roots[3], content='reply %d' % i, reactions_count=i)
+        self.client = APIClient()
+
+    def _get(self, **params):
+        return self.client.get('/api/foro/posts/%d/comments/' % self.post.id, params)
+
+    def test_post_embeds_only_top_comments(self):
+        data = self.client.get('/api/foro/posts/%d/' % self.post.id).data
+        self.assertEqual([c['content'] for c in data['comments']], ['root 3', 'root 4'])
+        self.assertEqual(data['comments'][0]['replies'], [])
+        self.assertTrue(data['comments'][0]['has_more_replies'])
+
+    def test_thread_pages_by_cursor_per_level(self):
+        first = self._get(limit=2)
+        # root 3 ranks first: 3 reactions + 3 replies
+        self.assertEqual([c['content'] for c in first.data['results']], ['root 3', 'root 4'])
+        nested = first.data['results'][0]
+        self.assertEqual([r['content'] for r in nested['replies']], ['reply 2', 'reply 1'])
+        self.assertTrue(nested['has_more_replies'])
+
+        second = self._get(limit=2, cursor=first.data['next'])
+        self.assertEqual([c['content'] for c in second.data['results']], ['root 2', 'root 1'])
+        last = self._get(limit=2, cursor=second.data['next'])
+        self.assertEqual([c['content'] for c in last.data['results']], ['root 0'])
+        self.assertIsNone(last.data['next'])
+
+        more = self._get(parent=self.roots[3].id, limit=2, cursor=nested['replies_cursor'])
+        self.assertEqual([r['content'] for r in more.data['results']], ['reply 0'])
+        self.assertEqual(self._get(cursor='@@').status_code, 400)
+
+    def test_path_index_maintained_on_insert(self):
+        root = Comment.objects.get(pk=self.roots[3].pk)
+        self.assertEqual(root.replies_count, 3)
+        reply = Comment.objects.filter(parent=root).first()
+        deep = Comment.objects.create(user=self.user, post=self.post, parent=reply, content='deep')
+        self.assertEqual((deep.depth, deep.path), (2, root.path + Comment.path_segment(reply.pk) + Comment.path_segment(deep.pk)))
+        self.assertEqual(Comment.objects.filter(path__startswith=root.path).count(), 5)
+
+        with self.assertNumQueries(1):
+            attach_replies([root], depth=2)
+        loaded = {c.pk: c for c in root._reply_list}
+        self.assertEqual([c.content for c in loaded[reply.pk]._reply_list], ['deep'])
+
+        deep.delete()
+        self.assertEqual(Comment.objects.get(pk=reply.pk).replies_count, 0)
+
+
+class ReactionCounterTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(phone_number='73000001', password='pass1234', full_name='A')
+        self.fan = User.objects.create_user(phone_number='73000002', password='pass1234', full_name='F')
+        self.post = Post.objects.create(author=self.author, title='t', content='c')
+        self.client = APIClient()
+        self.client.force_authenticate(self.fan)
+
+    def _react(self, rtype):
+        return self.client.post('/api/foro/reactions/', {'type': rtype, 'content_type': 'post', 'object_id': self.post.id}, format='json')
+
+    def test_counters_follow_create_and_remove(self):
+        heart = self._react('heart')
+        self._react('heart')
+        self._react('like')
+        self.assertEqual(self._react('wow').status_code, 400)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.reactions_count, self.post.heart_count, self.post.like_count), (2, 1, 1))
+
+        self.client.delete('/api/foro/reactions/%d/remove/' % heart.data['id'])
+        self.client.delete('/api/foro/reactions/%d/remove/' % heart.data['id'])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.reactions_count, self.post.heart_count, self.post.like_count), (1, 0, 1))
+
+    def test_reconcile_repairs_drift(self):
+        self._react('dislike')
+        Post.objects.filter(pk=self.post.pk).update(reactions_count=7, dislike_count=0, like_count=3)
+        out = io.StringIO()
+        call_command('reconcile_reaction_counters', stdout=out)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.reactions_count, self.post.dislike_count, self.post.like_count), (1, 1, 0))
+        self.assertIn('Post: fixed 1 rows', out.getvalue())
+
+
+@override_settings(FORO_VIEW_COUNTER_BACKEND='local', FORO_VIEWS_FLUSH_INTERVAL=3600)
+class BufferedViewCounterTests(TestCase):
+
+    def setUp(self):
+        view_counter._local.drain()
+        author = get_user_model().objects.create_user(phone_number='75000001', password='pass1234', full_name='A')
+        self.post = Post.objects.create(author=author, title='t', content='c')
+        self.client = APIClient()
+
+    def test_views_are_buffered_then_flushed_in_batch(self):
+        for _ in range(3):
+            resp = self.client.get('/api/foro/posts/%d/' % self.post.id)
+        self.assertEqual(resp.data['views_count'], 3)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 0)
+
+        out = io.StringIO()
+        call_command('flush_post_views', stdout=out)
+        self.assertIn('Flushed 3 post views', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 3)
+        self.assertEqual(self.client.get('/api/foro/posts/').data[0]['views_count'], 3)
+
+    def test_view_in_redis_is_not_counted_again_when_the_flush_fails(self):
+        client = mock.Mock()
+        client.set.side_effect = ConnectionError('down')
+        with mock.patch.object(view_counter, '_redis_client', return_value=client):
+            view_counter.record_view(self.post.id)
+        client.hincrby.assert_called_once_with(view_counter.PENDING_KEY, self.post.id, 1)
+        self.assertEqual(view_counter._local.get_many([self.post.id]), {})
+
+    def test_sharded_counter_from_threads(self):
+        import threading
+        counter = view_counter.ShardedCounter(shards=4)
+        workers = [threading.Thread(target=lambda: [counter.add(1) for _ in range(500)]) for _ in range(8)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        self.assertEqual(counter.get_many([1]), {1: 4000})
+        self.assertEqual(counter.drain(), {1: 4000})
+        self.assertEqual(counter.get_many([1]), {})
+
+
+@override_settings(FORO_NOTIFICATIONS_ASYNC=False, CACHES=LOCMEM_CACHE,
+                   CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationAggregationTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(phone_number='76000000', password='pass1234', full_name='Autor')
+        self.fans = [
+            User.objects.create_user(phone_number='7600000%d' % i, password='pass1234', full_name='Fan %d' % i)
+            for i in range(1, 5)
+        ]
+        self.post = Post.objects.create(author=self.author, title='t', content='c')
+        self.client = APIClient()
+
+    def _react(self, user, rtype='like'):
+        self.client.force_authenticate(user)
+        self.client.post('/api/foro/reactions/', {'type': rtype, 'content_type': 'post', 'object_id': self.post.id}, format='json')
+
+    def test_burst_of_reactions_collapses_into_one_row(self):
+        for fan in self.fans:
+            self._react(fan)
+        self._react(self.fans[0], 'heart')  # same actor again is not counted twice
+        note = Notification.objects.get(recipient=self.author)
+        self.assertEqual(note.actors_count, 4)
+        self.assertEqual(note.actor_id, self.fans[0].id)
+        self.assertEqual(note.summary, 'Fan 1 and 3 others reacted to your post')
+
+        # once read, a new event starts a fresh row
+        Notification.objects.update(read=True)
+        self._react(self.fans[1], 'heart')
+        fresh = Notification.objects.get(recipient=self.author, read=False)
+        self.assertEqual((fresh.actors_count, fresh.summary), (1, 'Fan 2 reacted heart'))
+
+    def test_batched_events_are_written_together(self):
+        post_ct = ContentType.objects.get_for_model(Post).id
+        events = [
+            {'recipient_id': self.author.id, 'actor_id': fan.id, 'actor_name': 'Fan', 'notif_type': 'post_reply',
+             'content_type_id': post_ct, 'object_id': self.post.id, 'verb': ''}
+            for fan in self.fans
+        ]
+        # lookup of open rows + INSERT (in a savepoint) + actor avatars,
+        # unread recount and targets for the push, whatever the number of events
+        with self.assertNumQueries(7):
+            notifications.write_events(events)
+        self.assertEqual(Notification.objects.get().actors_count, 4)
+
+    def test_pushed_rows_get_ids_without_bulk_insert_returning(self):
+        post_ct = ContentType.objects.get_for_model(Post).id
+        events = [{'recipient_id': self.author.id, 'actor_id': self.fans[0].id, 'actor_name': 'Fan',
+                   'notif_type': notif_type, 'content_type_id': post_ct, 'object_id': self.post.id, 'verb': ''}
+                  for notif_type in ('post_reply', 'post_reaction')]
+        # MySQL can't return the ids of a bulk INSERT
+        with mock.patch.object(type(default_connection.features), 'can_return_rows_from_bulk_insert', False):
+            written = notifications.write_events(events)
+        self.assertEqual(sorted(n.pk for n in written), sorted(Notification.objects.values_list('pk', flat=True)))
+        self.assertEqual({n.pk: n.notif_type for n in written},
+                         dict(Notification.objects.values_list('pk', 'notif_type')))
+
+    def test_new_notification_is_pushed_with_unread_count(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)('user_%d' % self.author.id, channel)
+
+        self._react(self.fans[0])
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['type'], 'notification.new')
+        self.assertEqual(event['unread_count'], 1)
+        self.assertEqual(event['notification']['summary'], 'Fan 1 reacted like')
+
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.get('/api/foro/notifications/unread_count/').data, {'unread_count': 1})
+        note = Notification.objects.get()
+        self.client.post('/api/foro/notifications/mark_read/', {'ids': [note.id]}, format='json')
+        self.assertEqual(self.client.get('/api/foro/notifications/unread_count/').data, {'unread_count': 0})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class NotificationInboxTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(phone_number='77000000', password='pass1234', full_name='Inbox')
+        self.actor = User.objects.create_user(phone_number='77000001', password='pass1234', full_name='Actor')
+        self.notes = [
+            Notification.objects.create(recipient=self.user, actor=self.actor, notif_type='post_reply')
+            for _ in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_targets_cost_one_query_per_content_type(self):
+        post = Post.objects.create(author=self.actor, title='Vacunas', content='c')
+        comments = [Comment.objects.create(user=self.actor, post=post, content='reply %d' % i) for i in range(3)]
+        post_ct, comment_ct = (ContentType.objects.get_for_model(m) for m in (Post, Comment))
+        Notification.objects.filter(pk=self.notes[0].pk).update(content_type=post_ct, object_id=post.pk)
+        for note, comment in zip(self.notes[1:], comments):
+            Notification.objects.filter(pk=note.pk).update(content_type=comment_ct, object_id=comment.pk)
+        Notification.objects.filter(pk=self.notes[4].pk).update(content_type=comment_ct, object_id=999999)
+
+        # page + posts + comments, however many notifications point at them
+        with self.assertNumQueries(3):
+            data = self.client.get('/api/foro/notifications/').data['results']
+        targets = {n['id']: n['target'] for n in data}
+        self.assertEqual(targets[self.notes[0].id], {'type': 'post', 'id': post.id, 'title': 'Vacunas'})
+        self.assertEqual(targets[self.notes[1].id]['excerpt'], 'reply 0')
+        self.assertIsNone(targets[self.notes[4].id])
+
+    def test_list_pages_by_cursor(self):
+        seen = []
+        url = '/api/foro/notifications/?page_size=2'
+        while url:
+            data = self.client.get(url).data
+            seen.extend(n['id'] for n in data['results'])
+            url = data['next']
+        self.assertEqual(seen, [n.id for n in reversed(self.notes)])
+
+    def test_mark_all_read_up_to_id(self):
+        resp = self.client.post('/api/foro/notifications/mark_all_read/', {'up_to_id': self.notes[2].id}, format='json')
+        self.assertEqual(resp.data, {'updated': 3})
+        self.assertEqual(Notification.objects.filter(read=False).count(), 2)
+        self.assertEqual(self.client.get('/api/foro/notifications/unread_count/').data, {'unread_count': 2})
+        resp = self.client.post('/api/foro/notifications/mark_read/', {'ids': [self.notes[0].id, self.notes[4].id]}, format='json')
+        self.assertEqual(resp.data, {'updated': 1})
+
+    def test_archive_moves_old_read_rows(self):
+        old = timezone.now() - timedelta(days=60)
+        Notification.objects.filter(id__in=[n.id for n in self.notes[:3]]).update(created_at=old)
+        Notification.objects.filter(id__in=[self.notes[0].id, self.notes[1].id, self.notes[4].id]).update(read=True)
+        call_command('archive_notifications', days=30, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Notification.objects.values_list('id', flat=True)),
+            [self.notes[2].id, self.notes[3].id, self.notes[4].id],
+        )
+        self.assertEqual(NotificationArchive.objects.filter(recipient=self.user, created_at=old).count(), 2)
+
+
+class CommunityMembersCountTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(phone_number='78000%03d' % i, password='pass1234', full_name='M %d' % i)
+            for i in range(4)
+        ]
+        self.comm = Community.objects.create(name='Ganaderos', slug='ganaderos')
+
+    def _count(self):
+        self.comm.refresh_from_db()
+        return self.comm.members_count
+
+    def test_join_and_leave_are_counted_once(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        url = '/api/foro/communities/%d/' % self.comm.id
+        # lookup, INSERT and one F() UPDATE (plus savepoints); no COUNT(*)
+        with self.assertNumQueries(7):
+            client.post(url + 'join/')
+        client.post(url + 'join/')
+        self.assertEqual(self._count(), 1)
+        client.post(url + 'leave/')
+        client.post(url + 'leave/')
+        self.assertEqual(self._count(), 0)
+
+    def test_m2m_api_uses_actual_delta(self):
+        self.comm.members.add(*self.users[:3])
+        self.comm.members.add(self.users[0], self.users[3])  # one already a member
+        self.assertEqual(self._count(), 4)
+        self.comm.members.remove(self.users[0], self.users[0].pk + 100)
+        self.users[1].communities.remove(self.comm)
+        self.assertEqual(self._count(), 2)
+        self.comm.members.clear()
+        self.assertEqual(self._count(), 0)
+
+    def test_bulk_add_recounts_rows_skipped_by_the_insert(self):
+        Membership = Community.members.through
+        real_bulk_create = Membership.objects.bulk_create
+
+        def join_first(rows, **kwargs):
+            # a join lands between the existence check and the INSERT
+            add_member(self.comm.pk, self.users[0].pk)
+            return real_bulk_create(rows, **kwargs)
+
+        pairs = [(self.comm.pk, u.pk) for u in self.users[:2]]
+        with mock.patch.object(Membership.objects, 'bulk_create', side_effect=join_first):
+            memberships.bulk_add_members(pairs)
+        self.assertEqual(self._count(), 2)
+        self.assertEqual(memberships.bulk_add_members([(self.comm.pk, u.pk) for u in self.users]), 2)
+        self.assertEqual(self._count(), 4)
+
+    def test_reconcile_repairs_drift(self):
+        self.comm.members.add(*self.users)
+        Community.objects.filter(pk=self.comm.pk).update(members_count=42)
+        call_command('reconcile_members_count', stdout=io.StringIO())
+        self.assertEqual(self._count(), 4)
+
+
+# needs concurrent writers: SQLite locks the whole database per write
+CONCURRENT_WRITERS = default_connection.vendor != 'sqlite'
+
+
+@skipIf(not CONCURRENT_WRITERS, 'SQLite does not allow concurrent writers')
+class CommunityMembersConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_join_and_leave(self):
+        import threading
+        from django.db import connection
+
+        User = get_user_model()
+        users = [
+            User.objects.create_user(phone_number='79000%03d' % i, password='pass1234', full_name='C %d' % i)
+            for i in range(6)
+        ]
+        comm = Community.objects.create(name='Concurrencia', slug='concurrencia')
+        errors = []
+
+        def hammer(user, rounds):
+            try:
+                for i in range(rounds):
+                    add_member(comm.pk, user.pk)
+                    add_member(comm.pk, user.pk)
+                    if i % 2:
+                        remove_member(comm.pk, user.pk)
+            except Exception as e:  # pragma: no cover - surfaced by the assert below
+                errors.append(e)
+            finally:
+                connection.close()
+
+        # two threads per user so the same membership row is raced
+        workers = [threading.Thread(target=hammer, args=(u, 6)) for u in users for _ in range(2)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        self.assertEqual(errors, [])
+        comm.refresh_from_db()
+        self.assertEqual(comm.members_count, comm.members.count())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DefaultCommunityTests(TestCase):
+
+    def test_registration_joins_role_community(self):
+        User = get_user_model()
+        User.objects.create_user(phone_number='79100001', password='pass1234', role='consumer')
+        comm = Community.objects.get(slug='consumidores')
+        self.assertEqual(comm.members_count, 1)
+        second = User.objects.create_user(phone_number='79100002', password='pass1234')
+        # slug map is cached: INSERT, COUNT of the new rows and the recount UPDATE (plus savepoint)
+        with self.assertNumQueries(5):
+            memberships.assign_default_communities([(second.pk, 'consumer')], check_existing=False)
+        comm.refresh_from_db()
+        self.assertEqual(comm.members_count, 2)
+
+    def test_backfill_is_bulk_and_idempotent(self):
+        User = get_user_model()
+        users = [User.objects.create_user(phone_number='7920%04d' % i, password='pass1234') for i in range(7)]
+        User.objects.filter(pk__in=[u.pk for u in users[:4]]).update(role='businessman')
+        call_command('backfill_default_communities', chunk_size=3, general=True, stdout=io.StringIO())
+        call_command('backfill_default_communities', chunk_size=3, general=True, stdout=io.StringIO())
+        general = Community.objects.get(slug='general')
+        agro = Community.objects.get(slug='agroveterinarias')
+        self.assertEqual((general.members_count, general.members.count()), (7, 7))
+        self.assertEqual((agro.members_count, agro.members.count()), (4, 4))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, FORO_SEARCH_BACKEND='memory')
+class ForumSearchTests(TestCase):
+
+    def setUp(self):
+        search.reset_memory_index()
+        self.addCleanup(search.reset_memory_index)
+        self.author = get_user_model().objects.create_user(phone_number='79300001', password='pass1234')
+        self.comm = Community.objects.create(name='Lecheros', slug='lecheros')
+        self.mastitis = Post.objects.create(author=self.author, title='Mastitis en vacas', content='Tratamiento de la mastitis', community=self.comm)
+        self.pasto = Post.objects.create(author=self.author, title='Pasto seco', content='Que forraje usar en sequía')
+        self.other = Post.objects.create(author=self.author, title='Consulta', content='Ternero con diarrea')
+        Comment.objects.create(user=self.author, post=self.other, content='Puede ser mastitis de la madre')
+        self.client = APIClient()
+
+    def _search(self, **params):
+        return self.client.get('/api/foro/posts/search/', params).data
+
+    def test_ranks_posts_and_comment_matches(self):
+        data = self._search(q='mastitis')
+        self.assertEqual([p['id'] for p in data['results']], [self.mastitis.id, self.other.id])
+        self.assertEqual([p['id'] for p in self._search(q='sequia')['results']], [self.pasto.id])
+        self.assertEqual([p['id'] for p in self._search(q='mastitis', community=self.comm.id)['results']], [self.mastitis.id])
+
+    def test_community_filter_applies_before_the_hit_limit(self):
+        louder = Post.objects.create(author=self.author, title='Mastitis', content='mastitis mastitis')
+        with override_settings(FORO_SEARCH_MAX_HITS=1):
+            self.assertEqual([p['id'] for p in self._search(q='mastitis')['results']], [louder.id])
+            self.assertEqual([p['id'] for p in self._search(q='mastitis', community=self.comm.id)['results']], [self.mastitis.id])
+
+    def test_cursor_pages_and_index_follows_edits(self):
+        first = self._search(q='mastitis', limit=1)
+        second = self._search(q='mastitis', limit=1, cursor=first['next'])
+        self.assertEqual([first['results'][0]['id'], second['results'][0]['id']], [self.mastitis.id, self.other.id])
+        self.assertIsNone(second['next'])
+
+        self.pasto.content = 'Mastitis por pasto humedo'
+        self.pasto.save()
+        self.mastitis.delete()
+        self.assertEqual({p['id'] for p in self._search(q='mastitis')['results']}, {self.pasto.id, self.other.id})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RelevanceJobTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(phone_number='79400001', password='pass1234')
+        self.fan = User.objects.create_user(phone_number='79400002', password='pass1234')
+        view_counter.flush_views()  # drop views buffered by other tests before post ids get reused
+        self.hot = Post.objects.create(author=self.author, title='hot', content='c')
+        self.cold = Post.objects.create(author=self.author, title='cold', content='c')
+
+    def test_scores_only_changed_posts(self):
+        call_command('recompute_relevance', stdout=io.StringIO())  # consumes the creation log
+        Comment.objects.create(user=self.fan, post=self.hot, content='x')
+        Reaction.objects.create(user=self.fan, type='heart', content_type=ContentType.objects.get_for_model(Post), object_id=self.hot.id)
+        apply_reaction_delta(Post, self.hot.id, 'heart', 1)
+        Post.objects.filter(pk=self.cold.pk).update(relevance_score=-1)  # must not be touched
+
+        out = io.StringIO()
+        call_command('recompute_relevance', stdout=out)
+        self.assertIn('Recomputed relevance for 1 posts', out.getvalue())
+        self.hot.refresh_from_db()
+        self.cold.refresh_from_db()
+        self.assertAlmostEqual(self.hot.relevance_score, 5.0 / 2 ** 1.5, places=3)
+        self.assertEqual(self.cold.relevance_score, -1)
+        self.assertFalse(PostChangeLog.objects.exists())
+
+    def test_vectorized_matches_python_fallback(self):
+        from foro import relevance
+        args = ([0, 10, 3], [0, 2, 1], [1, 0, 5], [0, 4, 0], [0, 1, 9], [0.5, 30.0, 200.0])
+        vectorized = relevance.compute_scores(*args)
+        with mock.patch.object(relevance, 'np', None):
+            plain = relevance.compute_scores(*args)
+        for a, b in zip(vectorized, plain):
+            self.assertAlmostEqual(a, b)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, FORO_COMMUNITY_FEED_BACKEND='local', FORO_NOTIFICATIONS_ASYNC=False)
+class CommunityFeedTests(TestCase):
+
+    def setUp(self):
+        community_feed._local.clear()
+        self.addCleanup(community_feed._local.clear)
+        self.user = get_user_model().objects.create_user(phone_number='79500001', password='pass1234')
+        self.comm = Community.objects.create(name='Porcinos', slug='porcinos')
+        self.posts = [Post.objects.create(author=self.user, title='p%d' % i, content='c', community=self.comm) for i in range(4)]
+        Post.objects.create(author=self.user, title='elsewhere', content='c')
+        self.client = APIClient()
+
+    def _feed(self, **params):
+        return self.client.get('/api/foro/communities/%d/feed/' % self.comm.id, params).data
+
+    def test_orderings_and_cursor(self):
+        Post.objects.filter(pk=self.posts[1].pk).update(reactions_count=5)
+        top = self._feed(order='top', limit=2)
+        self.assertEqual(top['results'][0]['id'], self.posts[1].id)
+        rest = self._feed(order='top', limit=2, cursor=top['next'])
+        self.assertIsNone(rest['next'])
+        seen = [p['id'] for p in top['results'] + rest['results']]
+        self.assertEqual(sorted(seen), sorted(p.id for p in self.posts))
+        self.assertEqual([p['id'] for p in self._feed(order='new')['results']], [p.id for p in reversed(self.posts)])
+        self.assertEqual(self._feed(order='hot')['results'][0]['id'], self.posts[1].id)
+
+    def test_window_follows_events(self):
+        self._feed()  # builds the windows
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/api/foro/comments/', {'post': self.posts[0].id, 'content': 'x'}, format='json')
+            client.post('/api/foro/comments/', {'post': self.posts[0].id, 'content': 'y'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            fresh = Post.objects.create(author=self.user, title='new', content='c', community=self.comm)
+        self.assertEqual(self._feed(order='top')['results'][0]['id'], self.posts[0].id)
+        self.assertEqual(self._feed(order='new')['results'][0]['id'], fresh.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            fresh.delete()
+        self.assertNotIn(fresh.id, [p['id'] for p in self._feed(order='new')['results']])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, FORO_NOTIFICATIONS_ASYNC=False)
+class ReactionToggleTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(phone_number='79600001', password='pass1234')
+        self.fan = User.objects.create_user(phone_number='79600002', password='pass1234')
+        self.post = Post.objects.create(author=self.author, title='t', content='c')
+        self.client = APIClient()
+        self.client.force_authenticate(self.fan)
+
+    def _toggle(self, rtype='like', object_id=None):
+        body = {'type': rtype, 'content_type': 'post', 'object_id': object_id or self.post.id}
+        return self.client.post('/api/foro/reactions/toggle/', body, format='json')
+
+    def test_toggle_on_and_off(self):
+        on = self._toggle().data
+        self.assertEqual((on['active'], on['counts']), (True, {'heart': 0, 'like': 1, 'dislike': 0, 'total': 1}))
+        self._toggle('heart')
+        off = self._toggle().data
+        self.assertEqual((off['active'], off['counts']), (False, {'heart': 1, 'like': 0, 'dislike': 0, 'total': 1}))
+        self.assertEqual(Notification.objects.get(recipient=self.author).actors_count, 1)
+        self.assertEqual(self._toggle(object_id=self.post.id + 99).status_code, 404)
+        self.assertEqual(Reaction.objects.count(), 1)
+
+
+@skipIf(not CONCURRENT_WRITERS, 'SQLite does not allow concurrent writers')
+class ReactionToggleConcurrencyTests(TransactionTestCase):
+
+    @override_settings(FORO_NOTIFICATIONS_ASYNC=False, CACHES=LOCMEM_CACHE)
+    def test_concurrent_toggles_keep_counters_exact(self):
+        import threading
+        from django.db import connection
+
+        User = get_user_model()
+        users = [User.objects.create_user(phone_number='79700%03d' % i, password='pass1234') for i in range(6)]
+        post = Post.objects.create(author=users[0], title='t', content='c')
+        errors = []
+
+        def hammer(user, times):
+            try:
+                for _ in range(times):
+                    toggle_reaction(user.pk, Post, post.pk, 'like')
+            except Exception as e:  # pragma: no cover - surfaced by the assert below
+                errors.append(e)
+            finally:
+                connection.close()
+
+        # two threads per user racing on the same (user, post, type) row
+        workers = [threading.Thread(target=hammer, args=(u, 3 + i % 2)) for i, u in enumerate(users) for _ in range(2)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        self.assertEqual(errors, [])
+        post.refresh_from_db()
+        likes = Reaction.objects.filter(object_id=post.pk, type='like').count()
+        self.assertEqual((post.like_count, post.reactions_count), (likes, likes))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(phone_number='79700001', password='pass1234')
+        self.comm = Community.objects.create(name='Ovinos', slug='ovinos')
+        self.post = Post.objects.create(author=self.user, title='t', content='c', community=self.comm)
+        self.client = APIClient()
+
+    def test_anonymous_detail_is_cached_until_a_comment(self):
+        url = '/api/foro/posts/%d/' % self.post.id
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.data['comments_count'], 0)
+
+        author = APIClient()
+        author.force_authenticate(self.user)
+        author.post('/api/foro/comments/', {'post': self.post.id, 'content': 'x'}, format='json')
+        fresh = self.client.get(url)
+        self.assertEqual(fresh['X-Cache'], 'MISS')
+        self.assertEqual(fresh.data['comments_count'], 1)
+        # authenticated requests bypass the cache
+        self.assertNotIn('X-Cache', author.get(url))
+
+    def test_view_flush_keeps_cached_listings(self):
+        view_counter._local.drain()
+        self.assertEqual(self.client.get('/api/foro/posts/')['X-Cache'], 'MISS')
+        self.client.get('/api/foro/posts/%d/' % self.post.id)
+        view_counter.flush_views()
+        self.assertEqual(self.client.get('/api/foro/posts/')['X-Cache'], 'HIT')
+        detail = self.client.get('/api/foro/posts/%d/' % self.post.id)
+        self.assertEqual((detail['X-Cache'], detail.data['views_count']), ('MISS', 2))
+
+    def test_membership_changes_invalidate_community_list(self):
+        self.assertEqual(self.client.get('/api/foro/communities/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/foro/communities/')['X-Cache'], 'HIT')
+        add_member(self.comm.pk, self.user.pk)
+        listing = self.client.get('/api/foro/communities/')
+        self.assertEqual(listing['X-Cache'], 'MISS')
+        self.assertEqual([c['members_count'] for c in listing.data if c['id'] == self.comm.pk], [1])
+
+    def test_cold_key_is_built_once(self):
+        import time
+
+        from foro import cache as response_cache
+        calls = []
+
+        def build():
+            calls.append(1)
+            return Response({'ok': True})
+
+        request = mock.Mock(method='GET', path='/x/', user=None, query_params=QueryDict(''))
+        key = cache_utils.make_key(response_cache.cache_key(request, 'test'), response_cache.POSTS)
+        cache.add(cache_utils._lock_key(key, None), 1, 5)  # another worker is rebuilding it
+        with mock.patch.object(cache_utils, '_wait', return_value=(cache_utils.ENVELOPE, {'ok': True}, time.time() + 30, 0.0)):
+            hit = response_cache.cached_response(request, 'test', response_cache.POSTS, build)
+        self.assertEqual((hit.data, hit['X-Cache']), ({'ok': True}, 'HIT'))
+        self.assertEqual(calls, [])
+
+
+@override_settings(FORO_RESPONSE_CACHE=False, PERFORMANCE_BUDGET_MODE='raise')
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(phone_number='79800001', password='pass1234')
+        for i in range(10):
+            post = Post.objects.create(author=user, title='t%d' % i, content='c')
+            for _ in range(2):
+                Comment.objects.create(post=post, user=user, content='x')
+        self.client = APIClient()
+
+    def test_list_stays_within_budget_and_reports_server_timing(self):
+        resp = self.client.get('/api/foro/posts/')
+        self.assertEqual(len(resp.data), 10)
+        self.assertRegex(resp['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    def test_over_budget_fails(self):
+        with override_settings(PERFORMANCE_QUERY_BUDGETS={'GET foro-posts-list': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/foro/posts/')
@@ -0,0 +1,157 @@
+"""Depth-limited, cursor-paginated comment threads.
+
+Post payloads only embed the top ``FORO_POST_TOP_COMMENTS`` top-level
+comments; full threads are served level by level from
+``/posts/{id}/comments/``, with nested replies read from the
+``Comment.path`` index in one query. Every level is ordered by popularity
+(reactions + replies, newest first on ties) and paginated with an opaque
+keyset cursor so deep pages don't need OFFSET scans.
+"""
+import base64
+import binascii
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from foro.models import Comment
+
+POPULARITY = F('reactions_count') + F('replies_count')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def top_comments_per_post():
+    return int(getattr(settings, 'FORO_POST_TOP_COMMENTS', 3))
+
+
+def page_size(requested=None):
+    default = int(getattr(settings, 'FORO_COMMENTS_PAGE_SIZE', 20))
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, int(getattr(settings, 'FORO_COMMENTS_MAX_PAGE_SIZE', 100))))
+
+
+def max_depth(requested=None):
+    limit = int(getattr(settings, 'FORO_COMMENTS_MAX_DEPTH', 3))
+    try:
+        depth = int(requested) if requested is not None else limit
+    except (TypeError, ValueError):
+        depth = limit
+    return max(1, min(depth, limit))
+
+
+def encode_cursor(comment):
+    raw = '%d:%d' % (comment.reactions_count + comment.replies_count, comment.pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(popularity, id)`` for a cursor produced by ``encode_cursor``."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        popularity, pk = raw.split(':')
+        return int(popularity), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, AttributeError):
+        raise InvalidCursor(cursor)
+
+
+def _ranked(qs):
+    return qs.select_related('user').annotate(popularity=POPULARITY)
+
+
+def _mark_unloaded(comments):
+    for c in comments:
+        c._reply_list = []
+        c._has_more_replies = c.replies_count > 0
+        c._replies_cursor = None
+
+
+def attach_replies(parents, depth=1, limit=None):
+    """Attach up to ``limit`` replies per comment, ``depth`` levels down.
+
+    A single query covers every level: the materialized path turns each
+    parent's subthread into a ``path LIKE 'prefix%'`` index range, and a
+    ROW_NUMBER window partitioned by parent keeps the ``limit + 1`` most
+    popular replies of every comment in it (the extra row only tells
+    whether there is a next page). Sets ``_reply_list``,
+    ``_has_more_replies`` and ``_replies_cursor`` on every visited comment.
+    """
+    limit = page_size(limit)
+    level = [c for c in parents if c.path]
+    _mark_unloaded(c for c in parents if not c.path)
+    if depth <= 0 or not level:
+        _mark_unloaded(level)
+        return
+    subthreads = Q()
+    for c in level:
+        subthreads |= Q(path__startswith=c.path, depth__gt=c.depth, depth__lte=c.depth + depth)
+    rows = (
+        _ranked(Comment.objects.filter(subthreads))
+        .annotate(rn=Window(RowNumber(), partition_by=F('parent_id'), order_by=[POPULARITY.desc(), F('id').desc()]))
+        .filter(rn__lte=limit + 1)
+        .order_by('depth', 'parent_id', 'rn')
+    )
+    children = defaultdict(list)
+    for row in rows:
+        children[row.parent_id].append(row)
+    # walk down from the requested parents only: rows whose parent did not
+    # make its own level's page are dropped here
+    for _ in range(depth):
+        next_level = []
+        for c in level:
+            kids = children.get(c.pk, [])
+            c._reply_list = kids[:limit]
+            c._has_more_replies = len(kids) > limit
+            c._replies_cursor = encode_cursor(kids[limit - 1]) if c._has_more_replies else None
+            next_level.extend(c._reply_list)
+        level = next_level
+    _mark_unloaded(level)
+
+
+def attach_top_comments(posts, limit=None):
+    """Set ``_comment_tree`` on each post to its top-level comments, most popular first.
+
+    A single windowed query covers the whole page of posts; the replies of
+    these comments are not loaded (clients page them from the thread endpoint).
+    """
+    posts = list(posts)
+    limit = top_comments_per_post() if limit is None else limit
+    by_post = defaultdict(list)
+    if posts and limit > 0:
+        rows = (
+            _ranked(Comment.objects.filter(post_id__in=[p.pk for p in posts], parent__isnull=True))
+            .annotate(rn=Window(RowNumber(), partition_by=F('post_id'), order_by=[POPULARITY.desc(), F('id').desc()]))
+            .filter(rn__lte=limit)
+            .order_by('post_id', 'rn')
+        )
+        for row in rows:
+            by_post[row.post_id].append(row)
+    for p in posts:
+        p._comment_tree = by_post.get(p.pk, [])
+        _mark_unloaded(p._comment_tree)
+
+
+def comment_page(post_id, parent_id=None, cursor=None, limit=None, depth=None):
+    """Return ``(comments, next_cursor)`` for one level of a post's thread.
+
+    ``parent_id`` None means top-level comments. Replies are attached
+    ``depth - 1`` further levels down, each with its own cursor.
+    """
+    limit = page_size(limit)
+    qs = Comment.objects.filter(post_id=post_id)
+    qs = qs.filter(parent__isnull=True) if parent_id is None else qs.filter(parent_id=parent_id)
+    qs = _ranked(qs)
+    if cursor:
+        popularity, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(popularity__lt=popularity) | Q(popularity=popularity, id__lt=pk))
+    rows = list(qs.order_by('-popularity', '-id')[:limit + 1])
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(rows) > limit else None
+    attach_replies(page, depth=max_depth(depth) - 1, limit=limit)
+    return page, next_cursor
@@ -12,5 +12,6 @@ urlpatterns = [
     path('', include(router.urls)),
     # Reactions handled separately (custom ViewSet)
     path('reactions/', ReactionViewSet.as_view({'post': 'create'}), name='foro-reactions'),
+    path('reactions/toggle/', ReactionViewSet.as_view({'post': 'toggle'}), name='foro-reaction-toggle'),
     path('reactions/<int:pk>/remove/', ReactionViewSet.as_view({'delete': 'remove'}), name='foro-reaction-remove'),
 ]
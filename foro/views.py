@@ -1,12 +1,25 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.contenttypes.models import ContentType
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from django.db.models import F
-from .models import Post, Comment, Reaction, Notification, Community
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import (
+    Post, Comment, Reaction, Notification, Community, REACTION_COUNTER_FIELDS,
+    ReactionTargetMissing, add_member, apply_reaction_delta, remove_member, toggle_reaction,
+)
+from .feed import ranked_post_ids
+from .pagination import NotificationCursorPagination
+from .notifications import invalidate_unread_count, notify, unread_count as get_unread_count
+from .threads import InvalidCursor, comment_page
+from .view_counter import record_view
+from . import search as forum_search
+from . import community_feed
+from . import cache as response_cache
 from .serializers import PostSerializer, CommentSerializer, ReactionSerializer, NotificationSerializer, CommunitySerializer
 from media.models import Media
 from django.conf import settings
@@ -17,15 +30,26 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def with_comment_counts(qs):
+    # comment count from a correlated subquery instead of one COUNT per
+    # post; reaction counts are denormalized on Post
+    comments = (Comment.objects.filter(post=OuterRef('pk')).order_by()
+                .values('post').annotate(c=Count('id')).values('c'))
+    return qs.annotate(num_comments=Coalesce(Subquery(comments), 0))
+
+
 class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.all().select_related('author', 'media', 'community')
     serializer_class = PostSerializer
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'comments', 'search']:
             return [AllowAny()]
         return [IsAuthenticated()]
 
+    def get_queryset(self):
+        return with_comment_counts(super().get_queryset())
+
     def perform_create(self, serializer):
         # Expect optional media id in request.data['media_id']
         media_id = self.request.data.get('media_id')
@@ -39,40 +63,99 @@ class PostViewSet(viewsets.ModelViewSet):
             community = get_object_or_404(Community, pk=community_id)
         serializer.save(author=self.request.user, media=media, community=community)
 
+    def list(self, request, *args, **kwargs):
+        # anonymous responses are cached until a post/comment/reaction write (foro/cache.py)
+        build = super().list
+        return response_cache.cached_response(
+            request, 'posts:list', response_cache.POSTS, lambda: build(request, *args, **kwargs),
+            to_cache=response_cache.post_views_stored, on_hit=response_cache.post_views_current,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            instance = self.get_object()
+            instance.increment_views()
+            return Response(self.get_serializer(instance).data)
+
+        def on_hit(data):
+            record_view(int(pk))
+            return response_cache.post_views_current(data)
+
+        pk = kwargs.get(self.lookup_field, '')
+        if not str(pk).isdigit():
+            return build()
+        return response_cache.cached_response(
+            request, 'posts:detail', response_cache.post_stamp(pk), build,
+            to_cache=response_cache.post_views_stored, on_hit=on_hit,
+        )
+
+    @action(detail=True, methods=['get'])
+    def comments(self, request, pk=None):
+        """One level of the post's comment thread, most popular first.
+
+        Query params: ``parent`` (comment id, omit for top-level), ``cursor``
+        (``next``/``replies_cursor`` from a previous response), ``limit`` and
+        ``depth`` (levels of replies to embed, capped by FORO_COMMENTS_MAX_DEPTH).
+        """
+        if not Post.objects.filter(pk=pk).exists():
+            return Response({'detail': 'not found'}, status=status.HTTP_404_NOT_FOUND)
+        parent = request.query_params.get('parent')
+        if parent is not None and not str(parent).isdigit():
+            return Response({'detail': 'parent must be a comment id'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page, next_cursor = comment_page(
+                pk,
+                parent_id=int(parent) if parent is not None else None,
+                cursor=request.query_params.get('cursor'),
+                limit=request.query_params.get('limit'),
+                depth=request.query_params.get('depth'),
+            )
+        except InvalidCursor:
+            return Response({'detail': 'invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = CommentSerializer(page, many=True, context={'request': request})
+        return Response({'results': serializer.data, 'next': next_cursor})
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Full-text search over post titles/contents and comments (see foro/search.py).
+
+        Query params: ``q``, ``community`` (id), ``cursor`` (``next`` of a
+        previous response) and ``limit``. Results are ranked by text match
+        combined with ``relevance_score``.
+        """
+        q = (request.query_params.get('q') or '').strip()
+        if not q:
+            return Response({'detail': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        community = request.query_params.get('community')
+        if community is not None and not str(community).isdigit():
+            return Response({'detail': 'community must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids, next_cursor = forum_search.search_posts(
+                q,
+                community_id=int(community) if community is not None else None,
+                cursor=request.query_params.get('cursor'),
+                limit=request.query_params.get('limit'),
+            )
+        except forum_search.InvalidCursor:
+            return Response({'detail': 'invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        by_id = self.get_queryset().in_bulk(ids)
+        posts = [by_id[pk] for pk in ids if pk in by_id]
+        serializer = PostSerializer(posts, many=True, context={'request': request})
+        return Response({'results': serializer.data, 'next': next_cursor})
+
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def relevant(self, request):
-        # Simple personalized relevance: boost posts from authors the user interacted with
-        user = request.user
-        # build interaction counts: reactions and comments by the user to other authors
-        interacted_authors = {}
-        # comments by user -> posts' authors
-        user_comments = Comment.objects.filter(user=user).select_related('post__author')
-        for c in user_comments:
-            a = c.post.author_id
-            interacted_authors[a] = interacted_authors.get(a, 0) + 3
-        # reactions by user -> content_object might be post or comment
-        user_reacts = Reaction.objects.filter(user=user)
-        for r in user_reacts:
-            obj = r.content_object
-            if hasattr(obj, 'author_id'):
-                a = obj.author_id
-                interacted_authors[a] = interacted_authors.get(a, 0) + 2
-            elif hasattr(obj, 'user_id'):
-                a = getattr(obj, 'user_id')
-                interacted_authors[a] = interacted_authors.get(a, 0) + 1
-
-        posts = list(Post.objects.all().select_related('author'))
-        def score(p):
-            base = p.relevance_score or 0
-            boost = interacted_authors.get(p.author_id, 0)
-            # time decay: more recent posts get slight boost
-            age_hours = (timezone.now() - p.created_at).total_seconds() / 3600.0
-            decay = max(0.1, 1.0 - age_hours / 168.0)
-            return base * 0.6 + boost * 1.2 * decay
-
-        posts.sort(key=lambda p: score(p), reverse=True)
-        page = self.paginate_queryset(posts)
-        serializer = PostSerializer(page, many=True, context={'request': request})
+        # Personalized relevance: recent posts boosted by the user's affinity
+        # with their authors (see foro/feed.py); ranked ids are cached per user
+        ids = ranked_post_ids(request.user.id)
+        page = self.paginate_queryset(ids)
+        if page is None:
+            page = ids
+        by_id = self.get_queryset().in_bulk(page)
+        posts = [by_id[pk] for pk in page if pk in by_id]
+        serializer = PostSerializer(posts, many=True, context={'request': request})
+        if self.paginator is None:
+            return Response(serializer.data)
         return self.get_paginated_response(serializer.data)
 
 
@@ -93,13 +176,15 @@ class CommentViewSet(viewsets.ModelViewSet):
         post = get_object_or_404(Post, pk=post_id)
         if parent_id:
             parent = get_object_or_404(Comment, pk=parent_id)
+            if parent.depth >= Comment.MAX_DEPTH:
+                raise ValidationError({'parent': 'thread is too deep'})
+        # Comment.save keeps path/depth and the parent's replies_count
         comment = serializer.save(user=user, post=post, parent=parent)
-        # update counts and notifications
+        # notifications are queued and aggregated per target (foro.notifications)
         if parent:
-            parent.increment_replies()
-            Notification.objects.create(recipient=parent.user, actor=user, content_object=comment, notif_type='comment_reply', summary=f'{user} replied to your comment')
+            notify(parent.user_id, user, 'comment_reply', ContentType.objects.get_for_model(Comment).id, parent.pk)
         else:
-            Notification.objects.create(recipient=post.author, actor=user, content_object=comment, notif_type='post_reply', summary=f'{user} commented on your post')
+            notify(post.author_id, user, 'post_reply', ContentType.objects.get_for_model(Post).id, post.pk)
 
 
 class ReactionViewSet(viewsets.ViewSet):
@@ -112,50 +197,104 @@ class ReactionViewSet(viewsets.ViewSet):
         obj_id = request.data.get('object_id')
         if ctype not in ['post', 'comment']:
             return Response({'detail':'invalid content_type'}, status=status.HTTP_400_BAD_REQUEST)
+        if rtype not in REACTION_COUNTER_FIELDS:
+            return Response({'detail': 'invalid type'}, status=status.HTTP_400_BAD_REQUEST)
         model = Post if ctype == 'post' else Comment
         target = get_object_or_404(model, pk=obj_id)
         content_type = ContentType.objects.get_for_model(model)
-        # ensure single reaction per type per user
-        obj, created = Reaction.objects.get_or_create(user=request.user, content_type=content_type, object_id=target.pk, type=rtype)
+        # ensure single reaction per type per user; the counters move in the
+        # same transaction as the Reaction row
+        with transaction.atomic():
+            obj, created = Reaction.objects.get_or_create(user=request.user, content_type=content_type, object_id=target.pk, type=rtype)
+            if created:
+                apply_reaction_delta(model, target.pk, rtype, 1)
         if created:
-            # increment counters
-            if isinstance(target, Post):
-                # optional: no counter field on post for reactions; keep in Reaction table
-                pass
-            else:
-                Comment.objects.filter(pk=target.pk).update(reactions_count=F('reactions_count') + 1)
             # notify
-            owner = target.author if hasattr(target, 'author') else target.user
-            Notification.objects.create(recipient=owner, actor=request.user, content_object=target, notif_type=( 'post_reaction' if ctype=='post' else 'comment_reaction' ), summary=f'{request.user} reacted {rtype}')
+            owner_id = target.author_id if ctype == 'post' else target.user_id
+            notify(owner_id, request.user, ('post_reaction' if ctype == 'post' else 'comment_reaction'), content_type.id, target.pk, verb=rtype)
         serializer = ReactionSerializer(obj, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
+    @action(detail=False, methods=['post'])
+    def toggle(self, request):
+        """Add or remove the user's reaction in one transaction.
+
+        Body: ``{type, content_type: 'post'|'comment', object_id}``. Returns
+        ``{active, type, counts: {heart, like, dislike, total}}``.
+        """
+        rtype = request.data.get('type')
+        ctype = request.data.get('content_type')
+        obj_id = request.data.get('object_id')
+        if ctype not in ['post', 'comment']:
+            return Response({'detail': 'invalid content_type'}, status=status.HTTP_400_BAD_REQUEST)
+        if rtype not in REACTION_COUNTER_FIELDS:
+            return Response({'detail': 'invalid type'}, status=status.HTTP_400_BAD_REQUEST)
+        if not str(obj_id).isdigit():
+            return Response({'detail': 'invalid object_id'}, status=status.HTTP_400_BAD_REQUEST)
+        model = Post if ctype == 'post' else Comment
+        try:
+            active, row = toggle_reaction(request.user.pk, model, int(obj_id), rtype)
+        except ReactionTargetMissing:
+            return Response({'detail': 'not found'}, status=status.HTTP_404_NOT_FOUND)
+        if active:
+            notify(row['owner_id'], request.user, ('post_reaction' if ctype == 'post' else 'comment_reaction'),
+                   ContentType.objects.get_for_model(model).id, int(obj_id), verb=rtype)
+        counts = {t: row[f] for t, f in REACTION_COUNTER_FIELDS.items()}
+        counts['total'] = row['reactions_count']
+        return Response({'active': active, 'type': rtype, 'counts': counts})
+
     @action(detail=True, methods=['delete'])
     def remove(self, request, pk=None):
         # remove a reaction by id if owned
         reaction = get_object_or_404(Reaction, pk=pk, user=request.user)
-        # decrement counters if needed
-        target = reaction.content_object
-        if hasattr(target, 'reactions_count'):
-            target.reactions_count = F('reactions_count') - 1
-            target.save(update_fields=['reactions_count'])
-        reaction.delete()
+        with transaction.atomic():
+            # only the request that actually deleted the row decrements the counters
+            deleted, _ = Reaction.objects.filter(pk=reaction.pk).delete()
+            if deleted:
+                # get_for_id is cached; reaction.content_type would be one more query
+                model = ContentType.objects.get_for_id(reaction.content_type_id).model_class()
+                apply_reaction_delta(model, reaction.object_id, reaction.type, -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NotificationCursorPagination
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user)
+        qs = Notification.objects.filter(recipient=self.request.user).select_related('actor')
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            qs = qs.filter(read=False)
+        return qs
 
     @action(detail=False, methods=['post'])
     def mark_read(self, request):
         ids = request.data.get('ids', [])
-        qs = Notification.objects.filter(recipient=request.user, id__in=ids)
-        qs.update(read=True)
-        return Response({'updated': qs.count()})
+        updated = Notification.objects.filter(recipient=request.user, id__in=ids, read=False).update(read=True)
+        invalidate_unread_count(request.user.id)
+        return Response({'updated': updated})
+
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        # un solo UPDATE; up_to_id (el último id que vio el cliente) evita
+        # marcar notificaciones que llegaron después
+        qs = Notification.objects.filter(recipient=request.user, read=False)
+        up_to_id = request.data.get('up_to_id')
+        if up_to_id not in (None, ''):
+            try:
+                qs = qs.filter(id__lte=int(up_to_id))
+            except (TypeError, ValueError):
+                raise ValidationError({'up_to_id': 'Must be an integer.'})
+        updated = qs.update(read=True)
+        invalidate_unread_count(request.user.id)
+        return Response({'updated': updated})
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        # cached counter, refreshed whenever notifications are written; new
+        # notifications are also pushed as `notification.new` over the WS
+        return Response({'unread_count': get_unread_count(request.user.id)})
 
 
 class CommunityViewSet(viewsets.ModelViewSet):
@@ -163,37 +302,78 @@ class CommunityViewSet(viewsets.ModelViewSet):
     serializer_class = CommunitySerializer
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'feed']:
             return [AllowAny()]
         return [IsAuthenticated()]
 
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        return response_cache.cached_response(
+            request, 'communities:list', response_cache.COMMUNITIES, lambda: build(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        build = super().retrieve
+        pk = kwargs.get(self.lookup_field, '')
+        if not str(pk).isdigit():
+            return build(request, *args, **kwargs)
+        return response_cache.cached_response(
+            request, 'communities:detail', response_cache.community_stamp(pk), lambda: build(request, *args, **kwargs),
+        )
+
     def perform_create(self, serializer):
         # set creator automatically
         comm = serializer.save(created_by=self.request.user)
         # add creator as member by default
         try:
-            comm.members.add(self.request.user)
-            comm.members_count = comm.members.count()
-            comm.save(update_fields=['members_count'])
+            add_member(comm.pk, self.request.user.pk)
         except Exception:
-            pass
+            logger.exception('Could not add creator to community %s', comm.pk)
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def join(self, request, pk=None):
         comm = get_object_or_404(Community, pk=pk)
-        comm.members.add(request.user)
-        comm.members_count = comm.members.count()
-        comm.save(update_fields=['members_count'])
+        add_member(comm.pk, request.user.pk)
         return Response({'joined': True})
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def leave(self, request, pk=None):
         comm = get_object_or_404(Community, pk=pk)
-        comm.members.remove(request.user)
-        comm.members_count = comm.members.count()
-        comm.save(update_fields=['members_count'])
+        remove_member(comm.pk, request.user.pk)
         return Response({'left': True})
 
+    @action(detail=True, methods=['get'])
+    def feed(self, request, pk=None):
+        """Posts of this community from its ranked window (see foro/community_feed.py).
+
+        Query params: ``order`` (``hot`` default, ``new`` or ``top``), ``cursor``
+        (``next`` of a previous response) and ``limit``.
+        """
+        if not str(pk).isdigit():
+            return Response({'detail': 'not found'}, status=status.HTTP_404_NOT_FOUND)
+        return response_cache.cached_response(
+            request, 'communities:feed', response_cache.community_stamp(pk), lambda: self._feed(request, pk),
+            to_cache=response_cache.post_views_stored, on_hit=response_cache.post_views_current,
+        )
+
+    def _feed(self, request, pk):
+        if not Community.objects.filter(pk=pk).exists():
+            return Response({'detail': 'not found'}, status=status.HTTP_404_NOT_FOUND)
+        order = request.query_params.get('order', 'hot')
+        if order not in community_feed.ORDERINGS:
+            return Response({'detail': 'order must be one of hot, new, top'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids, next_cursor = community_feed.feed_page(
+                int(pk), order, cursor=request.query_params.get('cursor'), limit=request.query_params.get('limit'),
+            )
+        except community_feed.InvalidCursor:
+            return Response({'detail': 'invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        # drop posts that moved to another community since they were ranked
+        by_id = with_comment_counts(PostViewSet.queryset.filter(community_id=pk)).in_bulk(ids)
+        posts = [by_id[i] for i in ids if i in by_id]
+        serializer = PostSerializer(posts, many=True, context={'request': request})
+        return Response({'results': serializer.data, 'next': next_cursor})
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def upload_cover(self, request, pk=None):
         """Upload a cover image for the community. Accepts multipart/form-data with file field 'file'."""
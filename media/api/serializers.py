@@ -8,13 +8,21 @@ class MediaSerializer(serializers.ModelSerializer):
     # can upload a file first and attach later (e.g., reference from ChatMessage).
     content_type = serializers.PrimaryKeyRelatedField(queryset=ContentType.objects.all(), required=False, allow_null=True)
     object_id = serializers.IntegerField(required=False, allow_null=True)
+    spectrum = serializers.SerializerMethodField()
+    spectrum_rms = serializers.SerializerMethodField()
 
     class Meta:
         model = Media
         # Incluimos content_type y object_id para poder relacionar la media con otro objeto
-        fields = ("id", "name", "description", "price", "url", "created_at", "content_type", "object_id")
+        fields = ("id", "name", "description", "price", "url", "created_at", "content_type", "object_id", "spectrum", "spectrum_rms")
         read_only_fields = ("id", "created_at")
 
+    def get_spectrum(self, obj):
+        return obj.spectrum_values()
+
+    def get_spectrum_rms(self, obj):
+        return obj.spectrum_rms_values()
+
     def validate(self, data):
         # Si viene content_type/object_id, verificamos que sean de SpecialistProfile o BusinessmanProfile
         ct = data.get('content_type')
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from media.models import Media
 from media.api.serializers import MediaSerializer
 from auth_app.utils.supabase_utils import upload_image_to_supabase, delete_image_from_supabase
+from media.audio import is_audio, schedule_envelope
 import logging
 
 logger = logging.getLogger(__name__)
@@ -86,6 +87,17 @@ class MediaViewSet(viewsets.ModelViewSet):
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
             self.perform_create(serializer)
+            if image and is_audio(getattr(image, 'name', None), getattr(image, 'content_type', None)):
+                # Notas de voz: la envolvente se calcula en el servidor (en un
+                # worker si el archivo es grande) en lugar de confiar en el cliente
+                try:
+                    image.seek(0)
+                    stored = schedule_envelope(serializer.instance.id, image.read(), name=getattr(image, 'name', None), content_type=getattr(image, 'content_type', None))
+                    if stored is True:
+                        # calculada inline: la respuesta debe incluir la envolvente guardada
+                        serializer.instance.refresh_from_db()
+                except Exception:
+                    logger.exception('Failed scheduling audio envelope for media id=%s', getattr(serializer.instance, 'id', None))
             headers = self.get_success_headers(serializer.data)
             # After saving, attempt to read back the created Media and log its description for debugging
             try:
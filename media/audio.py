@@ -0,0 +1,159 @@
+"""Server-side audio envelope for voice notes.
+
+Uploaded WAV files are decoded with the stdlib ``wave`` module and
+OGG/Opus/FLAC through ``soundfile`` when it is installed. The samples are
+folded into a fixed number of buckets with NumPy and reduced to a peak and
+an RMS envelope, each stored as one 0-255 byte per bucket on ``Media``
+(``spectrum`` / ``spectrum_rms``). Files above ``MEDIA_AUDIO_INLINE_MAX_BYTES``
+are handed to a small thread pool so the upload request returns right away.
+"""
+import io
+import logging
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from media.spectrum import SPECTRUM_BINS
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+try:
+    import soundfile
+except Exception:
+    soundfile = None
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.wav', '.wave', '.ogg', '.oga', '.opus', '.flac')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _inline_max_bytes():
+    return int(getattr(settings, 'MEDIA_AUDIO_INLINE_MAX_BYTES', 256 * 1024))
+
+
+def _max_bytes():
+    return int(getattr(settings, 'MEDIA_AUDIO_MAX_BYTES', 20 * 1024 * 1024))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(getattr(settings, 'MEDIA_AUDIO_WORKERS', 2))
+                _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='media-audio')
+    return _executor
+
+
+def is_audio(name=None, content_type=None):
+    if str(content_type or '').startswith('audio/'):
+        return True
+    return str(name or '').lower().endswith(AUDIO_EXTENSIONS)
+
+
+def _decode_wav(raw):
+    with wave.open(io.BytesIO(raw), 'rb') as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        frames = wav.readframes(wav.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / float(1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / float(1 << 31)
+    else:
+        raise ValueError('unsupported WAV sample width: %s' % width)
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def decode_audio(raw, name=None, content_type=None):
+    """Return mono float32 samples in [-1, 1] for ``raw`` audio bytes, or None."""
+    if np is None or not raw:
+        return None
+    if raw[:4] == b'RIFF' and raw[8:12] == b'WAVE':
+        return _decode_wav(raw)
+    if soundfile is None:
+        logger.debug('decode_audio: soundfile not installed, cannot decode name=%s type=%s', name, content_type)
+        return None
+    data, _rate = soundfile.read(io.BytesIO(raw), dtype='float32', always_2d=True)
+    return data.mean(axis=1)
+
+
+def compute_envelope(samples, bins=SPECTRUM_BINS):
+    """Return ``(peak, rms)`` as ``bytes`` of length ``bins`` (0-255 each).
+
+    Samples are zero-padded to a multiple of ``bins`` and reshaped so the
+    per-bucket reductions are single vectorized NumPy calls. Both envelopes
+    are normalised against the loudest bucket peak.
+    """
+    if np is None or samples is None or len(samples) == 0:
+        return None
+    x = np.abs(np.asarray(samples, dtype=np.float32))
+    per_bin = -(-len(x) // bins)
+    x = np.pad(x, (0, per_bin * bins - len(x))).reshape(bins, per_bin)
+    peak = x.max(axis=1)
+    rms = np.sqrt(np.square(x).mean(axis=1))
+    top = float(peak.max())
+    if top <= 0:
+        return bytes(bins), bytes(bins)
+    scale = 255.0 / top
+    return (
+        np.clip(np.rint(peak * scale), 0, 255).astype(np.uint8).tobytes(),
+        np.clip(np.rint(rms * scale), 0, 255).astype(np.uint8).tobytes(),
+    )
+
+
+def store_envelope(media_id, raw, name=None, content_type=None):
+    """Decode ``raw``, compute the envelope and save it on ``Media``. Returns True on success."""
+    from media.models import Media
+
+    try:
+        envelope = compute_envelope(decode_audio(raw, name=name, content_type=content_type))
+    except Exception:
+        logger.exception('store_envelope: could not decode audio media_id=%s name=%s', media_id, name)
+        return False
+    if envelope is None:
+        return False
+    peak, rms = envelope
+    Media.objects.filter(pk=media_id).update(spectrum=peak, spectrum_rms=rms)
+    return True
+
+
+def _store_envelope_job(media_id, raw, name, content_type):
+    try:
+        return store_envelope(media_id, raw, name=name, content_type=content_type)
+    finally:
+        close_old_connections()
+
+
+def schedule_envelope(media_id, raw, name=None, content_type=None):
+    """Compute the envelope inline for small files, in the worker pool otherwise.
+
+    Returns a Future for pooled jobs, the boolean result for inline ones and
+    None when the upload is skipped (not audio, NumPy missing, too large).
+    """
+    if np is None or not raw or not is_audio(name, content_type):
+        return None
+    if len(raw) > _max_bytes():
+        logger.info('schedule_envelope: skipping media_id=%s size=%s over MEDIA_AUDIO_MAX_BYTES', media_id, len(raw))
+        return None
+    if len(raw) <= _inline_max_bytes():
+        return store_envelope(media_id, raw, name=name, content_type=content_type)
+    return _get_executor().submit(_store_envelope_job, media_id, raw, name, content_type)
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:27
+
+from django.db import migrations, models
+
+from media.spectrum import spectrum_from_description
+
+
+def backfill_spectrum(apps, schema_editor):
+    """Parse the JSON spectrum of existing descriptions once."""
+    Media = apps.get_model('media', 'Media')
+    batch = []
+    qs = Media.objects.exclude(description__isnull=True).exclude(description='').values_list('id', 'description')
+    for media_id, description in qs.iterator():
+        spectrum = spectrum_from_description(description)
+        if spectrum is None:
+            continue
+        batch.append(Media(id=media_id, spectrum=spectrum))
+        if len(batch) >= 500:
+            Media.objects.bulk_update(batch, ['spectrum'])
+            batch = []
+    if batch:
+        Media.objects.bulk_update(batch, ['spectrum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0002_make_content_fields_nullable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='spectrum',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_spectrum, migrations.RunPython.noop),
+    ]
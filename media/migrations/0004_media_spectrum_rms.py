@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0003_media_spectrum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='spectrum_rms',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
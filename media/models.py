@@ -3,6 +3,8 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.conf import settings
 
+from media.spectrum import decode_spectrum, spectrum_from_description
+
 
 class Media(models.Model):
     name = models.CharField(max_length=200, null=True, blank=True, default='0')
@@ -15,7 +17,33 @@ class Media(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
     object_id = models.PositiveIntegerField(null=True, blank=True)
     content_object = GenericForeignKey('content_type', 'object_id')
+    # Espectro de audio compacto (un byte 0-255 por bin) calculado una sola vez
+    # al guardar, para no re-parsear `description` en cada historial de chat.
+    spectrum = models.BinaryField(null=True, blank=True, editable=False)
+    # Envolvente RMS calculada en el servidor a partir del audio (media/audio.py).
+    # Cuando existe, `spectrum` también viene del servidor y no se pisa con la
+    # descripción enviada por el cliente.
+    spectrum_rms = models.BinaryField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.name or f"Media {self.pk}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        server_computed = self.spectrum_rms is not None
+        if not server_computed and (update_fields is None or 'description' in update_fields):
+            parsed = spectrum_from_description(self.description)
+            if parsed is not None:
+                self.spectrum = parsed
+                if update_fields is not None and 'spectrum' not in update_fields:
+                    kwargs['update_fields'] = list(update_fields) + ['spectrum']
+        super().save(*args, **kwargs)
+
+    def spectrum_values(self):
+        """Stored spectrum as a list of small ints, or None."""
+        return decode_spectrum(self.spectrum)
+
+    def spectrum_rms_values(self):
+        """Server-computed RMS envelope as a list of small ints, or None."""
+        return decode_spectrum(self.spectrum_rms)
+
@@ -0,0 +1,69 @@
+"""Compact audio spectrum helpers for Media.
+
+Voice notes carry a waveform/spectrum that chat clients render next to the
+player. Clients historically uploaded it as JSON inside
+``Media.description`` and every payload builder re-parsed that string.
+These helpers turn it, once at write time, into a fixed-length ``bytes``
+value (one 0-255 bucket per byte) stored in ``Media.spectrum``.
+"""
+import json
+
+SPECTRUM_BINS = 64
+SPECTRUM_KEYS = ('spectrum', 'media_spectrum', 'audio_spectrum', 'bins')
+
+
+def extract_spectrum(description):
+    """Return the list of spectrum values encoded in a description, or None.
+
+    Accepts a plain JSON list or a JSON object holding the list under one
+    of ``SPECTRUM_KEYS`` (falling back to the first list value).
+    """
+    if not description:
+        return None
+    try:
+        parsed = json.loads(description) if isinstance(description, (str, bytes)) else description
+    except (TypeError, ValueError):
+        return None
+    if isinstance(parsed, list):
+        return parsed
+    if isinstance(parsed, dict):
+        for k in SPECTRUM_KEYS:
+            if isinstance(parsed.get(k), list):
+                return parsed[k]
+        for v in parsed.values():
+            if isinstance(v, list):
+                return v
+    return None
+
+
+def encode_spectrum(values, bins=SPECTRUM_BINS):
+    """Resample ``values`` to ``bins`` buckets (max per bucket) scaled to 0-255."""
+    nums = []
+    for v in values or ():
+        try:
+            nums.append(abs(float(v)))
+        except (TypeError, ValueError):
+            continue
+    if not nums:
+        return None
+    n = len(nums)
+    buckets = []
+    for i in range(bins):
+        start = i * n // bins
+        end = max(start + 1, (i + 1) * n // bins)
+        buckets.append(max(nums[start:min(end, n)] or [0.0]))
+    peak = max(buckets)
+    if peak <= 0:
+        return bytes(bins)
+    return bytes(min(255, int(round(b / peak * 255))) for b in buckets)
+
+
+def decode_spectrum(raw):
+    """Return the stored spectrum as a list of ints (None when absent)."""
+    if raw is None:
+        return None
+    return list(bytes(raw))
+
+
+def spectrum_from_description(description, bins=SPECTRUM_BINS):
+    return encode_spectrum(extract_spectrum(description), bins=bins)
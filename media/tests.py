@@ -1,3 +1,93 @@
-from django.test import TestCase
+import io
+import json
+import math
+import struct
+import wave
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from media import audio
+from media.models import Media
+from media.spectrum import SPECTRUM_BINS, decode_spectrum, encode_spectrum, extract_spectrum
+
+
+class SpectrumTests(TestCase):
+
+    def test_extract_accepts_list_and_known_keys(self):
+        self.assertEqual(extract_spectrum('[1, 2, 3]'), [1, 2, 3])
+        self.assertEqual(extract_spectrum(json.dumps({'bins': [4, 5]})), [4, 5])
+        self.assertIsNone(extract_spectrum('not json'))
+        self.assertIsNone(extract_spectrum('0'))
+
+    def test_encode_resamples_to_fixed_bins(self):
+        raw = encode_spectrum([0.0, 0.5, 1.0] * 50)
+        self.assertEqual(len(raw), SPECTRUM_BINS)
+        values = decode_spectrum(raw)
+        self.assertEqual(max(values), 255)
+        self.assertTrue(all(0 <= v <= 255 for v in values))
+
+    def test_media_save_stores_spectrum_once(self):
+        media = Media.objects.create(name='nota.ogg', description=json.dumps([i % 10 for i in range(64)]))
+        stored = Media.objects.get(pk=media.pk)
+        self.assertEqual(len(stored.spectrum_values()), SPECTRUM_BINS)
+
+        stored.description = json.dumps({'spectrum': [1, 1]})
+        stored.save(update_fields=['description'])
+        self.assertEqual(set(Media.objects.get(pk=media.pk).spectrum_values()), {255})
+
+        plain = Media.objects.create(name='foto.jpg')
+        self.assertIsNone(plain.spectrum_values())
+
+
+def _wav_bytes(samples, rate=8000, channels=1):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b''.join(struct.pack('<h', s) for s in samples))
+    return buf.getvalue()
+
+
+@skipIf(audio.np is None, 'numpy not installed')
+class AudioEnvelopeTests(TestCase):
+
+    def test_wav_envelope_follows_loudness(self):
+        # one second of silence followed by one second of a loud tone
+        tone = [int(20000 * math.sin(2 * math.pi * 440 * i / 8000)) for i in range(8000)]
+        peak, rms = audio.compute_envelope(audio.decode_audio(_wav_bytes([0] * 8000 + tone)))
+        self.assertEqual((len(peak), len(rms)), (SPECTRUM_BINS, SPECTRUM_BINS))
+        half = SPECTRUM_BINS // 2
+        self.assertEqual(max(peak[:half]), 0)
+        self.assertEqual(min(peak[half:]), 255)
+        self.assertTrue(all(150 < v < 255 for v in rms[half:]))
+
+    def test_stereo_is_downmixed(self):
+        samples = audio.decode_audio(_wav_bytes([16384, -16384] * 100, channels=2))
+        self.assertEqual(len(samples), 100)
+        self.assertEqual(float(abs(samples).max()), 0.0)
+
+    @override_settings(MEDIA_AUDIO_INLINE_MAX_BYTES=1024 * 1024)
+    def test_server_envelope_wins_over_client_description(self):
+        media = Media.objects.create(name='nota.wav', description='[1, 1, 1]')
+        raw = _wav_bytes([0] * 4000 + [12000] * 4000)
+        self.assertTrue(audio.schedule_envelope(media.id, raw, name='nota.wav', content_type='audio/wav'))
+
+        media = Media.objects.get(pk=media.pk)
+        self.assertEqual(media.spectrum_values()[0], 0)
+        media.description = '[9, 9, 9]'
+        media.save()
+        self.assertEqual(Media.objects.get(pk=media.pk).spectrum_values()[0], 0)
+        self.assertIsNone(audio.schedule_envelope(media.id, raw, name='foto.jpg', content_type='image/jpeg'))
+
+    @override_settings(MEDIA_AUDIO_INLINE_MAX_BYTES=1024 * 1024)
+    def test_upload_response_includes_inline_envelope(self):
+        upload = SimpleUploadedFile('nota.wav', _wav_bytes([0] * 4000 + [12000] * 4000), content_type='audio/wav')
+        with mock.patch('media.api.views.upload_image_to_supabase', return_value='https://cdn.example.com/nota.wav'):
+            resp = APIClient().post('/api/media/', {'image': upload, 'name': 'nota.wav', 'description': '[9, 9, 9]'})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data['spectrum'], Media.objects.get(pk=resp.data['id']).spectrum_values())
+        self.assertEqual(resp.data['spectrum'][0], 0)
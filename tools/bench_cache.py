@@ -0,0 +1,132 @@
+"""Benchmark tools.cache_utils against a naive get/compute/set cache.
+
+    python tools/bench_cache.py --threads 32 --requests 20000 --keys 500
+    python tools/bench_cache.py --locmem          # without Redis
+
+Threads request keys with a Zipf-like popularity; a miss "computes" by
+sleeping ``--compute-ms``. Every ``--invalidate-every`` requests the
+namespace is invalidated, which makes all keys cold at once (the stampede
+case). For each mode it prints throughput, p50/p95/p99 latency and how many
+times values were computed.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+# Ensure project root is on sys.path so Django settings can be imported
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'consultveterinarias.settings')
+django.setup()
+
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from tools import cache_utils
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'OPTIONS': {'MAX_ENTRIES': 100000}}}
+
+
+def naive_get(key, func, timeout):
+    value = cache.get(key)
+    if value is None:
+        value = func()
+        cache.set(key, value, timeout)
+    return value
+
+
+def run(mode, args):
+    rng = random.Random(args.seed)
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(args.keys)))
+    keys = rng.choices(range(args.keys), cum_weights=cum_weights, k=args.requests)
+    namespace = 'bench:%s:%s' % (mode, time.time_ns())
+    computes = [0]
+    counter_lock = threading.Lock()
+    latencies = []
+    position = [0]
+
+    def compute():
+        with counter_lock:
+            computes[0] += 1
+        time.sleep(args.compute_ms / 1000.0)
+        return b'x' * args.value_bytes
+
+    def worker(out):
+        while True:
+            with counter_lock:
+                i = position[0]
+                position[0] += 1
+                # generation bump (or, for naive, a fresh prefix) every N requests
+                epoch = i // args.invalidate_every if args.invalidate_every else 0
+                if args.invalidate_every and i and i % args.invalidate_every == 0 and mode != 'naive':
+                    cache_utils.invalidate_namespace(namespace)
+            if i >= len(keys):
+                return
+            t0 = time.perf_counter()
+            if mode == 'naive':
+                naive_get('%s:%s:%s' % (namespace, epoch, keys[i]), compute, args.timeout)
+            else:
+                cache_utils.get_or_set_cache(keys[i], compute, timeout=args.timeout, namespace=namespace,
+                                             local=(mode == 'two-tier'))
+            out.append(time.perf_counter() - t0)
+
+    cache_utils.clear_local()
+    cache_utils.reset_stats()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(latencies,)) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def pct(p):
+        return 1000.0 * latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    print(f'{mode:>9}: {len(latencies) / elapsed:8.0f} req/s  p50={pct(0.50):.2f}ms p95={pct(0.95):.2f}ms '
+          f'p99={pct(0.99):.2f}ms computes={computes[0]}')
+    if mode != 'naive':
+        s = cache_utils.stats()
+        print(' ' * 11 + 'hit_ratio=%.3f local_hits=%d hits=%d misses=%d lock_waits=%d early_refreshes=%d' % (
+            s['hit_ratio'], s.get('local_hits', 0), s.get('hits', 0), s.get('misses', 0),
+            s.get('lock_waits', 0), s.get('early_refreshes', 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--keys', type=int, default=200)
+    parser.add_argument('--compute-ms', type=float, default=20.0)
+    parser.add_argument('--value-bytes', type=int, default=2048)
+    parser.add_argument('--timeout', type=int, default=60)
+    parser.add_argument('--invalidate-every', type=int, default=2500, help='0 disables invalidations.')
+    parser.add_argument('--modes', default='naive,shared,two-tier', help='Comma separated: naive, shared, two-tier.')
+    parser.add_argument('--locmem', action='store_true', help='Use an in-process cache instead of CACHES.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f'threads={args.threads} requests={args.requests} keys={args.keys} compute={args.compute_ms}ms '
+          f'backend={"locmem" if args.locmem else "settings.CACHES"}')
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    if args.locmem:
+        with override_settings(CACHES=LOCMEM_CACHE):
+            for mode in modes:
+                run(mode, args)
+    else:
+        for mode in modes:
+            run(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,338 @@
-from django.core.cache import cache
+"""Read-through cache helpers on top of the Django cache (Redis in production).
+
+``get_or_set_cache(key, func)`` returns the cached value or computes it with
+``func``. On top of a plain get/set it adds:
+
+- Namespaces: keys of a namespace embed its generation counter, so
+  ``invalidate_namespace(ns)`` drops the whole group with one INCR.
+- Early refresh (XFetch): as an entry nears its expiry, a request computes
+  it again with a probability that grows with the time ``func`` took, so
+  hot keys are refreshed before they expire instead of all at once after.
+- Single flight: only the request that wins a ``cache.add`` lock (SET NX on
+  Redis, so across processes) recomputes a key; the others keep serving the
+  current value or wait for the new one up to ``CACHE_UTILS_LOCK_WAIT``.
+- Negative caching: ``None`` results are cached too, for
+  ``negative_timeout`` seconds.
+- An optional in-process LRU in front of the shared cache (``local=True``;
+  ``CACHE_UTILS_LOCAL_MAXSIZE`` entries, at most ``CACHE_UTILS_LOCAL_TTL``
+  seconds old). ``invalidate_cache`` only clears it in the calling process:
+  other workers keep serving their copy for up to ``CACHE_UTILS_LOCAL_TTL``,
+  so use it only for values that tolerate that delay. With it, namespace
+  generations are kept locally that long too, so other processes see an
+  ``invalidate_namespace`` within the same delay; without it they see it
+  on their next read.
+- ``stats()``: hit/miss/refresh/lock counters and get/compute latency.
+
+Values are stored pickled by the cache backend (no JSON round trip), so
+anything picklable can be cached. ``python tools/bench_cache.py`` benchmarks it.
+"""
+import logging
+import math
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
 from django.conf import settings
-import json
+from django.core.cache import cache
+
+from tools.middleware.performance import record as record_request
+
+logger = logging.getLogger(__name__)
+
+# entries are (ENVELOPE, value, expires_at, compute_seconds); anything else
+# found under a key (e.g. a JSON string from older code) counts as a miss
+ENVELOPE = 'cache_utils:v2'
+MISSING = object()
+LOCK_POLL = 0.02
+# with the cache down every call fails: one warning per interval, not a traceback each
+ERROR_LOG_INTERVAL = 60.0
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class LocalLRU:
+    """Thread-safe LRU of ``key -> (value, expires_at)`` for one process."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            if item[1] <= time.time():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl):
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local = LocalLRU(int(_setting('CACHE_UTILS_LOCAL_MAXSIZE', 1024)))
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        _stats.update(deltas)
+
+
+_last_error_log = 0.0
+
+
+def _cache_error(message, arg, exc):
+    """Count a cache failure and log it (at most once per ERROR_LOG_INTERVAL)."""
+    global _last_error_log
+    _count(errors=1)
+    now = time.monotonic()
+    if now - _last_error_log >= ERROR_LOG_INTERVAL:
+        _last_error_log = now
+        logger.warning('cache_utils: ' + message + ': %s', arg, exc)
+
+
+def stats():
+    """Counters since start (or ``reset_stats``), with hit ratio and mean latencies in ms."""
+    with _stats_lock:
+        out = dict(_stats)
+    hits = out.get('local_hits', 0) + out.get('hits', 0)
+    lookups = hits + out.get('misses', 0)
+    out['hit_ratio'] = hits / lookups if lookups else 0.0
+    out['avg_get_ms'] = 1000.0 * out.get('get_seconds', 0.0) / lookups if lookups else 0.0
+    computes = out.get('computes', 0)
+    out['avg_compute_ms'] = 1000.0 * out.get('compute_seconds', 0.0) / computes if computes else 0.0
+    return out
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def clear_local():
+    """Drop this process's LRU tier (e.g. between tests)."""
+    _local.clear()
+
+
+def _local_ttl():
+    return float(_setting('CACHE_UTILS_LOCAL_TTL', 5))
+
+
+# ------------------ namespaces ------------------
+
+def _generation_key(namespace):
+    return 'cache_utils:gen:%s' % namespace
+
+
+def generation(namespace, local=False):
+    """Current generation of ``namespace`` (created on first use).
+
+    ``local=True`` reads it through the in-process tier, so it may be up to
+    ``CACHE_UTILS_LOCAL_TTL`` seconds behind another process's invalidation.
+    """
+    key = _generation_key(namespace)
+    if local:
+        gen = _local.get(key)
+        if gen is not MISSING:
+            return gen
+    gen = cache.get(key)
+    if gen is None:
+        # start from the clock, not 0: an evicted counter must not fall back
+        # to a generation whose keys may still be cached
+        cache.add(key, int(time.time() * 1000), None)
+        gen = cache.get(key)
+    if local:
+        _local.set(key, gen, _local_ttl())
+    return gen
 
-def get_or_set_cache(key, func, timeout=None, version=None):
+
+def invalidate_namespace(namespace):
+    """Invalidate every key of ``namespace`` at once; returns the new generation."""
+    key = _generation_key(namespace)
+    try:
+        cache.add(key, int(time.time() * 1000), None)
+        gen = cache.incr(key)
+    except Exception as exc:
+        _cache_error('could not bump generation of %s', namespace, exc)
+        return None
+    _local.set(key, gen, _local_ttl())
+    _count(namespace_invalidations=1)
+    return gen
+
+
+def make_key(key, namespace=None, local=False):
+    if namespace is None:
+        return key
+    return '%s:%s:%s' % (namespace, generation(namespace, local), key)
+
+
+# ------------------ get / set ------------------
+
+def _local_key(key, version):
+    return key if version is None else '%s:%s' % (version, key)
+
+
+def _is_envelope(raw):
+    return isinstance(raw, tuple) and len(raw) == 4 and raw[0] == ENVELOPE
+
+
+def _read(key, version, use_local):
+    """Return ``(envelope, tier)``; envelope is MISSING when absent."""
+    if use_local:
+        env = _local.get(_local_key(key, version))
+        if env is not MISSING:
+            return env, 'local'
+    try:
+        raw = cache.get(key, version=version)
+    except Exception as exc:
+        _cache_error('read failed for %s', key, exc)
+        return MISSING, None
+    if not _is_envelope(raw):
+        return MISSING, None
+    if use_local:
+        _local.set(_local_key(key, version), raw, min(_local_ttl(), raw[2] - time.time()))
+    return raw, 'remote'
+
+
+def _should_refresh(env, beta):
+    # XFetch: refresh when now - delta * beta * ln(U) >= expiry, U in (0, 1]
+    if beta <= 0:
+        return False
+    _, _, expires_at, delta = env
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def _lock_key(key, version):
+    return 'cache_utils:lock:%s' % _local_key(key, version)
+
+
+def _acquire(key, version):
+    try:
+        return cache.add(_lock_key(key, version), 1, int(_setting('CACHE_UTILS_LOCK_TIMEOUT', 10)))
+    except Exception as exc:
+        _cache_error('could not take lock for %s', key, exc)
+        return True  # cache down: compute without coordination
+
+
+def _release(key, version):
+    try:
+        cache.delete(_lock_key(key, version))
+    except Exception as exc:
+        _cache_error('could not release lock for %s', key, exc)
+
+
+def _wait(key, version):
+    deadline = time.monotonic() + float(_setting('CACHE_UTILS_LOCK_WAIT', 2))
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        env, _ = _read(key, version, use_local=False)
+        if env is not MISSING:
+            return env
+    return MISSING
+
+
+def _compute(key, func, timeout, negative_timeout, version, use_local):
+    start = time.perf_counter()
+    value = func() if callable(func) else func
+    delta = time.perf_counter() - start
+    _count(computes=1, compute_seconds=delta)
+    ttl = negative_timeout if value is None else timeout
+    if ttl and ttl > 0:
+        env = (ENVELOPE, value, time.time() + ttl, delta)
+        try:
+            cache.set(key, env, timeout=ttl, version=version)
+        except Exception as exc:
+            _cache_error('write failed for %s', key, exc)
+        if use_local:
+            _local.set(_local_key(key, version), env, min(_local_ttl(), ttl))
+    return value
+
+
+def get_or_set_cache(key, func, timeout=None, version=None, namespace=None,
+                     negative_timeout=None, beta=1.0, local=False):
     """Retrieve value from cache or set it by calling func().
 
-    func may be a callable or a literal value.
+    func may be a callable or a literal value. A ``None`` result is cached
+    for ``negative_timeout`` seconds (``CACHE_UTILS_NEGATIVE_TIMEOUT``, 0
+    disables it). ``beta`` scales early refresh (0 disables it) and
+    ``local=True`` adds the in-process tier, which can serve a value for
+    up to ``CACHE_UTILS_LOCAL_TTL`` after another process invalidated it.
     """
     if timeout is None:
         timeout = getattr(settings, 'DEFAULT_CACHE_TIMEOUT', 300)
-    val = cache.get(key, version=version)
-    if val is not None:
+    if negative_timeout is None:
+        negative_timeout = _setting('CACHE_UTILS_NEGATIVE_TIMEOUT', 30)
+    start = time.perf_counter()
+    try:
+        key = make_key(key, namespace, local)
+    except Exception as exc:
+        _cache_error('could not read generation of %s', namespace, exc)
+        return func() if callable(func) else func
+    env, tier = _read(key, version, local)
+
+    if env is not MISSING:
+        _count(**{'local_hits' if tier == 'local' else 'hits': 1, 'get_seconds': time.perf_counter() - start})
+        record_request(cache_hits=1)
+        if env[1] is None:
+            _count(negative_hits=1)
+        # only the lock holder refreshes early; everybody else keeps the current value
+        if _should_refresh(env, beta) and _acquire(key, version):
+            _count(early_refreshes=1)
+            try:
+                return _compute(key, func, timeout, negative_timeout, version, local)
+            finally:
+                _release(key, version)
+        return env[1]
+
+    _count(misses=1, get_seconds=time.perf_counter() - start)
+    record_request(cache_misses=1)
+    if _acquire(key, version):
         try:
-            return json.loads(val)
-        except Exception:
-            return val
+            return _compute(key, func, timeout, negative_timeout, version, local)
+        finally:
+            _release(key, version)
+    _count(lock_waits=1)
+    env = _wait(key, version)
+    if env is not MISSING:
+        return env[1]
+    _count(lock_timeouts=1)
+    return _compute(key, func, timeout, negative_timeout, version, local)
 
-    # compute value
-    value = func() if callable(func) else func
-    try:
-        store = json.dumps(value)
-    except Exception:
-        store = value
-    cache.set(key, store, timeout=timeout, version=version)
-    return value
 
-def invalidate_cache(key, version=None):
+def invalidate_cache(key, version=None, namespace=None):
+    """Delete one key from the shared cache and this process's LRU tier.
+
+    Other processes' LRU tiers are not reached: with ``local=True`` they may
+    serve the old value for up to ``CACHE_UTILS_LOCAL_TTL`` seconds.
+    """
     try:
+        key = make_key(key, namespace)
+        _local.delete(_local_key(key, version))
         cache.delete(key, version=version)
         return True
     except Exception:
@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+
+
+def _generic_field(model, name):
+    for field in model._meta.private_fields:
+        if isinstance(field, GenericForeignKey) and field.name == name:
+            return field
+    raise ValueError('%s has no GenericForeignKey named %r' % (model.__name__, name))
+
+
+def prefetch_generic(objects, field='content_object', querysets=None):
+    """Resolve a GenericForeignKey on many objects with one query per content type.
+
+    ``objects`` is any iterable of model instances (a page, a list of
+    Reactions/Notifications/Media...). Targets are grouped by content type
+    and each type is fetched with a single ``pk__in`` query, then cached on
+    the GFK so ``obj.content_object`` no longer queries. Missing targets are
+    cached as None. ``querysets`` maps a model class to the queryset to
+    fetch it from (e.g. ``{Post: Post.objects.only('id', 'title')}``).
+
+    Returns ``{(content_type_id, object_id): target}``.
+    """
+    objects = list(objects)
+    if not objects:
+        return {}
+    gfk = _generic_field(type(objects[0]), field)
+    ct_attname = objects[0]._meta.get_field(gfk.ct_field).get_attname()
+    querysets = querysets or {}
+
+    wanted = defaultdict(set)
+    for obj in objects:
+        ct_id = getattr(obj, ct_attname)
+        pk = getattr(obj, gfk.fk_field)
+        if ct_id is not None and pk is not None:
+            wanted[ct_id].add(pk)
+
+    found = {}
+    for ct_id, pks in wanted.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is None:
+            continue  # stale content type (model removed)
+        qs = querysets.get(model, model._base_manager.all())
+        for target in qs.filter(pk__in=pks):
+            found[(ct_id, target.pk)] = target
+
+    for obj in objects:
+        key = (getattr(obj, ct_attname), getattr(obj, gfk.fk_field))
+        gfk.set_cached_value(obj, found.get(key))
+    return found
@@ -0,0 +1,133 @@
+"""In-process metrics: counters, gauges and percentile histograms.
+
+``metrics`` is the process-wide registry fed by the WebSocket
+instrumentation in ``tools/middleware/websocket.py``; ``metrics_view``
+exposes ``metrics.snapshot()`` at ``/api/metrics/ws/`` (staff only).
+Values are per process: with several Daphne workers, each one reports its
+own.
+
+Histograms use fixed log-scale buckets (each ~19% wider than the previous
+one), so recording is O(1) with constant memory and a percentile is
+reported as the upper bound of its bucket: at most ~19% above the true value.
+"""
+import bisect
+import math
+import threading
+
+from django.conf import settings
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+BUCKET_GROWTH = 2 ** 0.25
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def _bounds(low, high):
+    n = int(math.ceil(math.log(high / low, BUCKET_GROWTH)))
+    return [low * BUCKET_GROWTH ** i for i in range(n + 1)]
+
+
+class Histogram:
+    """Log-bucketed histogram of non-negative values in ``[low, high]`` (clamped)."""
+
+    def __init__(self, low=0.01, high=1e8):
+        self.bounds = _bounds(low, high)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self):
+        out = {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'avg': round(self.total / self.count, 3) if self.count else 0.0,
+            'max': round(self.max, 3),
+        }
+        for p in PERCENTILES:
+            out['p%g' % (p * 100)] = round(self.percentile(p), 3)
+        return out
+
+
+class Registry:
+    """Thread-safe named counters, gauges and histograms.
+
+    At most ``METRICS_MAX_SERIES`` histograms are kept; further names are
+    folded into ``<prefix>.other`` so client-controlled names (event types)
+    can't grow it without bound.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.gauges = {}
+        self.reset()
+
+    def reset(self):
+        """Clear counters and histograms.
+
+        Gauges are kept: they track live state (open connections) that is
+        decremented later, so zeroing them would leave them negative.
+        """
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, delta):
+        with self._lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def observe(self, name, value):
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                if len(self.histograms) >= int(getattr(settings, 'METRICS_MAX_SERIES', 200)):
+                    name = name.split('.', 1)[0] + '.other'
+                    hist = self.histograms.get(name)
+                if hist is None:
+                    hist = self.histograms[name] = Histogram()
+            hist.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+            }
+
+
+metrics = Registry()
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """Current WebSocket metrics of this process (``?reset=1`` clears counters and histograms after reading)."""
+    data = metrics.snapshot()
+    if request.query_params.get('reset') in ('1', 'true'):
+        metrics.reset()
+    return Response(data)
@@ -1,31 +1,144 @@
-import time
-from django.utils.deprecation import MiddlewareMixin
+import contextvars
 import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
 
 logger = logging.getLogger(__name__)
 
-class PerformanceMiddleware(MiddlewareMixin):
-    """Simple middleware that records request processing time and logs slow requests.
+_current = contextvars.ContextVar('perf_request_stats', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised (PERFORMANCE_BUDGET_MODE='raise') when a view runs more queries than its budget."""
+
+
+class RequestStats:
+    """Counters of one request: DB queries/time, cache hits/misses and channel-layer sends."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.channel_sends = 0
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - start
+
+
+def current():
+    """Stats of the request being served in this context, or None."""
+    return _current.get()
+
+
+def record(cache_hits=0, cache_misses=0, channel_sends=0):
+    """Add to the current request's counters (no-op outside a request)."""
+    stats = _current.get()
+    if stats is not None:
+        stats.cache_hits += cache_hits
+        stats.cache_misses += cache_misses
+        stats.channel_sends += channel_sends
 
-    To enable, add 'tools.middleware.performance.PerformanceMiddleware' to MIDDLEWARE.
+
+def _counted(method):
+    async def send(*args, **kwargs):
+        record(channel_sends=1)
+        return await method(*args, **kwargs)
+    return send
+
+
+def instrument_channel_layer(layer):
+    """Count ``send``/``group_send`` of ``layer`` towards the current request (once per layer)."""
+    if layer is None or getattr(layer, '_perf_instrumented', False):
+        return layer
+    for name in ('send', 'group_send'):
+        if hasattr(layer, name):
+            setattr(layer, name, _counted(getattr(layer, name)))
+    layer._perf_instrumented = True
+    return layer
+
+
+def _channel_layer():
+    try:
+        from channels.layers import get_channel_layer
+        return get_channel_layer()
+    except Exception:
+        return None
+
+
+class PerformanceMiddleware:
+    """Per-request profiling: wall time, DB queries/time, cache and channel-layer activity.
+
+    Adds a ``Server-Timing`` header (plus the older ``X-Perf-Time-ms``), logs
+    requests slower than PERFORMANCE_SLOW_REQUEST_MS and checks
+    PERFORMANCE_QUERY_BUDGETS (``{'METHOD url-name' or 'url-name': max
+    queries}``, e.g. ``'GET foro-posts-list': 6``). Over budget it logs a
+    warning or, with PERFORMANCE_BUDGET_MODE='raise' (the default under
+    ``manage.py test``), raises QueryBudgetExceeded so N+1 regressions fail
+    the tests.
+
+    Cache layers report hits/misses with ``record()``; channel-layer sends
+    are counted by wrapping the layer's ``send``/``group_send``.
     """
-    def process_request(self, request):
-        request._perf_start = time.time()
-
-    def process_response(self, request, response):
-        start = getattr(request, '_perf_start', None)
-        if start is not None:
-            elapsed = (time.time() - start) * 1000.0
-            # attach header for diagnostics
-            try:
-                response['X-Perf-Time-ms'] = f"{elapsed:.2f}"
-            except Exception:
-                pass
-            # log slow requests
-            if elapsed > 500:  # ms
-                logger.warning('Slow request', extra={
-                    'path': getattr(request, 'path', None),
-                    'method': getattr(request, 'method', None),
-                    'time_ms': elapsed
-                })
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            instrument_channel_layer(_channel_layer())
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(stats.db_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        self._add_headers(response, stats, elapsed)
+        if elapsed > getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 500):
+            logger.warning('Slow request', extra={
+                'path': getattr(request, 'path', None),
+                'method': getattr(request, 'method', None),
+                'time_ms': elapsed,
+                'queries': stats.queries,
+                'db_ms': stats.db_seconds * 1000.0,
+            })
+        self._check_budget(request, stats)
         return response
+
+    def _add_headers(self, response, stats, elapsed):
+        try:
+            response['X-Perf-Time-ms'] = f"{elapsed:.2f}"
+            response['Server-Timing'] = ', '.join([
+                f'total;dur={elapsed:.2f}',
+                f'db;dur={stats.db_seconds * 1000.0:.2f};desc="{stats.queries} queries"',
+                f'cache;desc="{stats.cache_hits} hits {stats.cache_misses} misses"',
+                f'channels;desc="{stats.channel_sends} sends"',
+            ])
+        except Exception:
+            pass
+
+    def _check_budget(self, request, stats):
+        match = getattr(request, 'resolver_match', None)
+        name = getattr(match, 'view_name', None)
+        budgets = getattr(settings, 'PERFORMANCE_QUERY_BUDGETS', {})
+        budget = budgets.get('%s %s' % (request.method, name), budgets.get(name))
+        if budget is None or stats.queries <= budget:
+            return
+        msg = '%s %s ran %d queries (budget %d for %s)' % (request.method, request.path, stats.queries, budget, name)
+        if getattr(settings, 'PERFORMANCE_BUDGET_MODE', 'log') == 'raise':
+            raise QueryBudgetExceeded(msg)
+        logger.warning('Query budget exceeded: %s', msg)
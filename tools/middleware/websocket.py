@@ -0,0 +1,102 @@
+"""WebSocket instrumentation feeding ``tools.metrics.metrics``.
+
+- ``WebSocketMetricsMiddleware`` wraps the ``websocket`` branch of the ASGI
+  ``ProtocolTypeRouter`` (outermost, so authentication is included) and
+  records handshake time until ``websocket.accept`` (``ws.handshake_ms``),
+  rejected handshakes, open connections, connection lifetime and outbound
+  frames/bytes (``ws.frame_bytes``, ``ws.outbound_bytes``).
+- ``TimedDispatchMixin`` goes first in a consumer's bases and times every
+  handler it dispatches: channel-layer events as
+  ``ws.handler.<handler>`` (``chat_message``, ``message_update``...) and
+  JSON frames from the client as ``ws.receive_json.<type>``, in ms.
+
+Both are no-ops with ``WS_METRICS_ENABLED = False``.
+"""
+import re
+import time
+
+from channels.exceptions import StopConsumer
+from django.conf import settings
+
+from tools.metrics import metrics
+
+_EVENT_NAME_RE = re.compile(r'^[A-Za-z0-9_.]{1,48}$')
+
+
+def enabled():
+    return bool(getattr(settings, 'WS_METRICS_ENABLED', True))
+
+
+def _frame_size(message):
+    if message.get('bytes') is not None:
+        return len(message['bytes'])
+    return len((message.get('text') or '').encode('utf-8'))
+
+
+class WebSocketMetricsMiddleware:
+    """ASGI middleware measuring handshakes and outbound traffic of WebSocket connections."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        if scope.get('type') != 'websocket' or not enabled():
+            return await self.inner(scope, receive, send)
+        start = time.perf_counter()
+        state = {'accepted_at': None}
+
+        async def metered_send(message):
+            kind = message.get('type')
+            if kind == 'websocket.send':
+                size = _frame_size(message)
+                metrics.incr('ws.outbound_frames')
+                metrics.incr('ws.outbound_bytes', size)
+                metrics.observe('ws.frame_bytes', size)
+            elif kind == 'websocket.accept' and state['accepted_at'] is None:
+                state['accepted_at'] = time.perf_counter()
+                metrics.observe('ws.handshake_ms', (state['accepted_at'] - start) * 1000.0)
+                metrics.incr('ws.accepted')
+                metrics.gauge('ws.open_connections', 1)
+            elif kind == 'websocket.close' and state['accepted_at'] is None:
+                metrics.incr('ws.rejected')
+            await send(message)
+
+        try:
+            return await self.inner(scope, receive, metered_send)
+        finally:
+            if state['accepted_at'] is not None:
+                metrics.gauge('ws.open_connections', -1)
+                metrics.observe('ws.connection_seconds', time.perf_counter() - state['accepted_at'])
+
+
+class TimedDispatchMixin:
+    """Consumer mixin timing each dispatched handler into ``tools.metrics``."""
+
+    _metrics_event = None
+
+    async def decode_json(self, text_data):
+        content = await super().decode_json(text_data)
+        # remembered so dispatch can name the timing after the frame's type
+        event = content.get('type') if isinstance(content, dict) else None
+        self._metrics_event = event if isinstance(event, str) and _EVENT_NAME_RE.match(event) else 'unknown'
+        return content
+
+    async def dispatch(self, message):
+        if not enabled():
+            return await super().dispatch(message)
+        self._metrics_event = None
+        start = time.perf_counter()
+        try:
+            return await super().dispatch(message)
+        except StopConsumer:
+            raise  # normal end of a connection
+        except Exception:
+            metrics.incr('ws.handler_errors')
+            raise
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            if message.get('type') == 'websocket.receive' and self._metrics_event:
+                name = 'ws.receive_json.%s' % self._metrics_event
+            else:
+                name = 'ws.handler.%s' % str(message.get('type', 'unknown')).replace('.', '_')
+            metrics.observe(name, elapsed)
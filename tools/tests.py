@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from tools import cache_utils
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, CACHE_UTILS_LOCK_WAIT=2)
+class CacheUtilsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        cache_utils.clear_local()
+        self.calls = []
+
+    def _func(self, value):
+        def compute():
+            self.calls.append(value)
+            return value
+        return compute
+
+    def test_none_is_cached_within_negative_timeout(self):
+        self.assertIsNone(cache_utils.get_or_set_cache('k', self._func(None), negative_timeout=30))
+        self.assertIsNone(cache_utils.get_or_set_cache('k', self._func(1), negative_timeout=30))
+        self.assertEqual(self.calls, [None])
+
+    def test_invalidate_namespace_drops_its_keys(self):
+        cache_utils.get_or_set_cache('k', self._func(1), namespace='ns', beta=0)
+        cache_utils.invalidate_namespace('ns')
+        self.assertEqual(cache_utils.get_or_set_cache('k', self._func(2), namespace='ns', beta=0), 2)
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_namespace_invalidation_from_another_process_is_seen_without_local_tier(self):
+        cache_utils.get_or_set_cache('k', self._func(1), namespace='ns', beta=0)
+        cache.incr(cache_utils._generation_key('ns'))  # another worker's invalidate_namespace
+        self.assertEqual(cache_utils.get_or_set_cache('k', self._func(2), namespace='ns', beta=0), 2)
+        # the local tier may lag behind it by up to CACHE_UTILS_LOCAL_TTL
+        cache_utils.get_or_set_cache('k', self._func(2), namespace='ns', beta=0, local=True)
+        cache.incr(cache_utils._generation_key('ns'))
+        self.assertEqual(cache_utils.get_or_set_cache('k', self._func(3), namespace='ns', beta=0, local=True), 2)
+
+    def test_concurrent_misses_compute_once(self):
+        import threading
+        import time
+
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.3)
+            self.calls.append(1)
+            return 1
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache_utils.get_or_set_cache('k', slow, beta=0)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait(1)
+        for t in threads[1:]:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [1, 1, 1, 1])
+        self.assertEqual(self.calls, [1])
+
+    def test_local_lru_evicts_oldest_at_maxsize(self):
+        lru = cache_utils.LocalLRU(maxsize=2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')  # 'b' is now the least recently used
+        lru.set('c', 3, 60)
+        self.assertEqual(len(lru), 2)
+        self.assertIs(lru.get('b'), cache_utils.MISSING)
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+
+    def test_waiter_that_times_out_leaves_the_owners_lock(self):
+        lock = cache_utils._lock_key('k', None)
+        cache.add(lock, 1, 5)  # another worker is computing it
+        with mock.patch.object(cache_utils, '_wait', return_value=cache_utils.MISSING):
+            self.assertEqual(cache_utils.get_or_set_cache('k', self._func(1)), 1)
+        self.assertIsNotNone(cache.get(lock))
+
+    def test_cache_outage_logs_one_warning(self):
+        with mock.patch.object(cache_utils, '_last_error_log', 0.0), \
+                mock.patch.object(cache_utils.cache, 'get', side_effect=ConnectionError('down')), \
+                mock.patch.object(cache_utils.cache, 'set', side_effect=ConnectionError('down')), \
+                self.assertLogs('tools.cache_utils', 'WARNING') as logs:
+            for i in range(3):
+                self.assertEqual(cache_utils.get_or_set_cache('k', self._func(i)), i)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIsNone(logs.records[0].exc_info)
+
+    def test_legacy_json_entry_reads_as_miss(self):
+        cache.set('k', '{"old": true}')
+        self.assertEqual(cache_utils.get_or_set_cache('k', self._func({'new': True})), {'new': True})
+        self.assertEqual(self.calls, [{'new': True}])